@@ -5,6 +5,23 @@ import struct
 import time
 import select
 
+# Hosts resolved during the current ping / traceroute: every packet used to resolve its target again, a 4 packet ping
+# did 5 lookups and a traceroute 2 per hop. sendPing() and traceRoute() start with an empty memo, so every run still
+# sees the current address like a plain gethostbyname, just once instead of once per packet
+_resolvedHosts = {}
+
+
+def resolveHost(host):
+    address = _resolvedHosts.get(host)
+    if address is None:
+        address = _resolvedHosts[host] = gethostbyname(host)
+    return address
+
+
+def forgetResolvedHosts():
+    _resolvedHosts.clear()
+
+
 # Class IcmpHelperLibrary                                                                                              
 class IcmpHelperLibrary:
     
@@ -60,7 +77,7 @@ class IcmpHelperLibrary:
 
             # Only attempt to get destination address if it is not whitespace
             if len(self.__icmpTarget.strip()) > 0:
-                self.__destinationIpAddress = gethostbyname(self.__icmpTarget.strip())
+                self.__destinationIpAddress = resolveHost(self.__icmpTarget.strip())
 
         def setIcmpType(self, icmpType):
             self.__icmpType = icmpType
@@ -567,7 +584,7 @@ class IcmpHelperLibrary:
         packetsReceived = 0
         rtts = []
         
-        print(f"PING {host} ({gethostbyname(host)})")
+        print(f"PING {host} ({resolveHost(host)})")
         print()
 
         for i in range(4):
@@ -613,7 +630,7 @@ class IcmpHelperLibrary:
     def __sendIcmpTraceRoute(self, host):
         print("sendIcmpTraceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
         
-        print(f"TRACEROUTE to {host} ({gethostbyname(host)})")
+        print(f"TRACEROUTE to {host} ({resolveHost(host)})")
         print()
         
         consecutiveTimeouts = 0
@@ -664,7 +681,7 @@ class IcmpHelperLibrary:
     def __sendTracerouteProbe(self, icmpPacket, timeout):
         mySocket = None
         try:
-            destinationIp = gethostbyname(icmpPacket.getIcmpTarget().strip())
+            destinationIp = resolveHost(icmpPacket.getIcmpTarget().strip())
             mySocket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)
             mySocket.settimeout(timeout / 1000.0)  # Convert to seconds
             mySocket.bind(("", 0))
@@ -717,10 +734,12 @@ class IcmpHelperLibrary:
 
     def sendPing(self, targetHost):
         print("ping Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        forgetResolvedHosts()
         self.__sendIcmpEchoRequest(targetHost)
 
     def traceRoute(self, targetHost):
         print("traceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+        forgetResolvedHosts()
         self.__sendIcmpTraceRoute(targetHost)
 
 
@@ -0,0 +1,305 @@
+# asyncio bulk fetcher: thousands of URLs over a bounded number of keep-alive connections
+# http_client_lib.py fetches one path per blocking call, fine for the lab but one slow server stalls everything
+# behind it. fetch_all() runs a list of URLs on one event loop instead:
+# - at most `concurrency` requests in flight overall and at most `per_host` per (host, port), a URL waits for
+#   its host's slot before it takes a global one, so a busy host never holds slots other hosts could use
+# - every host keeps its open connections between requests, like http_pool.py, and a GET that fails on a
+#   reused connection is retried once on a new one
+# - requests are built by build_request() and responses framed like read_response(): same head parsing,
+#   Content-Length, chunked or until-close body, so both clients agree on what a response is
+# - results come back as an async iterator in completion order, the caller can handle the first ones while
+#   the rest are still on the wire
+# - every result has a RequestTiming (http_timing.py), `timings` has the histograms. first_byte is stamped when
+#   the response head is complete, asyncio streams do not say when the first byte came in
+#
+# run this file directly for a throughput vs concurrency benchmark against a local server
+
+import asyncio
+
+from dns_cache import aresolve
+from http_client_lib import (MAX_HEAD_BYTES, RECV_SIZE, HttpResponseError, build_request, has_body, parse_chunk_size,
+                             parse_head, split_url)
+from http_timing import RequestTiming, TimingHistograms, clock
+
+CONCURRENCY = 64
+PER_HOST = 8
+
+
+class FetchResult:
+    def __init__(self, url, response=None, error=None, timing=None):
+        self.url = url
+        self.response = response            # HttpResponse, None when the fetch failed
+        self.error = error                  # the exception that failed it
+        self.timing = timing                # RequestTiming from getting a slot on, also for failed fetches
+
+    @property
+    def elapsed(self):
+        timing = self.timing
+        return timing.last_byte - timing.start if timing is not None and timing.last_byte is not None else 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+async def _read_head(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HttpResponseError("response head too large")
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("server closed the connection before the response headers")
+    return parse_head(head)
+
+
+async def _read_exactly(reader, count):
+    try:
+        return await reader.readexactly(count)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("server closed the connection mid response")
+
+
+async def _read_line(reader):
+    try:
+        return (await reader.readuntil(b"\r\n"))[:-2]
+    except asyncio.LimitOverrunError:
+        raise HttpResponseError("chunk size line too long")
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("server closed the connection mid response")
+
+
+# read_response() for an asyncio StreamReader
+async def read_response_async(reader, method="GET", timing=None):
+    response = await _read_head(reader)
+    if timing is not None:
+        timing.first_byte = clock()
+    while 100 <= response.status < 200 and response.status != 101:
+        response = await _read_head(reader)
+    response.timing = timing
+    if not has_body(response, method):
+        if timing is not None:
+            timing.last_byte = clock()
+        return response
+
+    headers = response.headers
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = bytearray()
+        while True:
+            line = await _read_line(reader)
+            response.wire_bytes += len(line) + 2
+            size = parse_chunk_size(line)
+            if size == 0:
+                break
+            body += await _read_exactly(reader, size)
+            if await _read_exactly(reader, 2) != b"\r\n":
+                raise HttpResponseError("missing CRLF after chunk")
+            response.wire_bytes += size + 2
+        while True:
+            line = await _read_line(reader)
+            response.wire_bytes += len(line) + 2
+            if not line:
+                break
+        response.body = bytes(body)
+    elif "content-length" in headers:
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HttpResponseError("bad Content-Length")
+        response.body = await _read_exactly(reader, length)
+        response.wire_bytes += length
+    else:
+        response.body = await reader.read()
+        response.wire_bytes += len(response.body)
+    if timing is not None:
+        timing.last_byte = clock()
+    return response
+
+
+class _Host:
+    def __init__(self, per_host):
+        self.slots = asyncio.Semaphore(per_host)
+        self.idle = []                      # [(reader, writer)], most recently used last
+
+
+class AsyncFetcher:
+    def __init__(self, concurrency=CONCURRENCY, per_host=PER_HOST, timeout=None, headers=()):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout              # per request, connect included
+        self.headers = headers
+        self.hosts = {}                     # {(host, port): _Host}
+        self.slots = None                   # created on the running loop
+        self.connections = 0
+        self.reused = 0
+        self.timings = TimingHistograms()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # async iterator of FetchResult, in the order they finish. failed fetches are results too, nothing is raised
+    async def fetch_all(self, urls):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        results = asyncio.Queue()
+        tasks = set()
+        for url in urls:
+            task = asyncio.ensure_future(self._fetch_into(url, results))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        try:
+            for i in range(len(tasks)):
+                yield await results.get()
+        finally:
+            # the caller stopped iterating early
+            for task in list(tasks):
+                task.cancel()
+
+    # (response, RequestTiming), `timing` is filled in even when this raises
+    async def fetch(self, url, timing=None):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        host, port, path = split_url(url)
+        key = (host, port)
+        state = self.hosts.get(key)
+        if state is None:
+            state = self.hosts[key] = _Host(self.per_host)
+        request = build_request(host, path, self.headers, keep_alive=True)
+        # host slot first, see the top of the file
+        async with state.slots, self.slots:
+            if timing is None:
+                timing = RequestTiming()
+            else:
+                timing.start = clock()
+            exchange = self._exchange(key, state, request, timing)
+            if self.timeout is None:
+                response = await exchange
+            else:
+                response = await asyncio.wait_for(exchange, self.timeout)
+            self.timings.add(timing)
+            return response, timing
+
+    async def _fetch_into(self, url, results):
+        timing = RequestTiming()
+        try:
+            response, timing = await self.fetch(url, timing)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await results.put(FetchResult(url, error=error, timing=timing))
+        else:
+            await results.put(FetchResult(url, response, timing=timing))
+
+    async def _exchange(self, key, state, request, timing):
+        while state.idle:
+            reader, writer = state.idle.pop()
+            if reader.at_eof() or writer.is_closing():
+                writer.close()
+                continue
+            self.reused += 1
+            timing.reuse()
+            try:
+                return await self._send(key, state, reader, writer, request, timing)
+            except (ConnectionError, OSError):
+                # the server closed the idle connection under us, try a new one
+                writer.close()
+                break
+        # resolved through the shared DNS cache, separately from the connect so the two are timed apart
+        timing.reused = False
+        address = await aresolve(key[0])
+        timing.resolved = clock()
+        reader, writer = await asyncio.open_connection(address, key[1], limit=max(MAX_HEAD_BYTES, RECV_SIZE))
+        timing.connected = clock()
+        self.connections += 1
+        try:
+            return await self._send(key, state, reader, writer, request, timing)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _send(self, key, state, reader, writer, request, timing):
+        timing.send_start = clock()
+        writer.write(request)
+        await writer.drain()
+        timing.sent = clock()
+        try:
+            response = await read_response_async(reader, timing=timing)
+        except BaseException:
+            writer.close()
+            raise
+        if response.keep_alive():
+            state.idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def close(self):
+        for state in self.hosts.values():
+            while state.idle:
+                reader, writer = state.idle.pop()
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (ConnectionError, OSError):
+                    pass
+
+
+# convenience wrapper: async for result in fetch_all(urls): ...
+async def fetch_all(urls, concurrency=CONCURRENCY, per_host=PER_HOST, timeout=None):
+    async with AsyncFetcher(concurrency, per_host, timeout) as fetcher:
+        async for result in fetcher.fetch_all(urls):
+            yield result
+
+
+if __name__ == "__main__":
+    import argparse
+    import threading
+
+    from http_server import HttpServer
+
+    class SlowServer(HttpServer):
+        # every response is held back `delay` seconds, like a server on the other side of the internet.
+        # the wait is an async generator body, so the selector loop keeps serving other connections meanwhile
+        def __init__(self, *args, delay=0.0, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.delay = delay
+
+        def handle_request(self, request):
+            status, headers, body = super().handle_request(request)
+            if not self.delay or not isinstance(body, bytes):
+                return status, headers, body
+
+            async def delayed():
+                await asyncio.sleep(self.delay)
+                yield body
+            return status, headers, delayed()
+
+    parser = argparse.ArgumentParser(description="Async bulk fetch throughput vs concurrency")
+    parser.add_argument("--urls", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,4,16,64,256")
+    parser.add_argument("--delay-ms", type=float, default=10.0, help="latency the local server adds to every response")
+    parser.add_argument("--url", default=None, help="fetch this URL instead of starting a local server")
+    args = parser.parse_args()
+
+    if args.url is None:
+        server = SlowServer("127.0.0.1", 0, log_requests=False, delay=args.delay_ms / 1000)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.url = f"http://127.0.0.1:{server.port}/"
+
+    async def run(concurrency):
+        # one host, so the per-host limit is the concurrency itself
+        count = 0
+        failed = 0
+        start = clock()
+        async for result in fetch_all([args.url] * args.urls, concurrency, per_host=concurrency):
+            count += 1
+            failed += not result.ok
+        return count, failed, clock() - start
+
+    print(f"{args.urls} GETs of {args.url}")
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        count, failed, elapsed = asyncio.run(run(concurrency))
+        print(f"concurrency {concurrency:>4}: {count / elapsed:9.1f} requests/sec  {failed} failed")
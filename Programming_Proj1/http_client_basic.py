@@ -3,12 +3,23 @@
 # 2. connects to the provided server 
 # 3. sends an HTTP GET request for a particular file that is contained within the server
 # 4. recieve the HTTP response from the server and print it to the terminal for the user to view
+# (the response is read with http_client_lib.read_response so it is not cut off after the first 4096 bytes,
+#  it reads the headers and then exactly Content-Length bytes or the chunks of a chunked body)
+# with --cache DIR the response is kept on disk between runs, a rerun is served from there or revalidated with a
+# conditional GET (http_client_cache.py)
 
 # ***I USED THE OFFICIAL PYTHON MANUAL AND WATCHED some youtube videos on the topics if I was still a bit confuesed *** -> ontop of textbook examples and notes that were provided
 
 
 
-import socket 
+import argparse
+
+from http_client_cache import HttpCache
+from http_client_lib import connect, read_response
+
+parser = argparse.ArgumentParser(description="Basic HTTP client")
+parser.add_argument("--cache", default=None, metavar="DIR", help="keep responses in this directory between runs")
+args = parser.parse_args()
 
 #define the host url 
 host = "gaia.cs.umass.edu"
@@ -20,19 +31,27 @@ request = f"GET {path} HTTP/1.1\r\nHost:{host}\r\n\r\n"
 
 print(f"Request: {request}")
 
-# creating the TCP socket and connecting to the server
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.connect((host, port))
+if args.cache is not None:
+    cache = HttpCache(args.cache)
+    response = cache.get(f"http://{host}:{port}{path}")
+    cache.close()
+    print(f"-----Server Response ({response.cache_status})-----\n")
+    print((response.head + response.body).decode(errors='replace'))
+    raise SystemExit(0)
+
+# creating the TCP socket (AF_INET / SOCK_STREAM) and connecting to the server, the host name is looked up
+# through the shared DNS cache
+sock = connect(host, port)
 
 #send the http connection request
 sock.send(request.encode()) #converts the string object to bytes 
 
-#recieve the servers response (also in bytes of information)
-response = sock.recv(4096)
+#recieve the servers response (also in bytes of information), the whole response and not only the first recv
+response = read_response(sock)
 
 #print the network response as a decoded string 
 print("-----Server Response-----\n")
-print(response.decode(errors='replace'))
+print((response.head + response.body).decode(errors='replace'))
 
 #close the socket connection
 sock.close()
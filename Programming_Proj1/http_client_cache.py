@@ -0,0 +1,338 @@
+# on-disk HTTP cache for the clients, keyed by URL
+# a second run of a client script downloads everything again even when nothing changed. HttpCache keeps
+# responses on disk between runs and follows the HTTP caching rules (RFC 9111, the parts a private client needs):
+# - only 200 responses to GET are stored, never ones with Cache-Control: no-store
+# - a stored response is fresh for Cache-Control max-age (minus the Age it already had), or until Expires;
+#   fresh hits never touch the network
+# - a stale response (or one with no-cache) is revalidated with If-None-Match / If-Modified-Since. a 304 costs
+#   one small head on the wire, the body comes from disk and the stored headers are refreshed
+# - responses without freshness information or a validator are not worth storing
+# - the cache holds at most max_bytes of bodies, least recently used entries go first
+#
+# every entry is two files named after the SHA-256 of the URL: <key>.json (status, headers, freshness) and
+# <key>.body. both are written to a temp file and renamed, a crash never leaves half an entry behind
+#
+# run this file directly for a repeated-crawl benchmark against a local server
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from http_client_lib import HttpResponse, split_url
+from http_pool import HttpClient
+
+MAX_BYTES = 256 * 1024 * 1024
+
+
+def parse_cache_control(value):
+    directives = {}
+    for part in value.split(","):
+        name, sep, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if sep else None
+    return directives
+
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+# absolute time the response stops being fresh, from its headers and the time it was received
+def expires_at(headers, received):
+    directives = parse_cache_control(headers.get("cache-control", ""))
+    if "no-cache" in directives:
+        return received
+    if "max-age" in directives:
+        try:
+            max_age = int(directives["max-age"])
+        except (TypeError, ValueError):
+            return received
+        try:
+            age = int(headers.get("age", "0"))
+        except ValueError:
+            age = 0
+        return received + max_age - age
+    if "expires" in headers:
+        expires = _http_date(headers["expires"])
+        if expires is None:
+            # an invalid Expires means already expired
+            return received
+        # judged against the server's clock, not ours
+        date = _http_date(headers.get("date", "")) or received
+        return received + expires - date
+    return received
+
+
+def storable(method, response):
+    if method != "GET" or response.status != 200:
+        return False
+    directives = parse_cache_control(response.headers.get("cache-control", ""))
+    if "no-store" in directives:
+        return False
+    headers = response.headers
+    return "etag" in headers or "last-modified" in headers or "max-age" in directives or "expires" in headers
+
+
+def _head_bytes(version, status, reason, headers):
+    lines = [f"{version} {status} {reason}"] + [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class CacheEntry:
+    def __init__(self, url, version, status, reason, headers, received, expires, size):
+        self.url = url
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.received = received
+        self.expires = expires
+        self.size = size                    # body bytes on disk
+
+    def fresh(self, now):
+        return now < self.expires
+
+    def to_json(self):
+        return {"url": self.url, "version": self.version, "status": self.status, "reason": self.reason,
+                "headers": self.headers, "received": self.received, "expires": self.expires, "size": self.size}
+
+
+class HttpCache:
+    def __init__(self, directory, max_bytes=MAX_BYTES, client=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.client = client if client is not None else HttpClient()
+        self.entries = OrderedDict()        # {key: CacheEntry}, least recently used first
+        self.size = 0
+
+        self.hits = 0                       # fresh, served from disk without a request
+        self.revalidated = 0                # stale, the server said 304
+        self.misses = 0
+        self.stored = 0
+        self.evictions = 0
+        self.network_bytes = 0              # response bytes that came over the wire
+        self.saved_bytes = 0                # body bytes served from disk instead
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # entries of earlier runs, in the order they were last used (the .json mtime is touched on every use)
+    def _load(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                entry = CacheEntry(**data)
+                if os.path.getsize(self._body_path(key)) != entry.size:
+                    raise ValueError("body size mismatch")
+                found.append((os.path.getmtime(path), key, entry))
+            except (OSError, ValueError, TypeError):
+                self._delete_files(key)
+        for mtime, key, entry in sorted(found, key=lambda item: item[0]):
+            self.entries[key] = entry
+            self.size += entry.size
+        self._evict()
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _body_path(self, key):
+        return os.path.join(self.directory, key + ".body")
+
+    def _write_atomic(self, path, data):
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def _delete_files(self, key):
+        for path in (self._meta_path(key), self._body_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _response(self, entry, body):
+        return HttpResponse(entry.version, entry.status, entry.reason, dict(entry.headers),
+                            _head_bytes(entry.version, entry.status, entry.reason, entry.headers), body)
+
+    def _read_body(self, key):
+        with open(self._body_path(key), "rb") as f:
+            return f.read()
+
+    def _touch(self, key):
+        self.entries.move_to_end(key)
+        try:
+            os.utime(self._meta_path(key))
+        except OSError:
+            pass
+
+    # GET `url`, from disk when the cache allows it. response.cache_status is "hit", "revalidated" or "miss"
+    def get(self, url, headers=()):
+        key = self.key(url)
+        entry = self.entries.get(key)
+        now = time.time()
+        if entry is not None and entry.fresh(now):
+            try:
+                body = self._read_body(key)
+            except OSError:
+                self.remove(key)
+            else:
+                self._touch(key)
+                self.hits += 1
+                self.saved_bytes += len(body)
+                response = self._response(entry, body)
+                response.cache_status = "hit"
+                return response
+            entry = None
+
+        request_headers = list(headers)
+        if entry is not None:
+            if "etag" in entry.headers:
+                request_headers.append(("If-None-Match", entry.headers["etag"]))
+            if "last-modified" in entry.headers:
+                request_headers.append(("If-Modified-Since", entry.headers["last-modified"]))
+
+        host, port, path = split_url(url)
+        response = self.client.request("GET", host, port, path, request_headers)
+        received = time.time()
+        self.network_bytes += response.wire_bytes
+
+        if entry is not None and response.status == 304:
+            try:
+                body = self._read_body(key)
+            except OSError:
+                # the body vanished, ask again without validators
+                self.remove(key)
+                return self.get(url, headers)
+            # the 304 carries the current Cache-Control/Expires/ETag/Date, the rest stays as stored
+            entry.headers.update({name: value for name, value in response.headers.items()
+                                  if name not in ("content-length", "transfer-encoding", "connection")})
+            entry.received = received
+            entry.expires = expires_at(entry.headers, received)
+            self._write_atomic(self._meta_path(key), json.dumps(entry.to_json()).encode())
+            self.entries.move_to_end(key)
+            self.revalidated += 1
+            self.saved_bytes += len(body)
+            cached = self._response(entry, body)
+            cached.wire_bytes = response.wire_bytes
+            cached.cache_status = "revalidated"
+            return cached
+
+        self.misses += 1
+        if storable("GET", response):
+            self.store(key, url, response, received)
+        elif entry is not None:
+            self.remove(key)
+        response.cache_status = "miss"
+        return response
+
+    def store(self, key, url, response, received):
+        if len(response.body) > self.max_bytes:
+            # too big to keep, but whatever was stored for the URL before is out of date now
+            self.remove(key)
+            return
+        headers = {name: value for name, value in response.headers.items()
+                   if name not in ("transfer-encoding", "connection", "keep-alive")}
+        # the body is stored decoded from its chunks, so its length is known now
+        headers["content-length"] = str(len(response.body))
+        entry = CacheEntry(url, response.version, response.status, response.reason, headers, received,
+                           expires_at(headers, received), len(response.body))
+        self.remove(key)
+        self._write_atomic(self._body_path(key), response.body)
+        self._write_atomic(self._meta_path(key), json.dumps(entry.to_json()).encode())
+        self.entries[key] = entry
+        self.size += entry.size
+        self.stored += 1
+        self._evict()
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+        self._delete_files(key)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self.remove(key)
+            self.evictions += 1
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        lookups = self.hits + self.revalidated + self.misses
+        return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits,
+                "revalidated": self.revalidated, "misses": self.misses, "stored": self.stored,
+                "evictions": self.evictions, "network_bytes": self.network_bytes, "saved_bytes": self.saved_bytes,
+                "hit_ratio": (self.hits + self.revalidated) / lookups if lookups else 0.0}
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import threading
+
+    from http_server import HttpServer
+
+    class MaxAgeServer(HttpServer):
+        # static files, the ones under /fresh/ with Cache-Control: max-age so they are served without revalidation
+        def handle_request(self, request):
+            status, headers, body = super().handle_request(request)
+            if request.path.startswith("/fresh/") and status == 200:
+                headers = list(headers) + [("Cache-Control", "max-age=60"), ("Date", formatdate(usegmt=True))]
+            return status, headers, body
+
+    parser = argparse.ArgumentParser(description="Repeated crawl with and without the client cache")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        for folder in ("fresh", "validated"):
+            os.makedirs(os.path.join(root, folder))
+            for i in range(args.files // 2):
+                with open(os.path.join(root, folder, f"{i}.html"), "wb") as f:
+                    f.write(os.urandom(args.size_kb * 512).hex().encode())
+        server = MaxAgeServer("127.0.0.1", 0, log_requests=False, static_root=root)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [f"http://127.0.0.1:{server.port}/{folder}/{i}.html"
+                for folder in ("fresh", "validated") for i in range(args.files // 2)]
+
+        cache = HttpCache(os.path.join(root, "cache"))
+        for round_number in range(args.rounds):
+            before = cache.network_bytes
+            start = time.perf_counter()
+            for url in urls:
+                assert cache.get(url).status == 200
+            elapsed = time.perf_counter() - start
+            print(f"round {round_number + 1}: {elapsed * 1000:7.1f} ms  "
+                  f"{cache.network_bytes - before:>10} bytes over the network")
+        cache.close()
+        print(cache.stats())
+
+        # a new HttpCache on the same directory, like the next run of a client script
+        cache = HttpCache(os.path.join(root, "cache"))
+        for url in urls:
+            cache.get(url)
+        print(f"next run: {cache.stats()}")
+        cache.close()
+        server.stop(0)
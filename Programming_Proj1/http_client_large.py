@@ -7,47 +7,96 @@
 
 # because of this, for handling files of large sizes we must loop recv() until an empty byte string is returned, in which case we can safely assume that this is the end of the transmission. 
 
+# update: waiting for the close only works when the server closes right after the response. an HTTP/1.1 server keeps
+# the connection open (keep-alive), so the loop sat there until the server's idle timeout. the response itself says
+# where it ends (Content-Length, or the last chunk of Transfer-Encoding: chunked), http_client_lib.read_response
+# uses that and returns the moment the last byte is in
+
+# update 2: the old raw_response += data copied everything received so far on every 4 KB recv (quadratic), then
+# decoded and printed it all at the end. with --output FILE the body is streamed instead: http_client_lib.stream_response
+# recv_into()s one reused buffer of --buffer-size bytes and writes each piece straight to the file, so memory stays
+# the same for any file size and the work grows linearly with it
+
+# update 3: on a long fat path one connection cannot fill the link, --connections N (with --output) splits the file
+# into N byte ranges and downloads them in parallel, see http_segmented_download.py
+
+# update 4: the request says Accept-Encoding: gzip, deflate. a compressed body is smaller on the wire, and it is
+# never collected and decoded at the end any more: every piece that arrives goes through zlib's streaming
+# decompressor and an incremental decoder for the page's charset (http_client_lib.BodyDecoder) and is printed
+# (or, with --output, the decompressed bytes are written) right away, memory stays at one piece
+
 # ***I USED THE OFFICIAL PYTHON MANUAL AND WATCHED some youtube videos on the topics if I was still a bit confuesed *** -> ontop of textbook examples and notes that were provided
-import socket
+import argparse
+import sys
+
+from http_client_lib import RECV_SIZE, BodyDecoder, connect, read_final_head, stream_body
+from http_segmented_download import download
+
+parser = argparse.ArgumentParser(description="HTTP client for large files")
+parser.add_argument("--host", default="gaia.cs.umass.edu")
+parser.add_argument("--port", type=int, default=80)
+parser.add_argument("--path", default="/wireshark-labs/HTTP-wireshark-file3.html")
+parser.add_argument("--output", default=None, help="stream the body into this file instead of printing it")
+parser.add_argument("--buffer-size", type=int, default=RECV_SIZE, help="bytes per recv_into when streaming")
+parser.add_argument("--connections", type=int, default=1,
+                    help="with --output: download in this many parallel Range requests")
+args = parser.parse_args()
+
+if args.output is not None and args.connections > 1:
+    remote = download(f"http://{args.host}:{args.port}{args.path}", args.output, args.connections,
+                      buffer_size=args.buffer_size)
+    print(f"{remote.size} bytes written to {args.output} over up to {args.connections} connections")
+    raise SystemExit(0)
 
 # same setup/formatting as the previous http client example
-host = "gaia.cs.umass.edu"
-port = 80
+host = args.host
+port = args.port
 
-path = f"/wireshark-labs/HTTP-wireshark-file3.html"
-request = f"GET {path} HTTP/1.1\r\nHost:{host}\r\n\r\n"
+path = args.path
+request = f"GET {path} HTTP/1.1\r\nHost:{host}\r\nAccept-Encoding: gzip, deflate\r\n\r\n"
 
 print(f"Request: {request}")
 
-# create the same TCP socket setup
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-
-#connect to the created socket
-sock.connect((host, port))
+# create the same TCP socket setup and connect it, the host name goes through the shared DNS cache
+sock = connect(host, port)
 
 #send the HTTP GET request to the server, send method expects bytes so the string must be encoded
 sock.send(request.encode())
 
-#unlike the first simple http client, this version uses a loop to handle file sizes that are arbitrarely large
-#does not guarantee all of the data transmission in a singular call, TCP is stream based ans so you must loop until the server closes the connection
+pending = bytearray()
+response = read_final_head(sock, pending)
+print("-----Server's Response-----\n")
+print(response.head.decode(errors = 'replace'))
+
+if args.output is not None:
+    # streaming mode: the decompressed body goes to the file as it arrives
+    decoder = BodyDecoder(response.headers, text=False)
+    with open(args.output, "wb") as output_file:
+        def write(view):
+            for piece in decoder.feed(view):
+                output_file.write(piece)
+        stream_body(sock, response, write, pending, buffer_size=args.buffer_size)
+        for piece in decoder.finish():
+            output_file.write(piece)
+    print(f"{response.body_bytes} body bytes received ({decoder.encoding}), written to {args.output} decompressed")
+    sock.close()
+    raise SystemExit(0)
 
-raw_response = b'' #empty string of bytes that is used to accumulate the chunks of data
+#unlike the first simple http client, this version uses a loop to handle file sizes that are arbitrarely large
+#does not guarantee all of the data transmission in a singular call, TCP is stream based ans so stream_body loops
+#on recv until it has the number of bytes the headers announced (or the server closes, if it announced nothing)
+#every piece is decompressed and decoded to text as soon as it arrives and printed, nothing is accumulated
+decoder = BodyDecoder(response.headers)
 
-while True:
-    data = sock.recv(4096)
-    if not data:
-        #if 'data' is empty the server has closed the connection meaning that we have recieved the entirety of the file
-        break
-    
-    raw_response += data #append each chunk of data the the accumulator raw_response
 
-# once the transmission has finished -> decode all of the raw byte data at once
-decoded_response = raw_response.decode(errors = 'replace')
+def print_piece(view):
+    for text in decoder.feed(view):
+        sys.stdout.write(text)
 
-#display the decoded data and close the socket connection
 
-print("-----Server's Response-----\n")
-print(decoded_response)
+stream_body(sock, response, print_piece, pending, buffer_size=args.buffer_size)
+for text in decoder.finish():
+    sys.stdout.write(text)
+print(f"\n\n{response.body_bytes} body bytes received ({decoder.encoding}, {decoder.charset})")
 
 sock.close()
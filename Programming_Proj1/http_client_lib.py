@@ -0,0 +1,520 @@
+# the raw socket client code from http_client_basic.py / http_client_large.py as reusable functions,
+# so the load generator and other tools send requests and read responses the same way the lab clients do
+#
+# read_response() frames a response the way HTTP/1.1 says to instead of waiting for the server to close:
+# status line and headers up to the blank line, then exactly Content-Length bytes, or the chunks of a
+# Transfer-Encoding: chunked body, and only when there is neither does the body run until the close.
+# HEAD responses and 1xx/204/304 have no body at all. a download is done the moment its last byte is in,
+# so a keep-alive server's idle timeout is never waited out and nothing bigger than one recv gets cut off
+#
+# stream_response() is the same framing for big downloads: the body is never collected, it is recv_into()'d
+# into one reused buffer and handed to a write callback (a file's write, a hash's update, ...) piece by piece,
+# so memory stays at one buffer whatever the file size and the CPU cost grows linearly with it
+#
+# BodyDecoder undoes Content-Encoding (gzip/deflate, with zlib's streaming decompressor) and the charset (with
+# an incremental codec) one piece at a time, so a compressed page can go through stream_response() too and a
+# multi-byte character split between two recvs still comes out right
+#
+# run this file directly to compare the old accumulate-with-+= loop against stream_response
+
+import codecs
+import socket
+import zlib
+from time import perf_counter as clock
+from urllib.parse import urlsplit
+
+from dns_cache import resolve
+
+RECV_SIZE = 64 * 1024
+
+# a response head bigger than this is treated as garbage
+MAX_HEAD_BYTES = 64 * 1024
+
+
+class HttpResponseError(Exception):
+    # the server sent something that is not a valid HTTP/1.x response
+    pass
+
+
+class HttpResponse:
+    def __init__(self, version, status, reason, headers, head, body=b''):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers              # {lower case name: value}, repeated headers joined with ", "
+        self.head = head                    # status line + headers exactly as received, blank line included
+        self.body = body
+        self.wire_bytes = len(head)         # head + body as sent, chunk framing included
+        self.timing = None                  # http_timing.RequestTiming when the request was timed
+
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return "keep-alive" in connection
+        return "close" not in connection
+
+
+# what the clients advertise, BodyDecoder handles both
+ACCEPT_ENCODING = ("Accept-Encoding", "gzip, deflate")
+
+# upper bound on what one decompress() call may produce, a small very compressible piece would otherwise
+# expand into one huge string
+MAX_DECODED_PIECE = 256 * 1024
+
+
+# the same request line + Host header the lab clients send, plus optional extra headers
+def build_request(host, path, headers=(), keep_alive=True, method="GET"):
+    lines = [f"{method} {path} HTTP/1.1", f"Host:{host}"]
+    for name, value in headers:
+        lines.append(f"{name}: {value}")
+    if not keep_alive:
+        # HTTP/1.1 servers keep the connection open by default, the lab clients expect it to be closed after one reply
+        lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+# http://host[:port]/path?query -> (host, port, path)
+def split_url(url):
+    parts = urlsplit(url)
+    if parts.scheme != "http" or not parts.hostname:
+        raise ValueError(f"only http:// URLs are supported, not {url!r}")
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return parts.hostname, parts.port or 80, path
+
+
+# AF_INET -> IPv4, SOCK_STREAM -> TCP, like the lab clients. the name goes through the shared DNS cache
+# (dns_cache.py), a batch of connections to one host resolves it once.
+# with a RequestTiming (http_timing.py) the name lookup and the handshake are timed separately
+def connect(host, port, timeout=None, timing=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if timeout is not None:
+        sock.settimeout(timeout)
+    try:
+        address = resolve(host)
+        if timing is not None:
+            timing.resolved = clock()
+        sock.connect((address, port))
+        if timing is not None:
+            timing.connected = clock()
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+# http_client_large.py's loop: read until the server closes the connection, returns the byte count
+def read_until_close(sock, buffer_size=4096):
+    received = 0
+    while True:
+        data = sock.recv(buffer_size)
+        if not data:
+            return received
+        received += len(data)
+
+
+# one GET over a fresh connection, read until the server closes it
+def fetch_once(host, port, request):
+    sock = connect(host, port)
+    try:
+        sock.sendall(request)
+        return read_until_close(sock)
+    finally:
+        sock.close()
+
+
+# recv()s more bytes onto the end of `pending`, False when the server closed the connection
+def _fill(sock, pending, size=RECV_SIZE):
+    data = sock.recv(size)
+    if not data:
+        return False
+    pending += data
+    return True
+
+
+# status line + headers, consumed from the front of `pending`
+def read_head(sock, pending):
+    scan = 0
+    while True:
+        end = pending.find(b"\r\n\r\n", scan)
+        if end != -1:
+            break
+        if len(pending) > MAX_HEAD_BYTES:
+            raise HttpResponseError("response head too large")
+        # the terminator may start in the last 3 bytes we have
+        scan = max(0, len(pending) - 3)
+        if not _fill(sock, pending):
+            raise ConnectionError("server closed the connection before the response headers")
+    head = bytes(pending[:end + 4])
+    del pending[:end + 4]
+    return parse_head(head)
+
+
+# HttpResponse from a complete status line + headers, blank line included
+def parse_head(head):
+    lines = head[:-4].decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        raise HttpResponseError(f"bad status line {lines[0]!r}")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise HttpResponseError(f"bad header line {line!r}")
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = headers[name] + ", " + value if name in headers else value
+    return HttpResponse(parts[0], int(parts[1]), parts[2] if len(parts) > 2 else "", headers, head)
+
+
+# takes exactly `count` bytes from `pending`, receiving more as needed
+def _take(sock, pending, count):
+    have = len(pending)
+    if have >= count:
+        data = bytes(pending[:count])
+        del pending[:count]
+        return data
+    # the rest is recv_into()'d its final buffer: no recv(count) allocation per read, and nothing past `count`
+    # is read, so `pending` is simply empty afterwards
+    data = bytearray(count)
+    data[:have] = pending
+    pending.clear()
+    view = memoryview(data)
+    while have < count:
+        n = sock.recv_into(view[have:])
+        if not n:
+            raise ConnectionError("server closed the connection mid response")
+        have += n
+    view.release()
+    return bytes(data)
+
+
+def _take_line(sock, pending):
+    while True:
+        end = pending.find(b"\r\n")
+        if end != -1:
+            line = bytes(pending[:end])
+            del pending[:end + 2]
+            return line
+        if len(pending) > MAX_HEAD_BYTES:
+            raise HttpResponseError("chunk size line too long")
+        if not _fill(sock, pending):
+            raise ConnectionError("server closed the connection mid response")
+
+
+# the head of the real response, interim ones (100 Continue, 103 Early Hints) come before it and are skipped
+def read_final_head(sock, pending):
+    response = read_head(sock, pending)
+    while 100 <= response.status < 200 and response.status != 101:
+        response = read_head(sock, pending)
+    return response
+
+
+def parse_chunk_size(line):
+    try:
+        return int(line.split(b";", 1)[0].strip(), 16)
+    except ValueError:
+        raise HttpResponseError(f"bad chunk size {line!r}")
+
+
+def has_body(response, method):
+    return method != "HEAD" and response.status >= 200 and response.status not in (204, 304)
+
+
+# stamps timing.first_byte once at least one byte of the response is in `pending`
+def _wait_first_byte(sock, pending, timing):
+    if not pending and not _fill(sock, pending):
+        raise ConnectionError("server closed the connection before the response headers")
+    timing.first_byte = clock()
+
+
+# reads one whole response off `sock`. pass the same `pending` bytearray for every response on a keep-alive
+# connection, bytes that arrive past the end of one response belong to the next.
+# `timing` (http_timing.RequestTiming) gets its first_byte and last_byte stamps
+def read_response(sock, pending=None, method="GET", timing=None):
+    if pending is None:
+        pending = bytearray()
+    if timing is not None:
+        _wait_first_byte(sock, pending, timing)
+    response = read_final_head(sock, pending)
+    response.timing = timing
+    if not has_body(response, method):
+        if timing is not None:
+            timing.last_byte = clock()
+        return response
+
+    headers = response.headers
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = bytearray()
+        while True:
+            line = _take_line(sock, pending)
+            response.wire_bytes += len(line) + 2
+            size = parse_chunk_size(line)
+            if size == 0:
+                break
+            body += _take(sock, pending, size)
+            if _take(sock, pending, 2) != b"\r\n":
+                raise HttpResponseError("missing CRLF after chunk")
+            response.wire_bytes += size + 2
+        # trailers, dropped, up to the empty line
+        while True:
+            line = _take_line(sock, pending)
+            response.wire_bytes += len(line) + 2
+            if not line:
+                break
+        response.body = bytes(body)
+    elif "content-length" in headers:
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HttpResponseError("bad Content-Length")
+        response.body = _take(sock, pending, length)
+        response.wire_bytes += length
+    else:
+        # no framing at all: the body is everything until the server closes
+        while _fill(sock, pending):
+            pass
+        response.body = bytes(pending)
+        response.wire_bytes += len(pending)
+        pending.clear()
+    if timing is not None:
+        timing.last_byte = clock()
+    return response
+
+
+# reads exactly one response off a persistent connection, `pending` holds bytes that arrived past the last one
+# returns (response size, keep the connection?)
+def read_framed_response(sock, pending):
+    response = read_response(sock, pending)
+    return response.wire_bytes, response.keep_alive()
+
+
+# hands the first `count` bytes of `pending` to `write` and drops them, returns how many it took
+def _drain_pending(pending, count, write):
+    count = min(count, len(pending))
+    if count:
+        with memoryview(pending) as view:
+            write(view[:count])
+        del pending[:count]
+    return count
+
+
+# receives `count` body bytes, whatever is already in `pending` first, the rest straight into `view`
+def _stream_exactly(sock, pending, count, view, write):
+    remaining = count - _drain_pending(pending, count, write)
+    while remaining:
+        n = sock.recv_into(view, min(remaining, len(view)))
+        if not n:
+            raise ConnectionError("server closed the connection mid response")
+        write(view[:n])
+        remaining -= n
+
+
+# like read_response, but the body goes to write(memoryview) as it arrives instead of into response.body.
+# the memoryview points into a buffer that is reused for the next recv, write() has to consume it right away.
+# response.body_bytes is the body size, response.body stays empty
+def stream_response(sock, write, pending=None, method="GET", buffer_size=RECV_SIZE, timing=None):
+    if pending is None:
+        pending = bytearray()
+    if timing is not None:
+        _wait_first_byte(sock, pending, timing)
+    response = read_final_head(sock, pending)
+    response.timing = timing
+    stream_body(sock, response, write, pending, method, buffer_size)
+    if timing is not None:
+        timing.last_byte = clock()
+    return response
+
+
+# the body half of stream_response, for callers that look at the head before deciding where the body goes
+def stream_body(sock, response, write, pending, method="GET", buffer_size=RECV_SIZE):
+    response.body_bytes = 0
+    if not has_body(response, method):
+        return response
+
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    headers = response.headers
+    try:
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            while True:
+                line = _take_line(sock, pending)
+                response.wire_bytes += len(line) + 2
+                size = parse_chunk_size(line)
+                if size == 0:
+                    break
+                _stream_exactly(sock, pending, size, view, write)
+                if _take(sock, pending, 2) != b"\r\n":
+                    raise HttpResponseError("missing CRLF after chunk")
+                response.body_bytes += size
+                response.wire_bytes += size + 2
+            while True:
+                line = _take_line(sock, pending)
+                response.wire_bytes += len(line) + 2
+                if not line:
+                    break
+        elif "content-length" in headers:
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                raise HttpResponseError("bad Content-Length")
+            _stream_exactly(sock, pending, length, view, write)
+            response.body_bytes = length
+            response.wire_bytes += length
+        else:
+            received = _drain_pending(pending, len(pending), write)
+            while True:
+                n = sock.recv_into(view)
+                if not n:
+                    break
+                write(view[:n])
+                received += n
+            response.body_bytes = received
+            response.wire_bytes += received
+    finally:
+        view.release()
+    return response
+
+
+def parse_charset(content_type, default="utf-8"):
+    for parameter in content_type.split(";")[1:]:
+        name, sep, value = parameter.strip().partition("=")
+        if sep and name.strip().lower() == "charset":
+            charset = value.strip().strip('"')
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                return default
+    return default
+
+
+class BodyDecoder:
+    # feed() takes body pieces as they arrive and yields what they decode to, at most MAX_DECODED_PIECE at a time:
+    # bytes with text=False (decompressed only), str with text=True (decompressed and charset-decoded).
+    # finish() after the last piece yields whatever the decoders still hold
+    def __init__(self, headers, text=True, errors="replace"):
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            # decided on the first two bytes: zlib wrapper as the RFC says, or raw deflate as some servers send
+            self.decompressor = None
+        elif encoding in ("identity", ""):
+            self.decompressor = False
+        else:
+            raise HttpResponseError(f"unsupported Content-Encoding {encoding!r}")
+        self.encoding = encoding
+        self.charset = parse_charset(headers.get("content-type", "")) if text else None
+        self.text_decoder = codecs.getincrementaldecoder(self.charset)(errors) if text else None
+        self.compressed_bytes = 0
+        self.deflate_head = b""             # deflate bytes held back until there are two to tell the format by
+
+    def _choose_deflate(self):
+        data = self.deflate_head
+        # a zlib stream starts with CMF/FLG where (CMF * 256 + FLG) % 31 == 0
+        zlib_wrapped = len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] * 256 + data[1]) % 31 == 0
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS if zlib_wrapped else -zlib.MAX_WBITS)
+        self.deflate_head = b""
+        return data
+
+    def _decompress(self, data):
+        self.compressed_bytes += len(data)
+        if self.decompressor is False:
+            if data:
+                yield bytes(data)
+            return
+        if self.decompressor is None:
+            # chunked and streamed reads can hand over a 1-byte first piece
+            self.deflate_head += data
+            if len(self.deflate_head) < 2:
+                return
+            data = self._choose_deflate()
+        data = bytes(data)
+        while data:
+            piece = self.decompressor.decompress(data, MAX_DECODED_PIECE)
+            data = self.decompressor.unconsumed_tail
+            if piece:
+                yield piece
+
+    def feed(self, data):
+        for piece in self._decompress(data):
+            if self.text_decoder is None:
+                yield piece
+            else:
+                text = self.text_decoder.decode(piece)
+                if text:
+                    yield text
+
+    def finish(self):
+        tail = b''
+        if self.decompressor is None and self.deflate_head:
+            # the whole body was one byte, too short for any deflate stream: the check below reports it
+            data = self._choose_deflate()
+            self.decompressor.decompress(data)
+        if self.decompressor and self.compressed_bytes:
+            tail = self.decompressor.flush()
+            if not self.decompressor.eof:
+                raise HttpResponseError(f"{self.encoding} body ends in the middle of the stream")
+        if self.text_decoder is None:
+            if tail:
+                yield tail
+            return
+        text = self.text_decoder.decode(tail, final=True)
+        if text:
+            yield text
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+    import threading
+    import time
+
+    from http_server import HttpServer
+
+    parser = argparse.ArgumentParser(description="Download CPU time: accumulate with += vs stream_response")
+    parser.add_argument("--sizes-mb", default="1,2,4,8")
+    parser.add_argument("--buffer-size", type=int, default=RECV_SIZE)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes_mb.split(",")]
+
+    with tempfile.TemporaryDirectory() as root:
+        for size in sizes:
+            with open(os.path.join(root, f"{size}.bin"), "wb") as f:
+                f.write(os.urandom(size * 1024 * 1024))
+        server = HttpServer("127.0.0.1", 0, log_requests=False, static_root=root)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # the original http_client_large.py loop
+        def accumulate(path):
+            sock = connect("127.0.0.1", server.port)
+            sock.sendall(build_request("127.0.0.1", path, keep_alive=False))
+            raw_response = b''
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                raw_response += data
+            sock.close()
+            return len(raw_response)
+
+        def streamed(path):
+            sock = connect("127.0.0.1", server.port)
+            sock.sendall(build_request("127.0.0.1", path, keep_alive=False))
+            with open(os.devnull, "wb") as out:
+                response = stream_response(sock, out.write, buffer_size=args.buffer_size)
+            sock.close()
+            return response.wire_bytes
+
+        print(f"{'size':>6} {'accumulate +=':>16} {'stream_response':>16}")
+        for size in sizes:
+            times = []
+            for download in (accumulate, streamed):
+                start = time.process_time()
+                download(f"/{size}.bin")
+                times.append(time.process_time() - start)
+            print(f"{size:>4}MB {times[0] * 1000:>13.1f} ms {times[1] * 1000:>13.1f} ms   (client+server CPU)")
+        server.stop(0)
@@ -0,0 +1,260 @@
+# Accept-Encoding support for the static file mode of http_server.py
+# html, css, js and json shrink to a fraction of their size with gzip, so for text we should not send identity bytes
+# to a client that says it can decode gzip or deflate:
+# - the encoding is picked from the client's Accept-Encoding header (q-values respected, gzip preferred)
+# - if a precompressed sibling exists (page.html.gz next to page.html, at least as new) it is sent as is, with sendfile
+# - otherwise the file is compressed on the fly and the result kept in a byte-bounded LRU of compressed variants,
+#   so a hot file is compressed once per change, not once per request
+# - files below MIN_SIZE are never compressed, the gzip header and the CPU are not worth it for a few hundred bytes
+# - Range requests are answered from the identity bytes (byte offsets of a compressed variant are of no use)
+# - every compressed response carries Vary: Accept-Encoding and its own ETag, so caches keep the variants apart
+#
+# run this file directly for a benchmark of bytes on the wire and server CPU per response
+
+import os
+import time
+import zlib
+from collections import OrderedDict
+
+from http_static import FileBody
+
+# below this many bytes the identity response is sent
+MIN_SIZE = 1024
+
+# files bigger than this are only sent compressed when a precompressed sibling exists
+MAX_ON_THE_FLY = 1024 * 1024
+
+# memory for compressed variants
+CACHE_BYTES = 16 * 1024 * 1024
+
+# zlib level, 6 is the usual tradeoff between ratio and CPU
+LEVEL = 6
+
+# wbits for zlib.compressobj: gzip wrapper, and the zlib wrapper which is what HTTP calls "deflate"
+WBITS = {"gzip": 31, "deflate": 15}
+
+# most preferred first
+ENCODINGS = ("gzip", "deflate")
+
+PRECOMPRESSED_SUFFIX = {"gzip": ".gz"}
+
+COMPRESSIBLE_TYPES = ("application/javascript", "application/json", "application/xml", "image/svg+xml")
+
+
+def is_compressible(content_type):
+    media_type = content_type.split(";", 1)[0].strip()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+# "gzip;q=0.8, deflate, *;q=0" -> {"gzip": 0.8, "deflate": 1.0, "*": 0.0}
+def parse_accept_encoding(header):
+    codings = {}
+    for part in header.split(","):
+        name, sep, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, eq, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[name] = q
+    return codings
+
+
+# best encoding out of `available` the client accepts, None for identity
+def choose_encoding(header, available=ENCODINGS):
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = codings.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, level=LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+class Variant:
+    # what a request will get: `encoding`, the variant's ETag and, for a precompressed sibling, its path and stat
+    def __init__(self, encoding, etag, sibling_path=None, sibling_stat=None):
+        self.encoding = encoding
+        self.etag = etag
+        self.sibling_path = sibling_path
+        self.sibling_stat = sibling_stat
+
+
+class Compressor:
+    def __init__(self, min_size=MIN_SIZE, level=LEVEL, max_bytes=CACHE_BYTES, max_on_the_fly=MAX_ON_THE_FLY):
+        self.min_size = min_size
+        self.level = level
+        self.max_bytes = max_bytes
+        self.max_on_the_fly = max_on_the_fly
+        self.cache = OrderedDict()          # {(path, encoding): (inode, mtime_ns, size, compressed bytes)}
+        self.memory = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.precompressed = 0
+        self.bytes_in = 0                   # identity bytes compressed on the fly
+        self.bytes_out = 0                  # what they compressed to
+        self.compress_seconds = 0.0
+
+    # picks the variant for a request, None means send the identity bytes
+    def negotiate(self, request, info):
+        if info.size < self.min_size or not is_compressible(info.content_type) or "range" in request.headers:
+            return None
+        header = request.headers.get("accept-encoding")
+        if not header:
+            return None
+        encoding = choose_encoding(header)
+        if encoding is None:
+            return None
+
+        suffix = PRECOMPRESSED_SUFFIX.get(encoding)
+        if suffix is not None:
+            try:
+                sibling_stat = os.stat(info.path + suffix)
+            except OSError:
+                sibling_stat = None
+            # an older sibling belongs to an older version of the file
+            if sibling_stat is not None and sibling_stat.st_mtime_ns >= info.stat.st_mtime_ns:
+                return Variant(encoding, self.etag(info.etag, encoding), info.path + suffix, sibling_stat)
+
+        if info.size > self.max_on_the_fly:
+            return None
+        return Variant(encoding, self.etag(info.etag, encoding))
+
+    @staticmethod
+    def etag(identity_etag, encoding):
+        return identity_etag[:-1] + "-" + encoding + '"'
+
+    # True when responses for this file depend on Accept-Encoding
+    def varies(self, info):
+        return info.size >= self.min_size and is_compressible(info.content_type)
+
+    # body of a negotiated variant: the precompressed sibling as a FileBody or the compressed bytes
+    # raises OSError when the file can not be read
+    def body(self, variant, info):
+        if variant.sibling_path is not None:
+            self.precompressed += 1
+            return FileBody(open(variant.sibling_path, "rb"), 0, variant.sibling_stat.st_size)
+        return self.compressed(info, variant.encoding)
+
+    # compressed bytes of a file, from the cache while the file is unchanged
+    def compressed(self, info, encoding):
+        key = (info.path, encoding)
+        stat = info.stat
+        cached = self.cache.get(key)
+        if cached is not None and cached[:3] == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return cached[3]
+
+        with open(info.path, "rb") as f:
+            data = f.read()
+        self.misses += 1
+        start = time.process_time()
+        body = compress(data, encoding, self.level)
+        self.compress_seconds += time.process_time() - start
+        self.bytes_in += len(data)
+        self.bytes_out += len(body)
+
+        if cached is not None:
+            self.memory -= len(cached[3])
+            del self.cache[key]
+        if len(body) <= self.max_bytes:
+            self.cache[key] = (stat.st_ino, stat.st_mtime_ns, stat.st_size, body)
+            self.memory += len(body)
+            while self.memory > self.max_bytes:
+                oldest, evicted = self.cache.popitem(last=False)
+                self.memory -= len(evicted[3])
+        return body
+
+    def summary(self):
+        ratio = self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+        return (f"compression: {len(self.cache)} cached variants, {self.memory / 1024:.1f} KB, "
+                f"{self.hits} hits, {self.misses} compressed on the fly (ratio {ratio:.2f}, "
+                f"{self.compress_seconds * 1000:.1f} ms CPU), {self.precompressed} precompressed")
+
+
+if __name__ == "__main__":
+    import argparse
+    import gzip
+    import shutil
+    import socket
+    import tempfile
+    import threading
+
+    from http_client_lib import read_framed_response
+    from http_server import HttpServer
+
+    parser = argparse.ArgumentParser(description="Bytes on the wire and server CPU per response with compression")
+    parser.add_argument("--file-kb", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    def run(root, path, accept_encoding, compress_enabled, cache_bytes=CACHE_BYTES):
+        server = HttpServer("127.0.0.1", 0, log_requests=False, static_root=root, compress=compress_enabled,
+                            compress_cache_bytes=cache_bytes)
+        server.start()
+        server_cpu = []
+
+        def serve():
+            start = time.thread_time()
+            server.serve_forever()
+            server_cpu.append(time.thread_time() - start)
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+        if accept_encoding:
+            request += f"Accept-Encoding: {accept_encoding}\r\n"
+        request = (request + "\r\n").encode()
+
+        sock = socket.create_connection(("127.0.0.1", server.port))
+        pending = bytearray()
+        wire_bytes = 0
+        for i in range(args.requests):
+            sock.sendall(request)
+            size, keep = read_framed_response(sock, pending)
+            wire_bytes += size
+        sock.close()
+        server.stop(0)
+        thread.join()
+        return wire_bytes / args.requests, server_cpu[0] / args.requests
+
+    # something that looks like a real page: repetitive markup with varying text
+    words = ["network", "packet", "socket", "header", "latency", "window", "segment", "router", "client", "server"]
+    rows = []
+    for i in range(args.file_kb * 1024 // 60 + 1):
+        rows.append(f'<tr class="row-{i % 7}"><td>{i}</td><td>{words[i % 10]} {words[(i * 7) % 10]}</td></tr>\n')
+    page = ("<html><body><table>\n" + "".join(rows) + "</table></body></html>\n").encode()
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, "page.html"), "wb") as f:
+            f.write(page)
+        shutil.copy(os.path.join(root, "page.html"), os.path.join(root, "static.html"))
+        with open(os.path.join(root, "static.html"), "rb") as src, gzip.open(os.path.join(root, "static.html.gz"),
+                                                                                "wb", compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+
+        print(f"{len(page)} byte html page, {args.requests} keep-alive requests per case")
+        cases = [
+            ("identity", "/page.html", None, False, CACHE_BYTES),
+            ("gzip on the fly, no cache", "/page.html", "gzip, deflate", True, 0),
+            ("deflate on the fly, cached", "/page.html", "deflate", True, CACHE_BYTES),
+            ("gzip on the fly, cached", "/page.html", "gzip, deflate", True, CACHE_BYTES),
+            ("gzip precompressed sibling", "/static.html", "gzip, deflate", True, CACHE_BYTES),
+        ]
+        for label, path, accept_encoding, compress_enabled, cache_bytes in cases:
+            wire, cpu = run(root, path, accept_encoding, compress_enabled, cache_bytes)
+            print(f"{label:<28} {wire:>9.0f} bytes/response  {cpu * 1e6:>8.1f} us server CPU/response")
@@ -0,0 +1,291 @@
+# load test for http_server.py
+# - opens `concurrency` client threads that each send GET requests to the server over and over for `duration` seconds
+# - by default every request uses a brand new TCP connection, the same way http_client_basic.py does it,
+#   with --keep-alive each thread keeps one persistent connection and frames responses by Content-Length
+#   (--compare-keep-alive runs both back to back so the handshake cost shows up in the numbers)
+# - closed loop (default): every thread sends its next request as soon as the previous response is in.
+#   a server stall then also stalls the client, so the requests that would have been sent during the stall are
+#   never measured (coordinated omission). the report adds corrected percentiles that fill those in,
+#   HdrHistogram style, using --expected-interval-ms (default: the median latency of the run)
+# - open loop (--rate R): R requests per second in total on a fixed schedule no matter how the server is doing,
+#   latency is measured from when a request was supposed to go out, which needs no correction
+# - reports requests per second and the p50/p90/p99/p99.9 latency of the whole run
+# - requests are built and responses read with http_client_lib.py, the same raw socket code the lab clients use,
+#   everything runs against 127.0.0.1 so no network access is needed
+# - --slow-clients N runs a slowloris style flood next to the test: N connections that send a request one byte
+#   every second and never finish it, to check that the well-behaved clients' latency stays where it was
+#
+# run the server first (python http_server.py --quiet, or python http_prefork.py --workers N) or pass --spawn-server
+# to run one inside this process. the load generator is python too, so against a prefork server use --processes to
+# spread the client threads over several processes, otherwise the client becomes the bottleneck
+
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+
+from http_client_lib import build_request, connect, fetch_once, read_framed_response
+
+
+# value at percentile p (0-100) of an already sorted list
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# holds `count` connections open by trickling a never ending request into them, reconnects when the server gives up
+# returns when `stop` is set, `stats` counts how often the server closed one of them
+def slow_clients(host, port, count, stop, stats):
+    header = b"GET / HTTP/1.1\r\nHost: slow\r\nX-Padding: "
+    socks = []
+    while not stop.is_set():
+        while len(socks) < count and not stop.is_set():
+            try:
+                sock = socket.create_connection((host, port), timeout=1.0)
+                sock.sendall(header[:1])
+            except OSError:
+                stats["refused"] += 1
+                time.sleep(0.01)
+                continue
+            sock.setblocking(False)
+            socks.append(sock)
+        alive = []
+        for sock in socks:
+            try:
+                sock.send(b"a")
+                if sock.recv(4096) == b"":
+                    raise ConnectionError
+            except BlockingIOError:
+                alive.append(sock)
+                continue
+            except OSError:
+                pass
+            # the server answered (408/503) or closed it
+            stats["closed"] += 1
+            sock.close()
+        socks = alive
+        stop.wait(1.0)
+    for sock in socks:
+        sock.close()
+
+
+def worker(host, port, request, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if fetch_once(host, port, request) == 0:
+                errors.append("empty response")
+                continue
+        except OSError as e:
+            errors.append(str(e))
+            continue
+        # list.append is atomic in CPython so every thread can share the same list
+        latencies.append(time.perf_counter() - start)
+
+
+# same as worker() but reuses one connection for as long as the server allows it
+def keep_alive_worker(host, port, request, deadline, latencies, errors):
+    sock = None
+    pending = bytearray()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if sock is None:
+                sock = connect(host, port)
+                pending.clear()
+            sock.sendall(request)
+            size, keep = read_framed_response(sock, pending)
+        except OSError as e:
+            errors.append(str(e))
+            if sock is not None:
+                sock.close()
+            sock = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if not keep:
+            sock.close()
+            sock = None
+    if sock is not None:
+        sock.close()
+
+
+# open loop: request k of this thread is due at first_send + k * interval whether or not the server kept up.
+# if it is late because the previous response took long, it goes out right away and the wait counts as latency
+def open_loop_worker(host, port, request, first_send, interval, deadline, latencies, errors, keep_alive):
+    sock = None
+    pending = bytearray()
+    due = first_send
+    while due < deadline:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            if not keep_alive:
+                if fetch_once(host, port, request) == 0:
+                    raise ConnectionError("empty response")
+            else:
+                if sock is None:
+                    sock = connect(host, port)
+                    pending.clear()
+                sock.sendall(request)
+                size, keep = read_framed_response(sock, pending)
+                if not keep:
+                    sock.close()
+                    sock = None
+        except OSError as e:
+            errors.append(str(e))
+            if sock is not None:
+                sock.close()
+            sock = None
+        else:
+            latencies.append(time.perf_counter() - due)
+        due += interval
+    if sock is not None:
+        sock.close()
+
+
+# closed loop latencies miss the requests a stalled client never sent. for every sample longer than the expected
+# interval between requests, add the samples those missing requests would have seen (HdrHistogram's
+# recordValueWithExpectedInterval)
+def correct_coordinated_omission(latencies, expected_interval):
+    if expected_interval <= 0:
+        return list(latencies)
+    corrected = []
+    for latency in latencies:
+        corrected.append(latency)
+        missing = latency - expected_interval
+        while missing >= expected_interval:
+            corrected.append(missing)
+            missing -= expected_interval
+    return corrected
+
+
+# runs `concurrency` worker threads in this process, returns (latencies, error count, elapsed seconds)
+# with `rate` (requests/sec for all threads together) the threads run open loop
+def collect_latencies(host, port, path, concurrency, duration, keep_alive=False, rate=None):
+    request = build_request(host, path, keep_alive=keep_alive)
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    deadline = start + duration
+
+    if rate:
+        interval = concurrency / rate
+        # spread the threads' schedules over one interval so the requests do not go out in bursts
+        threads = [threading.Thread(target=open_loop_worker,
+                                    args=(host, port, request, start + interval * i / concurrency, interval, deadline,
+                                          latencies, errors, keep_alive), daemon=True)
+                   for i in range(concurrency)]
+    else:
+        target = keep_alive_worker if keep_alive else worker
+        threads = [threading.Thread(target=target, args=(host, port, request, deadline, latencies, errors),
+                                    daemon=True)
+                   for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, len(errors), time.perf_counter() - start
+
+
+def summarize(latencies):
+    latencies.sort()
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "p999_ms": percentile(latencies, 99.9) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+# `rate` switches to open loop, `expected_interval` (seconds) is only used to correct closed loop results
+def run_load_test(host, port, path="/", concurrency=50, duration=5.0, processes=1, keep_alive=False, rate=None,
+                  expected_interval=None):
+    if processes <= 1:
+        latencies, errors, elapsed = collect_latencies(host, port, path, concurrency, duration, keep_alive, rate)
+    else:
+        # split the connections over several processes so the client side is not stuck on one core
+        per_process = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.starmap(collect_latencies,
+                                 [(host, port, path, n, duration, keep_alive, rate * n / concurrency if rate else None)
+                                  for n in per_process if n > 0])
+        latencies = [latency for part in parts for latency in part[0]]
+        errors = sum(part[1] for part in parts)
+        elapsed = max(part[2] for part in parts)
+
+    results = summarize(latencies)
+    results.update({
+        "mode": "open loop" if rate else "closed loop",
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "corrected": None,
+    })
+    if not rate and latencies:
+        if expected_interval is None:
+            expected_interval = percentile(latencies, 50)
+        results["corrected"] = summarize(correct_coordinated_omission(latencies, expected_interval))
+        results["expected_interval_ms"] = expected_interval * 1000
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for http_server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--processes", type=int, default=1, help="client processes to spread the connections over")
+    parser.add_argument("--keep-alive", action="store_true", help="reuse one connection per client thread")
+    parser.add_argument("--compare-keep-alive", action="store_true", help="run without and then with keep-alive")
+    parser.add_argument("--spawn-server", action="store_true", help="run http_server.HttpServer in a background thread")
+    parser.add_argument("--slow-clients", type=int, default=0, help="slowloris connections to run next to the test")
+    parser.add_argument("--rate", type=float, default=None, help="open loop: total requests/sec on a fixed schedule")
+    parser.add_argument("--expected-interval-ms", type=float, default=None,
+                        help="closed loop coordinated omission correction interval (default: median latency)")
+    args = parser.parse_args()
+
+    if args.spawn_server:
+        from http_server import HttpServer
+        server = HttpServer(args.host, 0, log_requests=False)
+        server.start()
+        args.port = server.port
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    slow_stop = threading.Event()
+    slow_stats = {"refused": 0, "closed": 0}
+    if args.slow_clients:
+        threading.Thread(target=slow_clients, args=(args.host, args.port, args.slow_clients, slow_stop, slow_stats),
+                         daemon=True).start()
+        # let the flood build up before measuring
+        time.sleep(2.0)
+
+    modes = [False, True] if args.compare_keep_alive else [args.keep_alive]
+    for keep_alive in modes:
+        label = "keep-alive" if keep_alive else "new connection per request"
+        if args.rate:
+            label += f", open loop at {args.rate:g} requests/sec"
+        print(f"Load testing http://{args.host}:{args.port}{args.path} with {args.concurrency} connections "
+              f"for {args.duration}s ({label})")
+        expected_interval = args.expected_interval_ms / 1000 if args.expected_interval_ms is not None else None
+        results = run_load_test(args.host, args.port, args.path, args.concurrency, args.duration, args.processes,
+                                keep_alive, args.rate, expected_interval)
+        print(f"requests: {results['requests']}  errors: {results['errors']}")
+        print(f"requests/sec: {results['rps']:.1f}")
+        print(f"latency p50: {results['p50_ms']:.2f} ms  p90: {results['p90_ms']:.2f} ms  "
+              f"p99: {results['p99_ms']:.2f} ms  p99.9: {results['p999_ms']:.2f} ms  max: {results['max_ms']:.2f} ms")
+        corrected = results["corrected"]
+        if corrected is not None:
+            print(f"corrected for coordinated omission (interval {results['expected_interval_ms']:.2f} ms): "
+                  f"p50: {corrected['p50_ms']:.2f} ms  p90: {corrected['p90_ms']:.2f} ms  "
+                  f"p99: {corrected['p99_ms']:.2f} ms  p99.9: {corrected['p999_ms']:.2f} ms")
+    if args.slow_clients:
+        slow_stop.set()
+        print(f"slow clients: {slow_stats['closed']} closed by the server, {slow_stats['refused']} failed to connect")
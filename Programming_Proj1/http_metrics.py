@@ -0,0 +1,119 @@
+# counters and latency histograms for http_server.py, served in the Prometheus text format from /metrics
+# recording has to be cheap enough to leave on all the time, so:
+# - counters are plain int attributes, one addition per event, no locks (the server is one thread)
+# - histograms have fixed buckets, an observation is one bisect and two additions, buckets are only made
+#   cumulative when somebody scrapes /metrics
+# - gauges that need a system call (accept queue depth) are read at scrape time, not kept up to date
+#
+# phases measured per request:
+#   parse  first byte of the request received -> request fully parsed (includes the time the client took to send it)
+#   handle handle_request() building the response
+#   write  response queued -> last byte handed to the kernel
+#
+# with http_prefork.py every worker has its own numbers, a scrape sees whichever worker the kernel picked
+
+import socket
+import struct
+from bisect import bisect_left
+
+# seconds, roughly log spaced from 50 us to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+PHASES = ("parse", "handle", "write")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # upper bound of the bucket the q-th quantile falls into (the largest finite bound when it is in +Inf)
+    def quantile(self, q):
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return self.bounds[-1]
+
+    # (upper bound as text, cumulative count) pairs, ending with +Inf
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            yield ("+Inf" if bound == float("inf") else repr(bound)), total
+
+
+# linux reports a listening socket's accept queue through TCP_INFO: tcpi_unacked is the number of connections
+# waiting for accept() and tcpi_sacked the backlog limit. returns (depth, limit) or None elsewhere
+def accept_queue(listen_socket):
+    if listen_socket is None or not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = listen_socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except OSError:
+        return None
+    if len(info) < 32:
+        return None
+    return struct.unpack_from("II", info, 24)
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.accepted = 0
+        self.responses = {}                 # {status code: count}
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def count_response(self, status):
+        self.responses[status] = self.responses.get(status, 0) + 1
+
+    # the whole exposition, `server` supplies the gauges and the counters it keeps itself
+    def render(self, server):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        metric("http_requests_total", "counter", "Requests parsed.", [("", self.requests)])
+        metric("http_responses_total", "counter", "Responses by status code.",
+               [(f'{{code="{code}"}}', count) for code, count in sorted(self.responses.items())])
+        metric("http_received_bytes_total", "counter", "Bytes read from client sockets.", [("", self.bytes_in)])
+        metric("http_sent_bytes_total", "counter", "Bytes written to client sockets.", [("", self.bytes_out)])
+        metric("http_accepted_connections_total", "counter", "Connections accepted.", [("", self.accepted)])
+        metric("http_shed_connections_total", "counter", "Connections turned away with 503 at capacity.",
+               [("", server.shed_connections)])
+        metric("http_timed_out_connections_total", "counter", "Connections closed by a read or write deadline.",
+               [("", server.timed_out_connections)])
+        metric("http_open_connections", "gauge", "Connections currently open.", [("", len(server.connections))])
+
+        queue = accept_queue(server.server_socket)
+        if queue is not None:
+            metric("http_accept_queue_depth", "gauge", "Connections waiting in the listen backlog.", [("", queue[0])])
+            metric("http_accept_queue_limit", "gauge", "Listen backlog size.", [("", queue[1])])
+
+        name = "http_request_phase_seconds"
+        lines.append(f"# HELP {name} Time spent per request in each phase.")
+        lines.append(f"# TYPE {name} histogram")
+        for phase, histogram in self.phases.items():
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {histogram.count}')
+        return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,262 @@
+# keep-alive connection pool for the HTTP clients
+# the lab clients open a socket, send one request and close it, so every fetch pays for a TCP handshake
+# (and for a slow start that never gets going). HttpClient keeps connections open between requests instead:
+# - idle connections are pooled per (host, port), the most recently used one is handed out first
+# - before an idle connection is reused it is checked for staleness: too long idle, or readable while idle,
+#   which means the server closed it (EOF) or sent something we never asked for
+# - a GET/HEAD that fails on a reused connection before any response byte arrived is retried once on a new
+#   connection, servers are allowed to close idle keep-alive connections at any moment
+# - at most max_per_host connections per (host, port) and max_total overall, in use or idle; callers wait for a
+#   free slot, and an idle connection of another host is closed to make room when the total cap is hit
+# - idle connections older than idle_timeout are evicted
+# - every response carries a RequestTiming (http_timing.py) and `timings` has the histograms of all of them
+#
+# safe to share between threads. run this file directly for a fresh-connection vs pooled benchmark
+
+import select
+import threading
+import time
+from collections import deque
+
+from http_client_lib import build_request, connect, read_response, split_url
+from http_timing import RequestTiming, TimingHistograms, clock
+
+MAX_PER_HOST = 6
+MAX_TOTAL = 64
+
+# a little below the usual server keep-alive timeouts, so we drop connections before the server does
+IDLE_TIMEOUT = 4.0
+
+# seconds to wait for a free connection slot before giving up
+ACQUIRE_TIMEOUT = 30.0
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    def __init__(self, key, sock):
+        self.key = key                      # (host, port)
+        self.sock = sock
+        self.pending = bytearray()          # bytes read past the end of the last response
+        self.idle_since = None
+        self.requests = 0
+
+    # an idle keep-alive connection has nothing to read, anything readable is an EOF or garbage
+    def is_stale(self, now, idle_timeout):
+        if self.pending or now - self.idle_since > idle_timeout:
+            return True
+        try:
+            readable, writable, errored = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def close(self):
+        self.sock.close()
+
+
+class HttpClient:
+    def __init__(self, max_per_host=MAX_PER_HOST, max_total=MAX_TOTAL, idle_timeout=IDLE_TIMEOUT,
+                 connect_timeout=None, acquire_timeout=ACQUIRE_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.acquire_timeout = acquire_timeout
+        self.idle = {}                      # {(host, port): deque of PooledConnection, oldest first}
+        self.open_per_host = {}             # {(host, port): connections open, idle or in use}
+        self.open_total = 0
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+
+        self.created = 0
+        self.reused = 0
+        self.stale = 0
+        self.evicted = 0
+        self.retried = 0
+        self.timings = TimingHistograms()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # GET http://host[:port]/path
+    def get(self, url, headers=()):
+        host, port, path = split_url(url)
+        return self.request("GET", host, port, path, headers)
+
+    def request(self, method, host, port, path, headers=()):
+        request = build_request(host, path, headers, keep_alive=True, method=method)
+        key = (host, port)
+        # only requests that are safe to send twice are retried
+        attempts = 2 if method in ("GET", "HEAD") else 1
+        for attempt in range(attempts):
+            timing = RequestTiming()
+            conn, reused = self._acquire(key, timing)
+            try:
+                timing.send_start = clock()
+                conn.sock.sendall(request)
+                timing.sent = clock()
+                response = read_response(conn.sock, conn.pending, method, timing)
+            except BaseException as error:
+                # whatever went wrong (bad response, ctrl-c, ...) the connection is in an unknown state, its slot
+                # has to be given back either way
+                self._discard(conn)
+                if (reused and timing.first_byte is None and attempt + 1 < attempts
+                        and isinstance(error, (ConnectionError, OSError))):
+                    # the server closed the idle connection under us, that is not an error of the request
+                    self.retried += 1
+                    continue
+                raise
+            conn.requests += 1
+            if response.keep_alive():
+                self._release(conn, timing)
+            else:
+                self._discard(conn, timing)
+            return response
+
+    # an idle pooled connection or a new one, waits while the host or the whole pool is at its cap.
+    # `timing` starts once there is a connection or a slot for one, time spent waiting for the pool is not in it
+    def _acquire(self, key, timing):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                idle = self.idle.get(key)
+                while idle:
+                    conn = idle.pop()
+                    if not conn.is_stale(now, self.idle_timeout):
+                        self.reused += 1
+                        timing.start = clock()
+                        timing.reuse()
+                        return conn, True
+                    self.stale += 1
+                    self._forget(conn)
+                if self.open_per_host.get(key, 0) < self.max_per_host:
+                    if self.open_total >= self.max_total:
+                        self._close_oldest_idle()
+                    if self.open_total < self.max_total:
+                        # reserve the slot now, connect outside the lock
+                        self.open_per_host[key] = self.open_per_host.get(key, 0) + 1
+                        self.open_total += 1
+                        self.created += 1
+                        break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolTimeout(f"no free connection to {key[0]}:{key[1]}")
+                self.slot_freed.wait(remaining)
+
+        timing.start = clock()
+        try:
+            sock = connect(key[0], key[1], self.connect_timeout, timing)
+        except OSError:
+            with self.lock:
+                self._release_slot(key)
+            raise
+        return PooledConnection(key, sock), False
+
+    def _release(self, conn, timing=None):
+        with self.lock:
+            if timing is not None:
+                self.timings.add(timing)
+            conn.idle_since = time.monotonic()
+            self.idle.setdefault(conn.key, deque()).append(conn)
+            self.slot_freed.notify()
+
+    def _discard(self, conn, timing=None):
+        with self.lock:
+            if timing is not None:
+                self.timings.add(timing)
+            self._forget(conn)
+
+    # closes a connection and gives its slot back (lock held)
+    def _forget(self, conn):
+        conn.close()
+        self._release_slot(conn.key)
+
+    def _release_slot(self, key):
+        self.open_per_host[key] -= 1
+        if not self.open_per_host[key]:
+            del self.open_per_host[key]
+        self.open_total -= 1
+        self.slot_freed.notify_all()
+
+    # total cap reached: the connection idle the longest, whatever its host, makes room (lock held)
+    def _close_oldest_idle(self):
+        oldest = None
+        for idle in self.idle.values():
+            if idle and (oldest is None or idle[0].idle_since < oldest.idle_since):
+                oldest = idle[0]
+        if oldest is not None:
+            self.idle[oldest.key].popleft()
+            self.evicted += 1
+            self._forget(oldest)
+
+    # lock held
+    def _evict_idle(self, now):
+        for key in list(self.idle):
+            idle = self.idle[key]
+            while idle and now - idle[0].idle_since > self.idle_timeout:
+                self.evicted += 1
+                self._forget(idle.popleft())
+            if not idle:
+                del self.idle[key]
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                while idle:
+                    self._forget(idle.popleft())
+            self.idle.clear()
+
+    def stats(self):
+        return {"created": self.created, "reused": self.reused, "stale": self.stale, "evicted": self.evicted,
+                "retried": self.retried, "open": self.open_total}
+
+
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    from http_server import HttpServer
+
+    parser = argparse.ArgumentParser(description="Batched fetches: new connection per request vs HttpClient pool")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--host", default=None, help="fetch from a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/")
+    args = parser.parse_args()
+
+    if args.host is None:
+        server = HttpServer("127.0.0.1", 0, log_requests=False)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.host, args.port = "127.0.0.1", server.port
+
+    def fresh_connection(i):
+        sock = connect(args.host, args.port)
+        try:
+            sock.sendall(build_request(args.host, args.path, keep_alive=False))
+            return read_response(sock).status
+        finally:
+            sock.close()
+
+    with HttpClient(max_per_host=args.threads) as client:
+        def pooled(i):
+            return client.request("GET", args.host, args.port, args.path).status
+
+        for label, fetch in (("new connection per request", fresh_connection), ("pooled keep-alive", pooled)):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.threads) as executor:
+                statuses = list(executor.map(fetch, range(args.requests)))
+            elapsed = time.perf_counter() - start
+            assert all(status == 200 for status in statuses), statuses[:5]
+            print(f"{label:<28} {args.requests / elapsed:9.1f} requests/sec  "
+                  f"{elapsed / args.requests * args.threads * 1e6:8.1f} us per request")
+        print(f"pool: {client.stats()}")
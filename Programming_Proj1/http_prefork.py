@@ -0,0 +1,187 @@
+# prefork mode for http_server.py
+# one python process is limited by the GIL to about one core, so instead of one server we run N of them:
+# - a supervisor process forks N worker processes
+# - every worker creates its own HttpServer bound to the same HOST/PORT with SO_REUSEPORT,
+#   the kernel then spreads new connections across the workers' listen sockets
+# - if a worker dies the supervisor forks a replacement
+# - SIGTERM/SIGINT to the supervisor is forwarded to the workers, which stop accepting and finish their open
+#   connections (HttpServer.stop), anything still alive after the grace period is killed
+# - every other HttpServer option (static root, caches, compression, limits, timeouts, metrics) is passed through
+#   `server_kwargs`, so each worker is configured like a single http_server.py. caches, limits and metrics are per
+#   worker: --max-connections caps one worker, and /metrics shows the worker that happened to accept the scrape
+#
+# linux only (os.fork + SO_REUSEPORT)
+#
+# run this file with --scaling 1,2,4 to measure requests/sec for each worker count with http_load_test.py
+
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+from http_server import (HOST, PORT, LISTEN_BACKLOG, SHUTDOWN_GRACE, HttpServer, add_server_arguments,
+                         server_options)
+
+# a worker that keeps dying right after it was started is not restarted faster than this
+RESTART_DELAY = 1.0
+
+
+# runs inside a forked child, never returns
+def run_worker(host, port, backlog, log_requests, grace, server_kwargs=None):
+    # the supervisor handles ctrl-c for the whole group, the worker only reacts to the SIGTERM it forwards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = HttpServer(host, port, backlog, log_requests=log_requests, reuse_port=True, **(server_kwargs or {}))
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(grace))
+    exit_code = 0
+    try:
+        server.serve_forever()
+    except Exception as e:
+        print(f"worker {os.getpid()} crashed: {e}", file=sys.stderr)
+        exit_code = 1
+    # skip the parent's atexit handlers and buffered output, this is a forked copy of it
+    os._exit(exit_code)
+
+
+class PreforkSupervisor:
+    def __init__(self, workers, host=HOST, port=PORT, backlog=LISTEN_BACKLOG, log_requests=False,
+                 grace=SHUTDOWN_GRACE, server_kwargs=None):
+        self.worker_count = workers
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.log_requests = log_requests
+        self.grace = grace
+        self.server_kwargs = dict(server_kwargs or {})  # more HttpServer keyword arguments for every worker
+        self.workers = {}                   # {pid: start time}
+        self.stopping = False
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.host, self.port, self.backlog, self.log_requests, self.grace, self.server_kwargs)
+        self.workers[pid] = time.monotonic()
+
+    def handle_stop_signal(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop_signal)
+        signal.signal(signal.SIGINT, self.handle_stop_signal)
+        print(f"Supervisor {os.getpid()} starting {self.worker_count} workers on http://{self.host}:{self.port}")
+        for i in range(self.worker_count):
+            self.spawn_worker()
+
+        # poll instead of a blocking waitpid, python retries a blocking waitpid after our signal handler runs
+        while not self.stopping:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            if pid in self.workers:
+                started = self.workers.pop(pid)
+                print(f"worker {pid} exited with status {status}, restarting", file=sys.stderr)
+                # do not spin if the worker dies on startup (port in use, bad config, ...)
+                if time.monotonic() - started < RESTART_DELAY:
+                    time.sleep(RESTART_DELAY)
+            if not self.stopping:
+                while len(self.workers) < self.worker_count:
+                    self.spawn_worker()
+
+        self.shutdown()
+
+    # forward SIGTERM, wait out the grace period, then SIGKILL whatever is left
+    def shutdown(self):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        # a little longer than the workers' own grace so they normally exit by themselves
+        deadline = time.monotonic() + self.grace + 1.0
+        while self.workers and time.monotonic() < deadline:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.05)
+                continue
+            self.workers.pop(pid, None)
+
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.clear()
+        print("The server has shutdown")
+
+
+# waits until something accepts connections on host:port
+def wait_until_listening(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+# [(workers, http_load_test results)]: the same load against a fresh supervisor with each worker count
+def measure_scaling(worker_counts, host, port, server_kwargs=None, concurrency=64, duration=5.0, client_processes=1,
+                    keep_alive=False):
+    from http_load_test import run_load_test
+
+    results = []
+    for count in worker_counts:
+        supervisor = PreforkSupervisor(count, host, port, server_kwargs=server_kwargs)
+        process = multiprocessing.Process(target=supervisor.run)
+        process.start()
+        try:
+            wait_until_listening(host, port)
+            # the first connect only proves one worker is up
+            time.sleep(0.5)
+            results.append((count, run_load_test(host, port, "/", concurrency, duration, client_processes,
+                                                 keep_alive)))
+        finally:
+            os.kill(process.pid, signal.SIGTERM)
+            process.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run http_server.py with several worker processes "
+                                                 "(--max-connections and --cache-mb apply to each worker)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG)
+    parser.add_argument("--grace", type=float, default=SHUTDOWN_GRACE, help="seconds to finish open connections")
+    parser.add_argument("--log-requests", action="store_true")
+    add_server_arguments(parser)
+    parser.add_argument("--scaling", default=None,
+                        help="comma separated worker counts to load test one after the other instead of serving")
+    parser.add_argument("--duration", type=float, default=5.0, help="--scaling: seconds of load per worker count")
+    parser.add_argument("--concurrency", type=int, default=64, help="--scaling: client connections")
+    parser.add_argument("--client-processes", type=int, default=os.cpu_count() or 1,
+                        help="--scaling: processes the load generator runs in")
+    parser.add_argument("--keep-alive", action="store_true", help="--scaling: reuse one connection per client")
+    args = parser.parse_args()
+
+    if args.scaling is None:
+        PreforkSupervisor(args.workers, args.host, args.port, args.backlog, args.log_requests, args.grace,
+                          server_options(args)).run()
+    else:
+        counts = [int(count) for count in args.scaling.split(",")]
+        results = measure_scaling(counts, args.host, args.port, server_options(args), args.concurrency,
+                                  args.duration, args.client_processes, args.keep_alive)
+        print(f"{os.cpu_count()} cpus, {args.concurrency} connections, {args.client_processes} client processes")
+        base = results[0][1]["rps"]
+        for count, result in results:
+            print(f"{count:>3} workers: {result['rps']:9.1f} requests/sec  x{result['rps'] / base:5.2f}  "
+                  f"p99 {result['p99_ms']:7.2f} ms  {result['errors']} errors")
@@ -0,0 +1,223 @@
+# in-memory response cache for the static file mode of http_server.py
+# without it every hit on a file does stat + open + sendfile and rebuilds the header block.
+# for small files that are asked for over and over (index.html, css, icons) that is most of the work, so:
+# - the first GET for a small file is read into memory together with its serialized status line and headers
+# - later GETs for the same path are answered with one prebuilt buffer (a single write, no file access)
+# - the cache is an LRU bounded by bytes, not by entries, so a few big files can not push out many small ones
+# - entries are dropped when the file's inode, mtime or size changes. by default every hit stats the file,
+#   with a watch interval the server instead re-checks all entries in the background every few seconds
+#   (a polling stand-in for inotify, which the standard library does not have) and hits do no file access at all
+# - GET only, and requests with Range or conditional headers go to StaticFiles untouched
+# - with compression on, entries are kept per Accept-Encoding header value, so each variant is cached on its own
+#
+# run this file directly to compare requests/sec with and without the cache and print the hit rate and memory use
+
+import os
+import time
+from collections import OrderedDict
+
+from http_static import FileBody, StaticResponse
+
+# default limits, small enough to stay out of the way on a lab machine
+CACHE_BYTES = 32 * 1024 * 1024
+MAX_FILE_SIZE = 256 * 1024
+
+# requests with any of these headers need the full StaticFiles logic (206, 304, ...)
+BYPASS_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since")
+
+
+class CachedResponse:
+    # a complete serialized 200 response for one file
+    # `response` is the keep-alive version, for Connection: close only the header block differs,
+    # so that one is kept separately and sent together with a view of the same body bytes
+    def __init__(self, full_path, stat_result, headers, response, body_offset, close_head):
+        self.full_path = full_path
+        self.inode = stat_result.st_ino
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.headers = headers
+        self.response = response
+        self.body = memoryview(response)[body_offset:]
+        self.close_head = close_head
+
+    def __len__(self):
+        return len(self.body)
+
+    # bytes of memory this entry is charged for
+    def memory(self):
+        return len(self.response) + len(self.close_head)
+
+    # False once the file on disk is not the one we cached
+    def matches(self, stat_result):
+        return (stat_result.st_ino == self.inode and stat_result.st_mtime_ns == self.mtime_ns
+                and stat_result.st_size == self.size)
+
+
+class ResponseCache:
+    # `build_head(status, headers, content_length, keep_alive)` serializes the header block, the server passes its own
+    # `watch_interval` None -> stat the file on every hit, otherwise seconds between background re-checks
+    def __init__(self, static_files, build_head, max_bytes=CACHE_BYTES, max_file_size=MAX_FILE_SIZE,
+                 watch_interval=None):
+        self.static = static_files
+        self.build_head = build_head
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.watch_interval = watch_interval
+        self.entries = OrderedDict()        # {(path, accept-encoding): CachedResponse}, least recently used first
+        self.memory = 0
+        self.next_check = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # same interface as StaticFiles.respond, a hit has a CachedResponse as its body
+    def respond(self, request):
+        if request.method != "GET" or any(name in request.headers for name in BYPASS_HEADERS):
+            self.bypassed += 1
+            return self.static.respond(request)
+
+        # browsers send the same Accept-Encoding string every time, so the raw value is a good enough variant key
+        key = (request.path, request.headers.get("accept-encoding"))
+        entry = self.lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return StaticResponse(200, entry.headers, entry)
+
+        self.misses += 1
+        response = self.static.respond(request)
+        if response.status == 200 and response.source is not None and len(response.body) <= self.max_file_size:
+            entry = self.store(key, response)
+            if entry is not None:
+                return StaticResponse(200, entry.headers, entry)
+        return response
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self.watch_interval is None:
+            try:
+                current = os.stat(entry.full_path)
+            except OSError:
+                current = None
+            if current is None or not entry.matches(current):
+                self.invalidations += 1
+                self.remove(key)
+                return None
+        self.entries.move_to_end(key)
+        return entry
+
+    # turns a fresh 200 response into a new entry, a FileBody is read into memory and closed either way
+    def store(self, key, response):
+        body = response.body
+        full_path, stat_result = response.source
+        if isinstance(body, FileBody):
+            try:
+                data = os.pread(body.file.fileno(), body.length, body.offset)
+            except OSError:
+                return None
+            finally:
+                body.close()
+            if len(data) != body.length:
+                # the file changed between stat and read, do not cache a body that disagrees with the headers
+                return None
+        else:
+            data = bytes(body)
+
+        response_bytes = self.build_head(200, response.headers, len(data), True) + data
+        close_head = self.build_head(200, response.headers, len(data), False)
+        entry = CachedResponse(full_path, stat_result, response.headers, response_bytes,
+                               len(response_bytes) - len(data), close_head)
+
+        if entry.memory() > self.max_bytes:
+            return entry
+        self.remove(key)
+        self.entries[key] = entry
+        self.memory += entry.memory()
+        while self.memory > self.max_bytes:
+            oldest, evicted = self.entries.popitem(last=False)
+            self.memory -= evicted.memory()
+            self.evictions += 1
+        return entry
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.memory -= entry.memory()
+
+    # called from the server loop, in watch mode re-stats every entry once per interval
+    def poll(self):
+        if self.watch_interval is None:
+            return
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.watch_interval
+        for key, entry in list(self.entries.items()):
+            try:
+                current = os.stat(entry.full_path)
+            except OSError:
+                current = None
+            if current is None or not entry.matches(current):
+                self.invalidations += 1
+                self.remove(key)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "memory_bytes": self.memory,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hit_rate(),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def summary(self):
+        return (f"response cache: {len(self.entries)} entries, {self.memory / 1024:.1f} KB of "
+                f"{self.max_bytes / 1024:.0f} KB, hit rate {self.hit_rate() * 100:.1f}% "
+                f"({self.hits} hits, {self.misses} misses, {self.bypassed} bypassed), "
+                f"{self.evictions} evictions, {self.invalidations} invalidations")
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import threading
+
+    from http_load_test import run_load_test
+    from http_server import HttpServer
+
+    parser = argparse.ArgumentParser(description="Static file requests/sec with and without the response cache")
+    parser.add_argument("--file-kb", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--watch", type=float, default=None, help="use a watch interval instead of a stat per hit")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, "index.html"), "wb") as f:
+            f.write(b"<html>" + b"x" * (args.file_kb * 1024) + b"</html>\r\n")
+
+        for cache_mb in (0, 32):
+            server = HttpServer("127.0.0.1", 0, log_requests=False, static_root=root, cache_bytes=cache_mb * 1024 * 1024,
+                                cache_watch=args.watch)
+            server.start()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            results = run_load_test("127.0.0.1", server.port, "/index.html", args.concurrency, args.duration,
+                                    keep_alive=True)
+            label = "cache on " if cache_mb else "cache off"
+            print(f"{label}: {results['rps']:9.1f} requests/sec  p50 {results['p50_ms']:.2f} ms  "
+                  f"p99 {results['p99_ms']:.2f} ms")
+            if server.response_cache is not None:
+                print("  " + server.response_cache.summary())
+            server.stop(0)
@@ -0,0 +1,273 @@
+# parallel segmented download with HTTP Range requests
+# one TCP connection is limited by its own congestion window, on a long fat path (lots of bandwidth, long RTT)
+# it never gets to use the whole link. this downloader splits the file over several connections instead:
+# - a HEAD probe first gets the size, whether the server does byte ranges, and the ETag/Last-Modified
+# - the output file is preallocated to the full size, every range is written at its own offset with os.pwrite,
+#   so the segments can arrive in any order and nothing is reassembled in memory
+# - every range request carries If-Range with the probe's validator: if the file changed on the server meanwhile
+#   it answers 200 with the whole new file instead of a piece of it, and the download stops instead of mixing
+#   two versions of the file
+# - a range that fails (connection reset, timeout, short body) is retried on its own, from the byte where it
+#   stopped, the others are not touched
+# - at the end every byte of the file has to have been received exactly once, and with `sha256` the file's
+#   digest has to match too
+# servers without Accept-Ranges (or tiny files) are downloaded over one connection like http_client_large.py
+#
+# http_static.py serves Range/If-Range, run this file directly for a benchmark against a local server
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client_lib import (RECV_SIZE, HttpResponseError, build_request, connect, read_final_head, read_response,
+                             split_url, stream_body)
+
+CONNECTIONS = 4
+
+# files smaller than this are not worth splitting
+MIN_SEGMENT = 1024 * 1024
+
+RETRIES = 3
+RETRY_DELAY = 0.5
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RemoteFileChanged(DownloadError):
+    # the server no longer has the version the probe saw
+    pass
+
+
+class RemoteFile:
+    def __init__(self, host, port, path, size, validator, ranges):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.size = size
+        self.validator = validator          # ETag, or Last-Modified when there is no ETag, for If-Range
+        self.ranges = ranges                # the server said Accept-Ranges: bytes
+
+
+# ranges only make sense over the identity encoding, a gzip variant has different offsets
+IDENTITY = ("Accept-Encoding", "identity")
+
+
+def probe(host, port, path, timeout=None):
+    sock = connect(host, port, timeout)
+    try:
+        sock.sendall(build_request(host, path, [IDENTITY], keep_alive=False, method="HEAD"))
+        response = read_response(sock, method="HEAD")
+    finally:
+        sock.close()
+    if response.status != 200:
+        raise DownloadError(f"HEAD {path}: {response.status} {response.reason}")
+    headers = response.headers
+    try:
+        size = int(headers["content-length"])
+    except (KeyError, ValueError):
+        raise DownloadError(f"HEAD {path}: no usable Content-Length")
+    validator = headers.get("etag")
+    if validator is None or validator.startswith("W/"):
+        # weak ETags are not allowed in If-Range
+        validator = headers.get("last-modified")
+    ranges = headers.get("accept-ranges", "").lower() == "bytes" and "content-encoding" not in headers
+    return RemoteFile(host, port, path, size, validator, ranges)
+
+
+# [(start, end)] inclusive byte ranges, one per connection
+def split(size, connections, min_segment=MIN_SEGMENT):
+    count = max(1, min(connections, size // min_segment))
+    step = -(-size // count)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def _pwrite_all(fd, data, offset):
+    while data:
+        written = os.pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+
+
+class _Segment:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.next = start                   # first byte still missing
+        self.attempts = 0
+
+    def missing(self):
+        return self.end - self.next + 1
+
+
+# receives what is still missing of one segment into `fd`. on failure segment.next is the first byte that did
+# not arrive, the retry asks for the rest only
+def _fetch_segment(remote, segment, fd, timeout, buffer_size):
+    headers = [IDENTITY, ("Range", f"bytes={segment.next}-{segment.end}")]
+    if remote.validator is not None:
+        headers.append(("If-Range", remote.validator))
+    sock = connect(remote.host, remote.port, timeout)
+    try:
+        sock.sendall(build_request(remote.host, remote.path, headers, keep_alive=False))
+        pending = bytearray()
+        response = read_final_head(sock, pending)
+        if response.status == 200 and remote.validator is not None:
+            raise RemoteFileChanged(f"{remote.path} changed on the server during the download")
+        expected = f"bytes {segment.next}-{segment.end}/{remote.size}"
+        if response.status != 206 or response.headers.get("content-range") != expected:
+            raise DownloadError(f"asked for {expected}, got {response.status} "
+                                f"{response.headers.get('content-range', 'without Content-Range')}")
+
+        def write(view):
+            if len(view) > segment.missing():
+                raise DownloadError(f"server sent more than bytes {segment.start}-{segment.end}")
+            _pwrite_all(fd, view, segment.next)
+            segment.next += len(view)
+
+        stream_body(sock, response, write, pending, buffer_size=buffer_size)
+    finally:
+        sock.close()
+    if segment.missing():
+        raise ConnectionError(f"bytes {segment.next}-{segment.end} never arrived")
+
+
+def _fetch_with_retries(remote, segment, fd, timeout, buffer_size, retries, log):
+    while True:
+        segment.attempts += 1
+        try:
+            _fetch_segment(remote, segment, fd, timeout, buffer_size)
+            return segment
+        except (ConnectionError, OSError, HttpResponseError) as error:
+            if segment.attempts > retries:
+                raise DownloadError(f"bytes {segment.start}-{segment.end}: gave up after "
+                                    f"{segment.attempts} attempts ({error})")
+            log(f"bytes {segment.next}-{segment.end}: {error!r}, retrying")
+            time.sleep(RETRY_DELAY * segment.attempts)
+
+
+# one connection, no ranges, for servers that do not support them
+def _fetch_whole(remote, fd, timeout, buffer_size):
+    sock = connect(remote.host, remote.port, timeout)
+    offset = 0
+    try:
+        sock.sendall(build_request(remote.host, remote.path, [IDENTITY], keep_alive=False))
+        pending = bytearray()
+        response = read_final_head(sock, pending)
+        if response.status != 200:
+            raise DownloadError(f"GET {remote.path}: {response.status} {response.reason}")
+
+        def write(view):
+            nonlocal offset
+            _pwrite_all(fd, view, offset)
+            offset += len(view)
+
+        stream_body(sock, response, write, pending, buffer_size=buffer_size)
+    finally:
+        sock.close()
+    return offset
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(RECV_SIZE * 16)
+            if not data:
+                return digest.hexdigest()
+            digest.update(data)
+
+
+# downloads http://host[:port]/path into `output`, returns the RemoteFile. the file is left in place on failure,
+# partly filled
+def download(url, output, connections=CONNECTIONS, retries=RETRIES, sha256=None, timeout=30.0,
+             buffer_size=RECV_SIZE, min_segment=MIN_SEGMENT, log=print):
+    host, port, path = split_url(url)
+    remote = probe(host, port, path, timeout)
+
+    fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # reserve the blocks up front, segments written out of order then do not fragment the file
+        if hasattr(os, "posix_fallocate") and remote.size:
+            try:
+                os.posix_fallocate(fd, 0, remote.size)
+            except OSError:
+                os.ftruncate(fd, remote.size)
+        else:
+            os.ftruncate(fd, remote.size)
+
+        if not remote.ranges or connections <= 1 or remote.size < 2 * min_segment:
+            received = _fetch_whole(remote, fd, timeout, buffer_size)
+            if received != remote.size:
+                raise DownloadError(f"got {received} bytes, HEAD said {remote.size}")
+        else:
+            segments = [_Segment(start, end) for start, end in split(remote.size, connections, min_segment)]
+            with ThreadPoolExecutor(len(segments)) as executor:
+                futures = [executor.submit(_fetch_with_retries, remote, segment, fd, timeout, buffer_size,
+                                           retries, log) for segment in segments]
+                for future in futures:
+                    future.result()
+            # every byte from 0 to size-1 has to be covered exactly once
+            covered = 0
+            for segment in segments:
+                if segment.start != covered or segment.missing():
+                    raise DownloadError(f"bytes {segment.start}-{segment.end} incomplete")
+                covered = segment.end + 1
+            if covered != remote.size:
+                raise DownloadError(f"segments cover {covered} of {remote.size} bytes")
+        if os.fstat(fd).st_size != remote.size:
+            raise DownloadError(f"{output} is {os.fstat(fd).st_size} bytes, expected {remote.size}")
+    finally:
+        os.close(fd)
+
+    if sha256 is not None and file_sha256(output) != sha256.lower():
+        raise DownloadError(f"{output}: SHA-256 does not match")
+    return remote
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import threading
+
+    from http_server import HttpServer
+
+    class FlakyServer(HttpServer):
+        # drops every `fail_every`th range request halfway, to show segments being retried on their own
+        def __init__(self, *args, fail_every=0, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.fail_every = fail_every
+            self.range_requests = 0
+
+        def handle_request(self, request):
+            status, headers, body = super().handle_request(request)
+            if status == 206 and self.fail_every:
+                self.range_requests += 1
+                if self.range_requests % self.fail_every == 0:
+                    body.length //= 2
+            return status, headers, body
+
+    parser = argparse.ArgumentParser(description="Segmented Range download vs one connection")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--connections", default="1,2,4,8")
+    parser.add_argument("--fail-every", type=int, default=0, help="cut every Nth range response short")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        source = os.path.join(root, "big.bin")
+        with open(source, "wb") as f:
+            for i in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        expected = file_sha256(source)
+        server = FlakyServer("127.0.0.1", 0, log_requests=False, static_root=root, fail_every=args.fail_every)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        output = os.path.join(root, "download.bin")
+        for connections in [int(count) for count in args.connections.split(",")]:
+            start = time.perf_counter()
+            download(f"http://127.0.0.1:{server.port}/big.bin", output, connections, sha256=expected)
+            elapsed = time.perf_counter() - start
+            print(f"{connections} connection(s): {args.size_mb / elapsed:8.1f} MB/s, SHA-256 verified")
+        server.stop(0)
@@ -7,51 +7,708 @@
 
 # ***I USED THE OFFICIAL PYTHON MANUAL AND WATCHED some youtube videos on the topics if I was still a bit confuesed *** -> ontop of textbook examples and notes that were provided
 
+# the original version accepted exactly one connection, did one recv(1024), replied and exited.
+# this version keeps the same request/response behaviour but runs as a long lived server:
+# - every socket is non-blocking and registered with a selector (epoll on linux), one loop serves every connection
+# - each connection is a small state machine: OPEN (reading requests / writing responses) -> CLOSING -> CLOSED
+# - partial reads and partial writes are expected, the state machine just waits for the next readiness event
+# - HTTP/1.1 keep-alive: every response carries Content-Length so the connection can stay open for the next request
+# - pipelining: several requests can arrive back to back, they are answered strictly in the order they came in
+# - every connection has a deadline (idle keep-alive, header read, body read, write, async stream piece) kept on a
+#   timer wheel, so slow clients that trickle a request in byte by byte (slowloris) or never read, and async
+#   generators stuck on an await, are closed in time
+# - at most MAX_CONNECTIONS open connections, past that new clients get a fast 503 instead of queueing up
+# - requests are read with the incremental parser in http_parser.py (recv_into a reusable buffer, size limits)
+# - with --root DIR the server serves files from DIR (http_static.py), file bodies go out with os.sendfile
+# - --cache-mb N keeps small hot files as prebuilt responses in memory (http_response_cache.py)
+# - --compress sends text files gzip/deflate encoded when the client accepts it (http_compression.py)
+# - handle_request may return a generator or async generator as the body, it is streamed chunked (http_streaming.py)
+# - an exception in handle_request is logged and answered with a 500, only that connection is closed
+# - GET /metrics returns counters and parse/handle/write latency histograms in Prometheus format (http_metrics.py)
+
+import argparse
+import inspect
+import os
+import selectors
 import socket
+import sys
+import time
+import traceback
+from collections import deque
+
+from http_compression import Compressor
+from http_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, ServerMetrics
+from http_parser import HEADERS, HttpParseError, HttpRequest, HttpRequestParser
+from http_response_cache import CachedResponse, ResponseCache
+from http_static import FileBody, StaticFiles
+from http_streaming import AsyncRunner, StreamBody, Wakeup
+from http_timer_wheel import TimerWheel
 
 #bind to the localhost to listen for TCP connections only from my computer
 HOST = "127.0.0.1"
 PORT = 8080
 
-# AF_INET -> IPv4, SOCK_STREAM -> TCP CONNECTION 
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# pending connections the kernel queues for us before accept() (the lab used 1, a real server needs far more)
+# linux silently caps this at net.core.somaxconn
+LISTEN_BACKLOG = 1024
+
+# open connections we serve at once, clients past this get a 503 and are closed right away
+MAX_CONNECTIONS = 4096
+
+# seconds a stopping server keeps serving the connections it already has before closing them
+SHUTDOWN_GRACE = 5.0
+
+# seconds a keep-alive connection may sit idle between requests
+KEEPALIVE_TIMEOUT = 5.0
+
+# seconds from the first byte of a request until its headers are complete, and for the whole body after that
+HEADER_TIMEOUT = 10.0
+BODY_TIMEOUT = 30.0
+
+# seconds a connection may have output queued without the client reading any of it
+WRITE_TIMEOUT = 30.0
+
+# seconds an async stream may take to produce its next piece, a generator stuck on an await does not hold its
+# connection open forever
+STREAM_TIMEOUT = 30.0
+
+# requests served on one connection before we ask the client to reconnect
+MAX_KEEPALIVE_REQUESTS = 1000
+
+# stop reading pipelined requests while this many response bytes are still waiting to be written
+MAX_PENDING_OUTPUT = 256 * 1024
+
+# largest piece of a file handed to one os.sendfile call
+SENDFILE_CHUNK = 4 * 1024 * 1024
+
+# tells the kernel more data follows right away (linux), so a header block is not sent on its own ahead of a file
+MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+# the html the lab asked us to send back
+RESPONSE_BODY = "<html>Congratulations! You've downloaded the first Wireshark lab file!</html>\r\n"
+
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+# status line + headers, Content-Length set so the client knows where the response ends
+# (204 and 304 never have a body so they get no Content-Length, streamed bodies pass None and are chunked instead)
+def build_head(status, headers, content_length, keep_alive):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+    for name, value in headers:
+        lines.append(f"{name}: {value}")
+    if content_length is not None and status not in (204, 304):
+        lines.append(f"Content-Length: {content_length}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def build_response(status, headers, body, keep_alive):
+    return build_head(status, headers, len(body), keep_alive) + body
+
+
+# built once, shedding load has to be cheaper than serving it
+SERVICE_UNAVAILABLE = build_response(503, [("Content-Type", "text/plain"), ("Retry-After", "1")],
+                                     b"503 Service Unavailable\r\n", False)
+REQUEST_TIMEOUT = build_response(408, [("Content-Type", "text/plain")], b"408 Request Timeout\r\n", False)
+INTERNAL_SERVER_ERROR = build_response(500, [("Content-Type", "text/plain")], b"500 Internal Server Error\r\n",
+                                       False)
+
+
+class HttpConnection:
+    # connection states
+    OPEN = "open"                           # reading requests and writing responses
+    CLOSING = "closing"                     # no more requests, close once the queued responses are written
+    CLOSED = "closed"
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.state = HttpConnection.OPEN
+        self.parser = HttpRequestParser()   # holds request bytes received but not parsed yet
+        self.out_queue = deque()            # responses waiting to be written, in request order
+        self.out_pending = 0                # bytes in out_queue
+        self.events = selectors.EVENT_READ  # what the selector currently watches for
+        self.last_active = time.monotonic()  # last time bytes moved in either direction
+        self.request_started = None         # first byte of the request being read arrived
+        self.body_started = None            # headers of the request being read were complete
+        self.write_started = None           # first response in out_queue was queued
+        self.requests_served = 0
+
+    def queue_response(self, response):
+        self.out_queue.append(memoryview(response))
+        self.out_pending += len(response)
+
+    # file bodies stay in the queue as FileBody items and are written with os.sendfile
+    def queue_file(self, body):
+        self.out_queue.append(body)
+        self.out_pending += len(body)
+
+
+class HttpServer:
+    def __init__(self, host=HOST, port=PORT, backlog=LISTEN_BACKLOG, log_requests=True, reuse_port=False,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, static_root=None, cache_bytes=0, cache_watch=None,
+                 compress=False, compress_min_size=None, compress_cache_bytes=None, max_connections=MAX_CONNECTIONS,
+                 header_timeout=HEADER_TIMEOUT, body_timeout=BODY_TIMEOUT, write_timeout=WRITE_TIMEOUT,
+                 stream_timeout=STREAM_TIMEOUT, metrics_path="/metrics"):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.log_requests = log_requests
+        self.reuse_port = reuse_port        # several processes bind the same port and the kernel balances accepts
+        self.keepalive_timeout = keepalive_timeout
+        self.max_connections = max_connections
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.write_timeout = write_timeout
+        self.stream_timeout = stream_timeout
+        self.metrics = ServerMetrics()
+        self.metrics_path = metrics_path    # None turns the endpoint off, the numbers are still kept
+        self.compressor = None
+        if compress:
+            self.compressor = Compressor()
+            if compress_min_size is not None:
+                self.compressor.min_size = compress_min_size
+            if compress_cache_bytes is not None:
+                self.compressor.max_bytes = compress_cache_bytes
+        self.static = StaticFiles(static_root, self.compressor) if static_root is not None else None
+        self.response_cache = None
+        if self.static is not None and cache_bytes > 0:
+            self.response_cache = ResponseCache(self.static, build_head, cache_bytes, watch_interval=cache_watch)
+        self.selector = selectors.DefaultSelector()
+        self.server_socket = None
+        self.connections = {}               # {fd: HttpConnection}
+        self.wakeup = None                  # other threads hand finished async stream pieces back through this
+        self.async_runner = None            # started on the first async generator body
+        self.running = False
+        self.stop_deadline = None           # set while draining connections after stop()
+        self.timers = TimerWheel(time.monotonic())
+        self.shed_connections = 0           # turned away with 503 at capacity
+        self.timed_out_connections = 0      # closed by a deadline
+
+    def start(self):
+        # AF_INET -> IPv4, SOCK_STREAM -> TCP CONNECTION
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # lets us restart the server right away instead of waiting for TIME_WAIT to clear
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        somaxconn = self._somaxconn()
+        if somaxconn is not None and self.backlog > somaxconn:
+            print(f"listen backlog {self.backlog} is capped by net.core.somaxconn={somaxconn}", file=sys.stderr)
+        self.server_socket.setblocking(False)
+        # port 0 means the OS picked one, remember the real port
+        self.port = self.server_socket.getsockname()[1]
+        self.selector.register(self.server_socket, selectors.EVENT_READ, None)
+        self.wakeup = Wakeup()
+        self.selector.register(self.wakeup.reader, selectors.EVENT_READ, self.wakeup)
+        self.running = True
+        print(f"Server is listening on: http://{self.host}:{self.port}")
+
+    @staticmethod
+    def _somaxconn():
+        try:
+            with open("/proc/sys/net/core/somaxconn") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    # the event loop: wait until some socket is ready and hand it to the right handler
+    def serve_forever(self):
+        if self.server_socket is None:
+            self.start()
+        try:
+            while self.running or self._draining():
+                for key, events in self.selector.select(timeout=0.5):
+                    if key.data is None:
+                        self._accept()
+                        continue
+                    if key.data is self.wakeup:
+                        self._on_wakeup()
+                        continue
+                    conn = key.data
+                    if events & selectors.EVENT_READ and conn.state == HttpConnection.OPEN:
+                        self._on_readable(conn)
+                    if events & selectors.EVENT_WRITE and conn.state != HttpConnection.CLOSED:
+                        self._on_writable(conn)
+                self._reap_connections()
+                if self.response_cache is not None:
+                    self.response_cache.poll()
+        finally:
+            self.close()
+
+    # graceful stop: no new connections, the open ones get up to `grace` seconds to finish
+    # (only sets flags so it is safe to call from a signal handler)
+    def stop(self, grace=SHUTDOWN_GRACE):
+        self.running = False
+        self.stop_deadline = time.monotonic() + grace
+
+    # True while a stopped server still has connections inside the grace period
+    def _draining(self):
+        if self.server_socket is not None:
+            # stop accepting first so the kernel sends new clients to the other workers
+            self.selector.unregister(self.server_socket)
+            self.server_socket.close()
+            self.server_socket = None
+        return bool(self.connections) and self.stop_deadline is not None and time.monotonic() < self.stop_deadline
+
+    def close(self):
+        for conn in list(self.connections.values()):
+            self._close_connection(conn)
+        if self.server_socket is not None:
+            self.selector.unregister(self.server_socket)
+            self.server_socket.close()
+            self.server_socket = None
+        if self.wakeup is not None:
+            self.selector.unregister(self.wakeup.reader)
+            self.wakeup.close()
+            self.wakeup = None
+        if self.async_runner is not None:
+            self.async_runner.stop()
+            self.async_runner = None
+        self.selector.close()
+
+    # accept every connection that is waiting, not just one, so a burst of clients does not sit in the backlog
+    def _accept(self):
+        while True:
+            try:
+                client_socket, client_address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # out of file descriptors or the client gave up, try again on the next event
+                return
+            client_socket.setblocking(False)
+            self.metrics.accepted += 1
+            if len(self.connections) >= self.max_connections:
+                self._shed(client_socket)
+                continue
+            # responses are written whole, Nagle would only hold back the tail of a file behind a delayed ACK
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = HttpConnection(client_socket, client_address)
+            self.connections[client_socket.fileno()] = conn
+            self.selector.register(client_socket, selectors.EVENT_READ, conn)
+            self.timers.schedule(conn, conn.last_active + self.keepalive_timeout)
+
+    # at capacity: answer 503 without registering the socket or parsing anything
+    def _shed(self, client_socket):
+        self.shed_connections += 1
+        self.metrics.count_response(503)
+        try:
+            # read what already arrived, closing with unread data sends a RST that can destroy the 503 on the way
+            client_socket.recv(4096)
+        except OSError:
+            pass
+        try:
+            # counted here, the canned responses never go through _send_buffers
+            self.metrics.bytes_out += client_socket.send(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        client_socket.close()
+
+    def _on_readable(self, conn):
+        between_requests = conn.parser.state == HEADERS and not conn.parser.buffered()
+        try:
+            received = conn.parser.recv_into(conn.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except HttpParseError as e:
+            self._reject(conn, e)
+            return
+        except OSError:
+            self._close_connection(conn)
+            return
+
+        if not received:
+            # client closed its side, finish writing whatever it already asked for
+            conn.state = HttpConnection.CLOSING
+            self._after_io(conn)
+            return
+
+        self.metrics.bytes_in += received
+        conn.last_active = time.monotonic()
+        if between_requests:
+            conn.request_started = conn.last_active
+        self._process_requests(conn)
+        # most responses fit in the socket buffer, try right away instead of waiting a loop for EVENT_WRITE
+        if conn.out_queue:
+            self._on_writable(conn)
+        else:
+            self._after_io(conn)
+
+    # answers every complete request in the buffer, in order (pipelining)
+    def _process_requests(self, conn):
+        while conn.state == HttpConnection.OPEN and conn.out_pending < MAX_PENDING_OUTPUT:
+            try:
+                request = conn.parser.next_request()
+            except HttpParseError as e:
+                self._reject(conn, e)
+                return
+            if request is None:
+                if conn.parser.state != HEADERS and conn.body_started is None:
+                    conn.body_started = time.monotonic()
+                return
+
+            conn.requests_served += 1
+            metrics = self.metrics
+            metrics.requests += 1
+            now = time.monotonic()
+            if conn.request_started is not None:
+                metrics.phases["parse"].observe(now - conn.request_started)
+            # the read deadlines start over for whatever follows this request
+            conn.request_started = now if conn.parser.buffered() else None
+            conn.body_started = None
+            keep_alive = request.wants_keep_alive() and conn.requests_served < MAX_KEEPALIVE_REQUESTS and self.running
+
+            if request.path == self.metrics_path:
+                status, headers, body = 200, [("Content-Type", METRICS_CONTENT_TYPE)], metrics.render(self)
+            else:
+                try:
+                    status, headers, body = self.handle_request(request)
+                except Exception:
+                    # a broken handler costs this one connection, not the loop and everybody else on it
+                    self._internal_error(conn, request)
+                    return
+            handled = time.monotonic()
+            metrics.phases["handle"].observe(handled - now)
+            metrics.count_response(status)
+            if not conn.out_queue:
+                conn.write_started = handled
+            keep_alive = self._queue_result(conn, request, status, headers, body, keep_alive)
+            if not keep_alive:
+                conn.state = HttpConnection.CLOSING
+
+    # queues the response for one request, returns whether the connection stays open after it
+    def _queue_result(self, conn, request, status, headers, body, keep_alive):
+        if isinstance(body, CachedResponse):
+            # prebuilt response, the common keep-alive case is one buffer, close only swaps the header block
+            if keep_alive:
+                conn.queue_response(body.response)
+            else:
+                conn.queue_response(body.close_head)
+                conn.queue_response(body.body)
+            return keep_alive
+        if inspect.isgenerator(body) or inspect.isasyncgen(body):
+            return self._queue_stream(conn, request, status, headers, body, keep_alive)
+        conn.queue_response(build_head(status, headers, len(body), keep_alive))
+        # HEAD gets the headers of the GET response but never a body
+        if request.method == "HEAD" or status in (204, 304) or not len(body):
+            if isinstance(body, FileBody):
+                body.close()
+            return keep_alive
+        if isinstance(body, FileBody):
+            conn.queue_file(body)
+        else:
+            conn.queue_response(body)
+        return keep_alive
+
+    # generator bodies: chunked for HTTP/1.1, for HTTP/1.0 the body just runs until we close the connection
+    def _queue_stream(self, conn, request, status, headers, body, keep_alive):
+        chunked = request.version != "HTTP/1.0"
+        if chunked:
+            headers = headers + [("Transfer-Encoding", "chunked")]
+        else:
+            keep_alive = False
+        conn.queue_response(build_head(status, headers, None, keep_alive))
+        runner = None
+        if inspect.isasyncgen(body):
+            if self.async_runner is None:
+                self.async_runner = AsyncRunner()
+            runner = self.async_runner
+        stream = StreamBody(body, chunked, runner)
+        if request.method == "HEAD" or status in (204, 304):
+            stream.close()
+        else:
+            conn.out_queue.append(stream)
+        return keep_alive
+
+    # answer a request we could not parse and close, the rest of the byte stream can not be trusted
+    def _reject(self, conn, error):
+        self.metrics.count_response(error.status)
+        body = f"{error.status} {REASONS.get(error.status, 'Error')}: {error}\r\n".encode()
+        conn.queue_response(build_response(error.status, [("Content-Type", "text/plain")], body, False))
+        conn.state = HttpConnection.CLOSING
+        self._on_writable(conn)
+
+    # the responses queued before this request still go out, then the 500 and the connection is closed
+    def _internal_error(self, conn, request):
+        print(f"handling {request.method} {request.path} from {conn.address} failed:", file=sys.stderr)
+        traceback.print_exc()
+        self.metrics.count_response(500)
+        conn.queue_response(INTERNAL_SERVER_ERROR)
+        conn.state = HttpConnection.CLOSING
+
+    def _on_writable(self, conn):
+        try:
+            # can be empty: an unchunked (HTTP/1.0) async stream that just finished leaves nothing to send
+            head = conn.out_queue[0] if conn.out_queue else None
+            if isinstance(head, StreamBody):
+                # the pieces before the stream are all written, time to ask the generator for more
+                self._pull_stream(conn, head)
+                if conn.state == HttpConnection.CLOSED:
+                    return
+                head = conn.out_queue[0] if conn.out_queue else None
+            if isinstance(head, FileBody):
+                self._send_file(conn, head)
+            elif isinstance(head, memoryview):
+                self._send_buffers(conn)
+            conn.last_active = time.monotonic()
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close_connection(conn)
+            return
+
+        if not conn.out_queue:
+            if conn.write_started is not None:
+                self.metrics.phases["write"].observe(time.monotonic() - conn.write_started)
+                conn.write_started = None
+            if conn.state == HttpConnection.CLOSING:
+                self._close_connection(conn)
+                return
+            # responses drained, pipelined requests that were held back can be answered now
+            if conn.parser.buffered():
+                self._process_requests(conn)
+                if conn.out_queue:
+                    self._on_writable(conn)
+                    return
+        self._after_io(conn)
+
+    # gather write: every queued buffer up to the next file goes to the kernel in one system call
+    def _send_buffers(self, conn):
+        buffers = []
+        flags = 0
+        for item in conn.out_queue:
+            if isinstance(item, FileBody):
+                flags = MSG_MORE
+                break
+            if isinstance(item, StreamBody) or len(buffers) == 64:
+                break
+            buffers.append(item)
+        sent = conn.sock.sendmsg(buffers, [], flags)
+        self.metrics.bytes_out += sent
+
+        conn.out_pending -= sent
+        while sent:
+            head = conn.out_queue[0]
+            if sent >= len(head):
+                sent -= len(head)
+                conn.out_queue.popleft()
+            else:
+                conn.out_queue[0] = head[sent:]
+                sent = 0
+
+    # file bytes go from the page cache to the socket inside the kernel
+    def _send_file(self, conn, body):
+        count = min(body.length, SENDFILE_CHUNK)
+        sent = os.sendfile(conn.sock.fileno(), body.file.fileno(), body.offset, count)
+        if sent == 0:
+            # the file got shorter since we sent Content-Length, the response can not be completed
+            raise OSError("file truncated while sending")
+        self.metrics.bytes_out += sent
+        body.offset += sent
+        body.length -= sent
+        conn.out_pending -= sent
+        if body.length == 0:
+            body.close()
+            conn.out_queue.popleft()
+
+    # sync generators are advanced right here, async ones are handed to the runner and come back via _on_wakeup
+    def _pull_stream(self, conn, stream):
+        if stream.is_async:
+            if not stream.waiting():
+                stream.request_next(lambda: self.wakeup.notify(conn))
+            return
+        try:
+            buffers, size = stream.pull()
+        except Exception as e:
+            self._abort_stream(conn, e)
+            return
+        self._stream_ready(conn, stream, buffers, size)
+
+    # puts freshly produced pieces in front of their stream, drops the stream once it is finished
+    def _stream_ready(self, conn, stream, buffers, size):
+        conn.out_queue.popleft()
+        if not stream.finished:
+            conn.out_queue.appendleft(stream)
+        for data in reversed(buffers):
+            conn.out_queue.appendleft(memoryview(data))
+        conn.out_pending += size
+
+    # the status line is long gone, all we can do is close without the last chunk so the client sees the body is cut
+    def _abort_stream(self, conn, error):
+        print(f"streaming response to {conn.address} failed: {error!r}", file=sys.stderr)
+        self._close_connection(conn)
+
+    # async stream pieces finished by the runner thread
+    def _on_wakeup(self):
+        self.wakeup.drain()
+        while self.wakeup.ready:
+            conn = self.wakeup.ready.popleft()
+            if conn.state == HttpConnection.CLOSED or not conn.out_queue:
+                continue
+            stream = conn.out_queue[0]
+            if not isinstance(stream, StreamBody) or not stream.waiting():
+                continue
+            try:
+                buffers, size = stream.take_result()
+            except Exception as e:
+                self._abort_stream(conn, e)
+                continue
+            self._stream_ready(conn, stream, buffers, size)
+            self._on_writable(conn)
+
+    # keeps the selector registration in line with what the connection is waiting for
+    def _after_io(self, conn):
+        if conn.state == HttpConnection.CLOSED:
+            return
+        if conn.state == HttpConnection.CLOSING and not conn.out_queue:
+            self._close_connection(conn)
+            return
+
+        events = 0
+        if conn.state == HttpConnection.OPEN and conn.out_pending < MAX_PENDING_OUTPUT:
+            events |= selectors.EVENT_READ
+        if conn.out_queue and not (isinstance(conn.out_queue[0], StreamBody) and conn.out_queue[0].waiting()):
+            events |= selectors.EVENT_WRITE
+        if events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+
+        self.timers.schedule(conn, self._deadline(conn))
+
+    # when the connection has to have made progress by
+    def _deadline(self, conn):
+        if conn.out_queue:
+            head = conn.out_queue[0]
+            if isinstance(head, StreamBody) and head.waiting():
+                # waiting on our own async generator, not on the client
+                return head.requested_at + self.stream_timeout
+            return conn.last_active + self.write_timeout
+        if conn.body_started is not None:
+            return conn.body_started + self.body_timeout
+        if conn.request_started is not None:
+            # a slowloris client keeps last_active fresh with one byte at a time, this deadline does not move
+            return conn.request_started + self.header_timeout
+        return conn.last_active + self.keepalive_timeout
+
+    # closes the connections whose deadline passed, the ones that made progress go back on the wheel
+    def _reap_connections(self):
+        now = time.monotonic()
+        for conn in self.timers.advance(now):
+            if conn.state == HttpConnection.CLOSED:
+                continue
+            deadline = self._deadline(conn)
+            if deadline > now:
+                self.timers.schedule(conn, deadline)
+                continue
+            if conn.out_queue:
+                self.timed_out_connections += 1
+            elif conn.request_started is not None or conn.body_started is not None:
+                self.timed_out_connections += 1
+                self.metrics.count_response(408)
+                try:
+                    self.metrics.bytes_out += conn.sock.send(REQUEST_TIMEOUT)
+                except OSError:
+                    pass
+            self._close_connection(conn)
 
-#bind the created socket to my IP address and the chosen port
-server_socket.bind((HOST, PORT))
+    def _close_connection(self, conn):
+        if conn.state == HttpConnection.CLOSED:
+            return
+        conn.state = HttpConnection.CLOSED
+        self.timers.cancel(conn)
+        for item in conn.out_queue:
+            if isinstance(item, (FileBody, StreamBody)):
+                item.close()
+        conn.out_queue.clear()
+        self.connections.pop(conn.sock.fileno(), None)
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
 
-# backlog = 1 -> a maximum of 1 queued connection which is enough for this lab
-server_socket.listen(1)
-print(f"Server is listening on: http://{HOST}:{PORT}")
- 
-#sits and waits for the TCP connection to be made from my local browser. 
-#once the accept() clause finishes and the connection has been made, the server returns 2 things
-# client_socket = a new TCP connection for communicating only with the localhost (this is how multiple TCP conncetion can be made to a server simutaneuously)
-# client_address = the IP address and port number of the client (my browser)
-client_socket, client_address = server_socket.accept()
-print(f"Accepted a conncetion from {client_address}")
+    # builds the (status, headers, body) for one complete request, the server adds the framing headers
+    def handle_request(self, request):
+        if self.log_requests:
+            print("\n-----Request Recieved-----")
+            #decode the bytes request that the browser made and print to the terminal (browser does not see this, only the terminal does)
+            print(request.raw.decode(errors = 'replace'))
 
-# read the bytes request from the client (my browser) 
-request_data = client_socket.recv(1024)
-print("\n-----Request Recieved-----")
-#decode the bytes request that the browser made and print to the terminal (browser does not see this, only the terminal does)
-print(request_data.decode(errors = 'replace'))
+        if self.static is not None:
+            response = (self.response_cache or self.static).respond(request)
+            return response.status, response.headers, response.body
 
-# the send function of the socket library requires that the information being sent is in bytes
-# because of this rencode the data and then send it back to the client to display
+        return 200, [("Content-Type", "text/html; charset=UTF-8")], RESPONSE_BODY.encode()
 
-response = (
-    "HTTP/1.1 200 OK\r\n"
-    "Content-Type: text/html; charset=UTF-8\r\n\r\n"
-    "<html>Congratulations! You've downloaded the first Wireshark lab file!</html>\r\n"
-)
 
-client_socket.send(response.encode())
+# the server options shared by this file's command line and http_prefork.py, everything but host/port/backlog
+def add_server_arguments(parser):
+    parser.add_argument("--keepalive-timeout", type=float, default=KEEPALIVE_TIMEOUT)
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument("--header-timeout", type=float, default=HEADER_TIMEOUT)
+    parser.add_argument("--body-timeout", type=float, default=BODY_TIMEOUT)
+    parser.add_argument("--write-timeout", type=float, default=WRITE_TIMEOUT)
+    parser.add_argument("--stream-timeout", type=float, default=STREAM_TIMEOUT,
+                        help="seconds an async streamed body may take for its next piece")
+    parser.add_argument("--root", default=None, help="serve files from this directory instead of the lab page")
+    parser.add_argument("--cache-mb", type=float, default=0, help="memory for cached small files (0 = no cache)")
+    parser.add_argument("--cache-watch", type=float, default=None,
+                        help="re-check cached files every N seconds instead of on every hit")
+    parser.add_argument("--compress", action="store_true", help="gzip/deflate text files for clients that accept it")
+    parser.add_argument("--compress-min-size", type=int, default=None, help="smallest file worth compressing (bytes)")
+    parser.add_argument("--compress-cache-mb", type=float, default=None, help="memory for compressed variants")
+    parser.add_argument("--metrics-path", default="/metrics", help="where to serve metrics, empty to turn it off")
 
-#close the client socket first and then the server socket
-client_socket.close()
-server_socket.close()
 
-print("The server has shutdown after handling the request from localhost")
+# HttpServer keyword arguments from the options add_server_arguments() defined
+def server_options(args):
+    return {
+        "keepalive_timeout": args.keepalive_timeout, "static_root": args.root,
+        "cache_bytes": int(args.cache_mb * 1024 * 1024), "cache_watch": args.cache_watch,
+        "compress": args.compress, "compress_min_size": args.compress_min_size,
+        "compress_cache_bytes": (int(args.compress_cache_mb * 1024 * 1024)
+                                 if args.compress_cache_mb is not None else None),
+        "max_connections": args.max_connections, "header_timeout": args.header_timeout,
+        "body_timeout": args.body_timeout, "write_timeout": args.write_timeout,
+        "stream_timeout": args.stream_timeout, "metrics_path": args.metrics_path or None,
+    }
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simple HTTP server for the CS372 lab")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG)
+    add_server_arguments(parser)
+    parser.add_argument("--quiet", action="store_true", help="do not print every request (use this for load tests)")
+    args = parser.parse_args()
 
+    server = HttpServer(args.host, args.port, args.backlog, log_requests=not args.quiet, **server_options(args))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    if server.response_cache is not None:
+        print(server.response_cache.summary())
+    if server.compressor is not None:
+        print(server.compressor.summary())
+    print("The server has shutdown")
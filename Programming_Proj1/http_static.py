@@ -0,0 +1,282 @@
+# static file mode for http_server.py
+# maps request paths onto a document root instead of always answering with the one hard coded html string
+# - file bodies are handed to the server as a FileBody, which it streams with os.sendfile so the bytes go from the
+#   page cache to the socket inside the kernel and never pass through python buffers
+# - Range: bytes=... requests get 206 Partial Content (one range per request, 416 when it is outside the file)
+# - every file has an ETag and Last-Modified, If-None-Match / If-Modified-Since that still match give 304 Not Modified
+# - paths are normalised and have to stay inside the document root (no ../ escapes)
+# - with a Compressor (http_compression.py) text files are sent gzip/deflate encoded to clients that accept it
+#
+# run this file directly for a large file download benchmark against raw loopback bandwidth
+
+import mimetypes
+import os
+import posixpath
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
+
+INDEX_FILE = "index.html"
+
+
+class FileBody:
+    # `length` bytes of an open file starting at `offset`, the server sends it with os.sendfile and closes the file
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class StaticResponse:
+    def __init__(self, status, headers, body=b'', source=None):
+        self.status = status
+        self.headers = headers              # [(name, value)], Content-Length/Connection are added by the server
+        self.body = body                    # bytes or FileBody
+        self.source = source                # (path, os.stat result) of the file the body was made from
+
+
+class FileInfo:
+    # what we need to know about a file to answer a request for it
+    def __init__(self, path, stat_result):
+        self.path = path
+        self.stat = stat_result
+        self.size = stat_result.st_size
+        self.mtime = stat_result.st_mtime
+        self.inode = stat_result.st_ino
+        # changes whenever the file is rewritten (new mtime) or replaced (new inode) or resized
+        self.etag = f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        content_type, encoding = mimetypes.guess_type(path)
+        if content_type is None:
+            content_type = "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+            content_type += "; charset=UTF-8"
+        self.content_type = content_type
+
+
+# parses a single "bytes=start-end" range against a file of `size` bytes
+# returns (start, end inclusive), None to ignore the header (serve the whole file) or "unsatisfiable"
+def parse_range(header, size):
+    unit, sep, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not sep or "," in spec:
+        # other units and multi-range requests are allowed to be answered with the full file
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first == "":
+            # suffix range: the last N bytes
+            suffix = int(last)
+            if suffix <= 0:
+                return "unsatisfiable"
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+class StaticFiles:
+    def __init__(self, root, compressor=None):
+        self.root = os.path.realpath(root)
+        self.compressor = compressor
+
+    # request path -> file system path inside the root, None when it points outside of it or is no valid path
+    def resolve(self, request_path):
+        path = unquote(request_path.split("?", 1)[0].split("#", 1)[0])
+        path = posixpath.normpath("/" + path.lstrip("/"))
+        try:
+            full_path = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        except (OSError, ValueError):
+            # ValueError: an escaped NUL (/%00) the OS cannot take in a path
+            return None
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            return None
+        if os.path.isdir(full_path):
+            full_path = os.path.join(full_path, INDEX_FILE)
+        return full_path
+
+    def stat(self, request_path):
+        full_path = self.resolve(request_path)
+        if full_path is None:
+            return None
+        try:
+            stat_result = os.stat(full_path)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(full_path):
+            return None
+        return FileInfo(full_path, stat_result)
+
+    # True when the client's cached copy is still current (RFC 9110: If-None-Match wins over If-Modified-Since)
+    @staticmethod
+    def not_modified(request, info, etag):
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            # W/ prefixed tags compare weakly, which is what GET conditionals use
+            return "*" in tags or etag in tags or ("W/" + etag) in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return int(info.mtime) <= since
+        return False
+
+    # If-Range: only honour Range when the client's validator still matches the file
+    @staticmethod
+    def range_allowed(request, info):
+        if_range = request.headers.get("if-range")
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == info.etag
+        return if_range == info.last_modified
+
+    def validators(self, info, etag):
+        headers = [("ETag", etag), ("Last-Modified", info.last_modified), ("Accept-Ranges", "bytes")]
+        if self.compressor is not None and self.compressor.varies(info):
+            headers.append(("Vary", "Accept-Encoding"))
+        return headers
+
+    def respond(self, request):
+        if request.method not in ("GET", "HEAD"):
+            return StaticResponse(405, [("Allow", "GET, HEAD"), ("Content-Type", "text/plain")],
+                                  b"405 Method Not Allowed\r\n")
+
+        info = self.stat(request.path)
+        if info is None:
+            return StaticResponse(404, [("Content-Type", "text/plain")], b"404 Not Found\r\n")
+
+        variant = self.compressor.negotiate(request, info) if self.compressor is not None else None
+        etag = variant.etag if variant is not None else info.etag
+        if self.not_modified(request, info, etag):
+            return StaticResponse(304, self.validators(info, etag))
+
+        headers = [("Content-Type", info.content_type)] + self.validators(info, etag)
+        if variant is not None:
+            return self.respond_encoded(request, info, variant, headers)
+
+        start, end = 0, info.size - 1
+        status = 200
+
+        range_header = request.headers.get("range")
+        if range_header is not None and self.range_allowed(request, info):
+            byte_range = parse_range(range_header, info.size)
+            if byte_range == "unsatisfiable":
+                return StaticResponse(416, [("Content-Range", f"bytes */{info.size}")] + self.validators(info, etag))
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                headers.append(("Content-Range", f"bytes {start}-{end}/{info.size}"))
+
+        length = end - start + 1
+        if request.method == "HEAD" or length <= 0:
+            # HEAD only needs the length, the server sends the headers and no body
+            return StaticResponse(status, headers, FileBody(None, start, length) if length > 0 else b'')
+        try:
+            file = open(info.path, "rb")
+        except OSError:
+            return StaticResponse(404, [("Content-Type", "text/plain")], b"404 Not Found\r\n")
+        return StaticResponse(status, headers, FileBody(file, start, length), (info.path, info.stat))
+
+    # 200 with a gzip/deflate body (the compressor never picks a variant for Range requests)
+    def respond_encoded(self, request, info, variant, headers):
+        headers.append(("Content-Encoding", variant.encoding))
+        try:
+            body = self.compressor.body(variant, info)
+        except OSError:
+            return StaticResponse(404, [("Content-Type", "text/plain")], b"404 Not Found\r\n")
+        if variant.sibling_path is not None:
+            source = (variant.sibling_path, variant.sibling_stat)
+        else:
+            source = (info.path, info.stat)
+        if request.method == "HEAD" and isinstance(body, FileBody):
+            body.close()
+            body = FileBody(None, 0, len(body))
+        return StaticResponse(200, headers, body, source)
+
+
+if __name__ == "__main__":
+    import argparse
+    import socket
+    import tempfile
+    import threading
+    import time
+
+    from http_server import HttpServer
+
+    parser = argparse.ArgumentParser(description="Large file download benchmark for the static file mode")
+    parser.add_argument("--size-mb", type=int, default=256)
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    def download(port, request):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(request)
+        buffer = bytearray(1024 * 1024)
+        view = memoryview(buffer)
+        received = 0
+        start = time.perf_counter()
+        while True:
+            n = sock.recv_into(view)
+            if not n:
+                break
+            received += n
+        elapsed = time.perf_counter() - start
+        sock.close()
+        return received, elapsed
+
+    # raw loopback: a thread that pushes the same number of bytes through a plain socket, as fast as python can
+    def raw_loopback():
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        chunk = bytes(1024 * 1024)
+
+        def push():
+            conn, addr = listener.accept()
+            conn.recv(1024)
+            sent = 0
+            while sent < size:
+                conn.sendall(chunk)
+                sent += len(chunk)
+            conn.close()
+
+        threading.Thread(target=push, daemon=True).start()
+        result = download(listener.getsockname()[1], b"go")
+        listener.close()
+        return result
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, "big.bin"), "wb") as f:
+            block = os.urandom(1024 * 1024)
+            for i in range(args.size_mb):
+                f.write(block)
+
+        server = HttpServer("127.0.0.1", 0, log_requests=False, static_root=root)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        received, elapsed = raw_loopback()
+        print(f"raw loopback socket:     {received / elapsed / 1e6:8.1f} MB/s")
+        request = b"GET /big.bin HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n"
+        received, elapsed = download(server.port, request)
+        print(f"static file (sendfile):  {received / elapsed / 1e6:8.1f} MB/s  ({received} bytes incl. headers)")
+        server.stop(0)
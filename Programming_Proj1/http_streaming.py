@@ -0,0 +1,285 @@
+# streaming response bodies for http_server.py
+# a handler normally returns the whole body as bytes, which means a big generated report sits in memory in full
+# and the client sees nothing until the last byte is built. a handler can instead return
+# - a generator that yields bytes (or str) pieces, or
+# - an async generator, which can await things (asyncio.sleep, queues, other I/O) between pieces
+# and the server sends it with Transfer-Encoding: chunked (HTTP/1.0 clients get the raw bytes and a close).
+# the next piece is only asked for once the pieces before it are in the socket buffer, so a slow client
+# slows the generator down instead of piling data up in memory (backpressure from socket writability).
+#
+# async generators run on one asyncio loop in a helper thread, the finished piece comes back to the selector
+# loop through a socketpair so the server thread never blocks on them
+#
+# run this file directly for a demo server and a time-to-first-byte / memory comparison against a buffered body
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+# a sync generator is advanced until this many bytes are queued, then the socket gets a chance to drain them.
+# the pieces of one batch go out as a single chunk, a generator that yields one short line at a time would
+# otherwise cost a chunk header and three buffers per line
+STREAM_BATCH = 64 * 1024
+
+LAST_CHUNK = b"0\r\n\r\n"
+
+
+# `data` as one chunk of a chunked body, three pieces so the data itself is not copied
+def frame_chunk(data):
+    return [f"{len(data):x}\r\n".encode(), data, b"\r\n"]
+
+
+class StreamBody:
+    # a generator or async generator that produces the body of one response
+    def __init__(self, iterator, chunked=True, runner=None):
+        self.iterator = iterator
+        self.is_async = hasattr(iterator, "__anext__")
+        self.chunked = chunked              # False for HTTP/1.0: raw bytes, the end of the body is the close
+        self.runner = runner                # AsyncRunner for async generators
+        self.future = None                  # the async piece being produced right now
+        self.requested_at = None            # time.monotonic() the server asked for it, for the stream timeout
+        self.finished = False
+
+    # streams have no length up front, that is the point of them
+    def __len__(self):
+        return 0
+
+    def waiting(self):
+        return self.future is not None
+
+    # takes pieces from a sync generator, returns ([buffers], byte count), sets `finished` at the end
+    def pull(self, limit=STREAM_BATCH):
+        pieces = []
+        total = 0
+        while total < limit:
+            try:
+                data = next(self.iterator)
+            except StopIteration:
+                self.finished = True
+                break
+            if isinstance(data, str):
+                data = data.encode()
+            pieces.append(data)
+            total += len(data)
+        buffers = []
+        size = self.add(buffers, pieces[0] if len(pieces) == 1 else b"".join(pieces))
+        if self.finished and self.chunked:
+            buffers.append(LAST_CHUNK)
+            size += len(LAST_CHUNK)
+        return buffers, size
+
+    # adds one piece to `buffers` in the right framing, returns its size on the wire
+    def add(self, buffers, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if not data:
+            # an empty chunk would end a chunked body early
+            return 0
+        if not self.chunked:
+            buffers.append(data)
+            return len(data)
+        pieces = frame_chunk(data)
+        buffers.extend(pieces)
+        return len(pieces[0]) + len(data) + 2
+
+    # asks the async generator for its next piece, `on_done()` is called from the runner thread when it is ready
+    def request_next(self, on_done):
+        self.requested_at = time.monotonic()
+        self.future = self.runner.submit(self.iterator)
+        self.future.add_done_callback(lambda future: on_done())
+
+    # result of the finished async piece in the same form as pull()
+    # exceptions raised by the generator are passed on
+    def take_result(self):
+        future, self.future = self.future, None
+        buffers = []
+        size = 0
+        try:
+            size = self.add(buffers, future.result())
+        except StopAsyncIteration:
+            self.finished = True
+            if self.chunked:
+                buffers.append(LAST_CHUNK)
+                size += len(LAST_CHUNK)
+        return buffers, size
+
+    def close(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self.is_async:
+            if self.future is not None:
+                # a generator stuck on an await (the stream timed out) gets a CancelledError there
+                self.future.cancel()
+            if self.runner is not None:
+                self.runner.close_generator(self.iterator)
+        else:
+            self.iterator.close()
+
+
+class AsyncRunner:
+    # an asyncio loop in a daemon thread that advances async generators one piece at a time
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    async def _next(generator):
+        return await generator.__anext__()
+
+    # concurrent.futures.Future with the next piece (or StopAsyncIteration)
+    def submit(self, generator):
+        return asyncio.run_coroutine_threadsafe(self._next(generator), self.loop)
+
+    def close_generator(self, generator):
+        asyncio.run_coroutine_threadsafe(generator.aclose(), self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1.0)
+
+
+class Wakeup:
+    # lets other threads interrupt selector.select(): they queue a connection and write a byte
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        self.ready = deque()                # deque.append/popleft are thread safe
+
+    def notify(self, item):
+        self.ready.append(item)
+        try:
+            self.writer.send(b"x")
+        except (BlockingIOError, InterruptedError):
+            # the reader already has unread bytes, the loop will wake up anyway
+            pass
+
+    def drain(self):
+        try:
+            while self.reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import tracemalloc
+
+    from http_server import HttpServer
+
+    class DemoServer(HttpServer):
+        # /report?rows=N  big generated table, streamed from a generator or (with &buffered) built in memory
+        # /tail           an async generator that sends one line every 0.2 seconds
+        # /stuck          an async generator that sends one line and then never another
+        def handle_request(self, request):
+            path, sep, query = request.path.partition("?")
+            params = dict(part.partition("=")[::2] for part in query.split("&") if part)
+            if path == "/report":
+                rows = int(params.get("rows", "100000"))
+                if "buffered" in params:
+                    body = "".join(f"{i},packet-{i},{i * 1500}\n" for i in range(rows)).encode()
+                    return 200, [("Content-Type", "text/csv")], body
+                return 200, [("Content-Type", "text/csv")], (f"{i},packet-{i},{i * 1500}\n" for i in range(rows))
+            if path == "/tail":
+                async def tail():
+                    for i in range(int(params.get("lines", "5"))):
+                        await asyncio.sleep(0.2)
+                        yield f"log line {i}\n"
+                return 200, [("Content-Type", "text/plain")], tail()
+            if path == "/stuck":
+                async def stuck():
+                    yield "waiting for an event that never comes\n"
+                    await asyncio.Event().wait()
+                    yield "unreachable\n"
+                return 200, [("Content-Type", "text/plain")], stuck()
+            return super().handle_request(request)
+
+    parser = argparse.ArgumentParser(description="Streaming response demo for http_server.py")
+    parser.add_argument("--rows", type=int, default=300000)
+    args = parser.parse_args()
+
+    server = DemoServer("127.0.0.1", 0, log_requests=False, stream_timeout=1.0)
+    server.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # reads a whole response, returns (time to first body byte, total time, body bytes on the wire)
+    def fetch(path):
+        start = time.perf_counter()
+        sock = socket.create_connection(("127.0.0.1", server.port))
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+        buffer = bytearray(256 * 1024)
+        first = None
+        received = 0
+        while True:
+            n = sock.recv_into(buffer)
+            if not n:
+                break
+            if first is None:
+                first = time.perf_counter() - start
+            received += n
+        sock.close()
+        return first, time.perf_counter() - start, received
+
+    for label, path in (("streamed", f"/report?rows={args.rows}"), ("buffered", f"/report?rows={args.rows}&buffered")):
+        first, total, received = fetch(path)
+        # second run with tracemalloc on for the memory number, it slows every allocation down too much for timing
+        tracemalloc.start()
+        fetch(path)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label}: first byte {first * 1000:8.2f} ms  total {total * 1000:8.1f} ms  "
+              f"{received} bytes  peak python memory {peak / 1024:8.0f} KB")
+
+    print("async generator, one line every 0.2 s:")
+    sock = socket.create_connection(("127.0.0.1", server.port))
+    sock.sendall(b"GET /tail?lines=5 HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+    start = time.perf_counter()
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            break
+        sys.stdout.write(f"  +{(time.perf_counter() - start) * 1000:6.0f} ms {data!r}\n")
+    sock.close()
+
+    # HTTP/1.0 gets the async stream unchunked, the end of the body is the close. the server has to survive the
+    # stream finishing with nothing left to send and still answer the next request
+    for version in ("HTTP/1.0", "HTTP/1.1"):
+        sock = socket.create_connection(("127.0.0.1", server.port))
+        sock.settimeout(5)
+        sock.sendall(f"GET /tail?lines=2 {version}\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+        response = b""
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+        sock.close()
+        assert response.startswith(b"HTTP/1.1 200") and b"log line 1" in response, response
+        print(f"async generator over {version}: {len(response)} bytes, connection closed cleanly")
+
+    # a stuck generator is cut off by the stream timeout: the body ends without the last chunk
+    sock = socket.create_connection(("127.0.0.1", server.port))
+    sock.settimeout(10)
+    sock.sendall(b"GET /stuck HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+    start = time.perf_counter()
+    response = b""
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            break
+        response += data
+    sock.close()
+    assert b"waiting for an event" in response and not response.endswith(LAST_CHUNK), response
+    print(f"stuck async generator: connection closed after {time.perf_counter() - start:.2f} s "
+          f"(stream timeout {server.stream_timeout} s), {server.timed_out_connections} timed out")
+    server.stop(0)
@@ -0,0 +1,58 @@
+# hashed timer wheel for the connection deadlines in http_server.py
+# every connection always has one deadline (idle keep-alive, header read, body read or write) and it moves on
+# every read and write. a heap would need a push per change and a full scan gets slow with thousands of
+# connections, so deadlines are rounded to TICK and dropped into one of SLOTS buckets instead:
+# - schedule() and cancel() are O(1) set operations
+# - advance() only looks at the buckets whose time has come
+# - a deadline further away than SLOTS * TICK simply comes around early, the caller checks the real deadline
+#   of everything advance() hands back and schedules it again if it is not due yet
+
+import math
+
+TICK = 0.25
+SLOTS = 512
+
+
+class TimerWheel:
+    def __init__(self, now, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        self.slots = [set() for i in range(slots)]
+        self.current = int(now / tick)      # next tick to fire
+        self.where = {}                     # {item: slot index it is in}
+
+    def __len__(self):
+        return len(self.where)
+
+    def schedule(self, item, deadline):
+        # never put anything into a tick that already fired, it would wait a whole turn
+        tick = max(math.ceil(deadline / self.tick), self.current)
+        index = tick % len(self.slots)
+        old = self.where.get(item)
+        if old == index:
+            return
+        if old is not None:
+            self.slots[old].discard(item)
+        self.slots[index].add(item)
+        self.where[item] = index
+
+    def cancel(self, item):
+        index = self.where.pop(item, None)
+        if index is not None:
+            self.slots[index].discard(item)
+
+    # items whose tick is at or before `now`, they are no longer scheduled when they come back
+    def advance(self, now):
+        expired = []
+        end = int(now / self.tick)
+        # after a long stall every slot is due, no need to go round more than once
+        steps = min(end - self.current + 1, len(self.slots))
+        for i in range(max(steps, 0)):
+            index = (self.current + i) % len(self.slots)
+            if self.slots[index]:
+                for item in self.slots[index]:
+                    del self.where[item]
+                expired.extend(self.slots[index])
+                self.slots[index] = set()
+        if end + 1 > self.current:
+            self.current = end + 1
+        return expired
@@ -0,0 +1,168 @@
+# per-phase timing of client requests
+# when a fetch is slow the total alone does not say why. every request made through http_client_lib.connect /
+# read_response (and so HttpClient and AsyncFetcher) can carry a RequestTiming that gets a time.perf_counter()
+# stamp (monotonic, sub-microsecond) at each step:
+#   start       the request begins (for HttpClient: once it has a connection slot)
+#   resolved    the host name is an address
+#   connected   the TCP handshake is done (resolved == connected == start on a reused keep-alive connection)
+#   send_start  the first request byte goes to the kernel
+#   sent        the last request byte went to the kernel
+#   first_byte  the first response byte is in
+#   last_byte   the last response byte is in
+# and the phases between them:
+#   resolve  DNS            connect  TCP handshake    send     writing the request
+#   wait     server think time + one round trip       receive  transfer of the response    total  all of it
+#
+# a timing is seven float attributes and seven clock reads, with the histogram update a few microseconds per
+# request, so it is always on. TimingHistograms adds them up in the fixed-bucket histograms of http_metrics.py
+#
+# run this file directly to measure the overhead and see the histograms for a batch of requests
+
+from time import perf_counter as clock
+
+from http_metrics import Histogram
+
+PHASES = ("resolve", "connect", "send", "wait", "receive", "total")
+
+
+class RequestTiming:
+    __slots__ = ("start", "resolved", "connected", "send_start", "sent", "first_byte", "last_byte", "reused")
+
+    def __init__(self):
+        self.start = clock()
+        self.resolved = None
+        self.connected = None
+        self.send_start = None
+        self.sent = None
+        self.first_byte = None
+        self.last_byte = None
+        self.reused = False
+
+    # the request goes out on a connection that is already open, there is nothing to resolve or connect
+    def reuse(self):
+        self.resolved = self.connected = self.start
+        self.reused = True
+
+    # {phase: seconds}, None for phases that never finished (a failed request)
+    def phases(self):
+        def between(a, b):
+            return b - a if a is not None and b is not None else None
+
+        return {
+            "resolve": between(self.start, self.resolved),
+            "connect": between(self.resolved, self.connected),
+            "send": between(self.send_start, self.sent),
+            "wait": between(self.sent, self.first_byte),
+            "receive": between(self.first_byte, self.last_byte),
+            "total": between(self.start, self.last_byte),
+        }
+
+    def __repr__(self):
+        parts = [f"{phase}={value * 1000:.3f}ms" for phase, value in self.phases().items() if value is not None]
+        return f"RequestTiming({', '.join(parts)}{', reused' if self.reused else ''})"
+
+
+class TimingHistograms:
+    def __init__(self):
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.resolve, self.connect, self.send, self.wait, self.receive, self.total = self.phases.values()
+        self.requests = 0
+        self.reused = 0
+
+    # called for every request, so no phases() dict here
+    def add(self, timing):
+        self.requests += 1
+        if timing.reused:
+            self.reused += 1
+        observe = self._observe
+        observe(self.resolve, timing.start, timing.resolved)
+        observe(self.connect, timing.resolved, timing.connected)
+        observe(self.send, timing.send_start, timing.sent)
+        observe(self.wait, timing.sent, timing.first_byte)
+        observe(self.receive, timing.first_byte, timing.last_byte)
+        observe(self.total, timing.start, timing.last_byte)
+
+    @staticmethod
+    def _observe(histogram, a, b):
+        if a is not None and b is not None:
+            histogram.observe(b - a)
+
+    # one line per phase: count, mean and bucket upper bounds for p50/p99
+    def summary(self):
+        lines = [f"{self.requests} requests, {self.reused} on reused connections"]
+        lines.append(f"{'phase':<8} {'count':>7} {'mean ms':>9} {'p50 <= ms':>10} {'p99 <= ms':>10}")
+        for phase, histogram in self.phases.items():
+            if not histogram.count:
+                continue
+            lines.append(f"{phase:<8} {histogram.count:>7} {histogram.sum / histogram.count * 1000:>9.3f} "
+                         f"{histogram.quantile(0.5) * 1000:>10.3f} {histogram.quantile(0.99) * 1000:>10.3f}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import threading
+    import time
+
+    from http_client_lib import build_request, connect, read_response
+    from http_pool import HttpClient
+    from http_server import HttpServer
+
+    parser = argparse.ArgumentParser(description="Per-phase client timing: overhead and histograms")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--host", default=None, help="fetch from a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/")
+    args = parser.parse_args()
+
+    if args.host is None:
+        server = HttpServer("127.0.0.1", 0, log_requests=False)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.host, args.port = "127.0.0.1", server.port
+
+    # the bookkeeping alone: a timing with every stamp set, added to the histograms
+    histograms = TimingHistograms()
+    count = 100000
+    begin = time.perf_counter()
+    for i in range(count):
+        timing = RequestTiming()
+        timing.resolved = timing.connected = timing.send_start = timing.sent = timing.first_byte = clock()
+        timing.last_byte = clock()
+        histograms.add(timing)
+    overhead = (time.perf_counter() - begin) / count
+
+    # the same fresh-connection fetch with and without a timing, each twice so the first round is a warm-up
+    def fetch(timing):
+        sock = connect(args.host, args.port, timing=timing)
+        try:
+            if timing is not None:
+                timing.send_start = clock()
+            sock.sendall(build_request(args.host, args.path, keep_alive=False))
+            if timing is not None:
+                timing.sent = clock()
+            return read_response(sock, timing=timing)
+        finally:
+            sock.close()
+
+    fresh = TimingHistograms()
+    results = {}
+    for label in ("timed", "untimed", "timed", "untimed"):
+        begin = time.perf_counter()
+        for i in range(args.requests):
+            timing = RequestTiming() if label == "timed" else None
+            fetch(timing)
+            if timing is not None:
+                fresh.add(timing)
+        results[label] = (time.perf_counter() - begin) / args.requests
+
+    print(f"timing + histogram bookkeeping: {overhead * 1e6:.2f} us per request")
+    print(f"fresh connection fetch: {results['untimed'] * 1e6:.1f} us untimed, {results['timed'] * 1e6:.1f} us timed")
+    print("\nnew connection per request")
+    print(fresh.summary())
+
+    with HttpClient() as client:
+        for i in range(args.requests):
+            client.request("GET", args.host, args.port, args.path)
+        print("\nHttpClient keep-alive pool")
+        print(client.timings.summary())
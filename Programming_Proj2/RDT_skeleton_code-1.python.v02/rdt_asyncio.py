@@ -0,0 +1,189 @@
+import asyncio
+
+from rdt_layer import RDTLayer
+from rdt_mux import RDTMultiplexer
+from unreliable import UnreliableChannel
+
+
+# asyncio streams on top of the RDT layer
+# Description:
+# Instead of calling processData in a manual loop and polling getDataReceived, every RDT connection is exposed as an
+# awaitable reader/writer pair in the style of asyncio.StreamReader/StreamWriter.
+#   - Ticks: RDTAsyncDriver schedules the protocol iterations on the event loop and stops ticking when nothing is busy
+#   - Connections: each connection is one stream of an RDTMultiplexer pair, so thousands share one channel pair
+#   - Backpressure: write() waits while more than HIGH_WATER characters are unacknowledged
+#   - Reading: read() waits until new in-order data has been delivered by the layer
+
+
+class RDTStreamReader(object):
+    def __init__(self, driver, layer):
+        self.driver = driver
+        self.layer = layer
+        self.readOffset = 0                             # how much of the layer's in-order data was handed out already
+        self.waiter = None
+
+    # True when read() would return without waiting
+    def poll(self):
+        return len(self.layer.receivedDataInOrder) > self.readOffset
+
+    # return up to n characters (all available when n < 0), waiting until at least one has arrived
+    async def read(self, n=-1):
+        while not self.poll():
+            await self.driver.waitFor(self)
+
+        data = self.layer.receivedDataInOrder
+        end = len(data) if n < 0 else min(len(data), self.readOffset + n)
+        chunk = data[self.readOffset:end]
+        self.readOffset = end
+        return chunk
+
+    async def readexactly(self, n):
+        while len(self.layer.receivedDataInOrder) - self.readOffset < n:
+            await self.driver.waitFor(self)
+        return await self.read(n)
+
+
+class RDTStreamWriter(object):
+    # CLASS SCOPE VARIABLES
+    HIGH_WATER = RDTLayer.FLOW_CONTROL_WIN_SIZE * 4     # unacknowledged characters allowed before write() waits
+
+    def __init__(self, driver, layer):
+        self.driver = driver
+        self.layer = layer
+        self.waiter = None
+        self.highWater = self.HIGH_WATER
+        self.drainAll = False                           # drain() waits for everything, write() only for HIGH_WATER
+
+    def pendingChars(self):
+        return len(self.layer.dataToSend) - self.layer.sendBase
+
+    def poll(self):
+        if self.drainAll:
+            return self.pendingChars() == 0
+        return self.pendingChars() <= self.highWater
+
+    # queue data on the connection, waits while the connection has too much unacknowledged data
+    async def write(self, data):
+        while not self.poll():
+            await self.driver.waitFor(self)
+        self.layer.appendDataToSend(data)
+        self.driver.wakeUp()
+
+    # wait until every character written so far has been acknowledged by the other side
+    async def drain(self):
+        self.drainAll = True
+        try:
+            while not self.poll():
+                await self.driver.waitFor(self)
+        finally:
+            self.drainAll = False
+
+
+class RDTAsyncDriver(object):
+    # CLASS SCOPE VARIABLES
+    TICK_SECONDS = 0.0                                  # delay between protocol iterations, 0 = as fast as the loop allows
+
+    def __init__(self, clientToServerChannel=None, serverToClientChannel=None):
+        if clientToServerChannel is None:
+            clientToServerChannel = UnreliableChannel(False, False, False, False)
+        if serverToClientChannel is None:
+            serverToClientChannel = UnreliableChannel(False, False, False, False)
+        self.clientToServerChannel = clientToServerChannel
+        self.serverToClientChannel = serverToClientChannel
+
+        self.client = RDTMultiplexer()
+        self.server = RDTMultiplexer()
+        self.client.setSendChannel(clientToServerChannel)
+        self.client.setReceiveChannel(serverToClientChannel)
+        self.server.setSendChannel(serverToClientChannel)
+        self.server.setReceiveChannel(clientToServerChannel)
+
+        self.nextStreamId = 0
+        self.waiting = set()                            # readers/writers blocked on the protocol
+        self.tickHandle = None
+        self.currentIteration = 0
+
+    # returns ((clientReader, clientWriter), (serverReader, serverWriter)) for a new connection
+    def openConnection(self):
+        streamId = self.nextStreamId
+        self.nextStreamId += 1
+        clientLayer = self.client.openStream(streamId)
+        serverLayer = self.server.openStream(streamId)
+        endpoints = ((RDTStreamReader(self, clientLayer), RDTStreamWriter(self, clientLayer)),
+                     (RDTStreamReader(self, serverLayer), RDTStreamWriter(self, serverLayer)))
+        for reader, writer in endpoints:
+            reader.streamId = writer.streamId = streamId
+        return endpoints
+
+    # drop both ends of a connection, pass reader.streamId or writer.streamId
+    def closeConnection(self, streamId):
+        self.client.closeStream(streamId)
+        self.server.closeStream(streamId)
+
+    # park a reader/writer until a tick makes poll() true
+    async def waitFor(self, endpoint):
+        endpoint.waiter = asyncio.get_running_loop().create_future()
+        self.waiting.add(endpoint)
+        self.wakeUp()
+        try:
+            await endpoint.waiter
+        finally:
+            endpoint.waiter = None
+            self.waiting.discard(endpoint)
+
+    # make sure ticks are scheduled, called whenever new work shows up
+    def wakeUp(self):
+        if self.tickHandle is None:
+            self.tickHandle = asyncio.get_running_loop().call_later(self.TICK_SECONDS, self.tick)
+
+    # one protocol iteration in the same order as rdt_main
+    def tick(self):
+        self.tickHandle = None
+        self.currentIteration += 1
+        self.client.processData()
+        self.clientToServerChannel.processData()
+        self.server.processData()
+        self.serverToClientChannel.processData()
+
+        for endpoint in list(self.waiting):
+            if endpoint.poll() and not endpoint.waiter.done():
+                endpoint.waiter.set_result(None)
+                self.waiting.discard(endpoint)
+
+        if self.isBusy():
+            self.wakeUp()
+
+    # keep ticking while any stream had work or any segment is still inside a channel
+    def isBusy(self):
+        if self.client.countBusyStreams or self.server.countBusyStreams:
+            return True
+        for channel in (self.clientToServerChannel, self.serverToClientChannel):
+            if channel.sendQueue or channel.receiveQueue or channel.delayedPackets:
+                return True
+        return False
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # echo demo: every connection sends a line, the server side echoes it back, all on one thread
+    RDTLayer.VERBOSE = False
+    numConnections = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    async def echo(driver, index):
+        (clientReader, clientWriter), (serverReader, serverWriter) = driver.openConnection()
+        message = f"connection {index}: The quick brown fox jumped over the lazy dog\n"
+        await clientWriter.write(message)
+        await serverWriter.write(await serverReader.readexactly(len(message)))
+        reply = await clientReader.readexactly(len(message))
+        assert reply == message, (reply, message)
+
+    async def main():
+        driver = RDTAsyncDriver(UnreliableChannel(True, True, True, True), UnreliableChannel(True, True, True, True))
+        startTime = time.perf_counter()
+        await asyncio.gather(*(echo(driver, index) for index in range(numConnections)))
+        elapsed = time.perf_counter() - startTime
+        print(f"{numConnections} echo connections finished in {elapsed:.2f}s ({driver.currentIteration} iterations)")
+
+    asyncio.run(main())
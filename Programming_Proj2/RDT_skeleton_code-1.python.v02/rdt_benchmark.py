@@ -0,0 +1,262 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from rdt_layer import RDTLayer
+from segment import Segment
+from trace_channel import ReplayChannel, generateTrace
+
+
+# RDT benchmark suite
+# Description:
+# Measures the whole stack (Segment, RDTLayer, channel) instead of eyeballing TOTAL ITERATIONS from one interactive
+# run. Every case runs over replayed channel traces so the network is identical between runs and iteration counts
+# can be compared exactly; only the CPU based metrics carry noise.
+#   - Sweeps: payload size (44 characters up to 1M, bigger ones like 100M only with --large, they run for many
+#             minutes), loss profile and flow-control window size
+#   - Metrics: iterations, goodput per iteration and per CPU second, CPU time per segment, retransmissions,
+#              peak traced memory, and a Segment encode/decode microbenchmark (reported once, not per case)
+#   - Baselines: --save writes the results as JSON, --compare fails (exit code 1) when a metric regressed by more
+#                than the threshold (10% by default, per metric with --metric-threshold name=fraction).
+#                Only the deterministic metrics are gated by default; the CPU timing metrics vary by tens of percent
+#                between identical runs, they are gated only with --gate-timing, against --timing-threshold (50%)
+#
+# Usage: python rdt_benchmark.py --sizes 44,10K,1M --profiles clean,lossy --windows 15,30 --save baseline.json
+#        python rdt_benchmark.py --compare baseline.json
+#        python rdt_benchmark.py --compare baseline.json --gate-timing --repeats 5
+
+# channel flags (outOfOrder, dropPackets, delayPackets, dataErrors) for every loss profile
+PROFILES = {
+    "clean": (False, False, False, False),
+    "drop": (False, True, False, False),
+    "lossy": (True, True, True, True),
+}
+
+# True when a bigger number is better
+METRICS = {
+    "iterations": False,
+    "goodputCharsPerIteration": True,
+    "goodputCharsPerCpuSecond": True,
+    "cpuUsPerSegment": False,
+    "retransmissions": False,
+    "peakMemoryKB": False,
+    "segmentEncodeUs": False,
+    "segmentDecodeUs": False,
+}
+
+# metrics measured in CPU time, noisy even as best of several runs
+TIMING_METRICS = ("goodputCharsPerCpuSecond", "cpuUsPerSegment", "segmentEncodeUs", "segmentDecodeUs")
+
+# the Segment microbenchmark does not depend on the case, it is one entry of its own in the results
+MICROBENCHMARK = "segment-microbenchmark"
+
+LARGE_SIZE = 1000 * 1000                                # bigger payloads need --large
+
+TRACE_ITERATIONS = 5000                                 # traces repeat after this many iterations
+MIN_REPEATS = 3                                         # CPU metrics use the fastest of at least this many runs
+MIN_CPU_SECONDS = 0.2                                   # ...and keep repeating small cases until this much CPU was used
+TEXT = "The quick brown fox jumped over the lazy dog "
+
+
+# "44", "10K", "100M" -> number of characters
+def parseSize(text):
+    text = text.strip().upper()
+    multiplier = {"K": 1000, "M": 1000 * 1000}.get(text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    return int(text) * multiplier
+
+
+def makePayload(size):
+    return (TEXT * (size // len(TEXT) + 1))[:size]
+
+
+# one complete transfer, returns the iteration count plus channel and layer statistics
+def runTransfer(dataToSend, profile, window, traces):
+    flags = PROFILES[profile]
+    clientToServerChannel = ReplayChannel(traces[0], *flags, repeat=True)
+    serverToClientChannel = ReplayChannel(traces[1], *flags, repeat=True)
+
+    client = RDTLayer()
+    server = RDTLayer()
+    client.FLOW_CONTROL_WIN_SIZE = window
+    server.FLOW_CONTROL_WIN_SIZE = window
+    client.setSendChannel(clientToServerChannel)
+    client.setReceiveChannel(serverToClientChannel)
+    server.setSendChannel(serverToClientChannel)
+    server.setReceiveChannel(clientToServerChannel)
+    client.setDataToSend(dataToSend)
+
+    loopIter = 0
+    target = len(dataToSend)
+    while len(server.receivedDataInOrder) < target:
+        loopIter += 1
+        client.processData()
+        clientToServerChannel.processData()
+        server.processData()
+        serverToClientChannel.processData()
+
+    if server.getDataReceived() != dataToSend:
+        raise AssertionError("received data does not match what was sent ({0}/{1}/{2})".format(len(dataToSend), profile, window))
+
+    segments = clientToServerChannel.countTotalDataPackets + serverToClientChannel.countAckPackets
+    return loopIter, segments, client.countSegmentTimeouts
+
+
+# CPU time per segment built (setData computes the checksum) and per segment verified, best of `repeats`
+def segmentMicrobenchmark(count=20000, repeats=5):
+    chunk = TEXT[:RDTLayer.DATA_LENGTH]
+    encodeTime = decodeTime = float("inf")
+    for r in range(repeats):
+        segments = []
+        startTime = time.process_time()
+        for seqnum in range(count):
+            segment = Segment()
+            segment.setData(str(seqnum), chunk)
+            segments.append(segment)
+        encodeTime = min(encodeTime, time.process_time() - startTime)
+
+        startTime = time.process_time()
+        for segment in segments:
+            segment.checkChecksum()
+        decodeTime = min(decodeTime, time.process_time() - startTime)
+    return encodeTime / count * 1e6, decodeTime / count * 1e6
+
+
+def runCase(size, profile, window, seed, repeats):
+    dataToSend = makePayload(size)
+    traces = (generateTrace(seed, TRACE_ITERATIONS), generateTrace(seed + 1, TRACE_ITERATIONS))
+
+    # the traces make every run identical, so repeating only removes scheduling noise from the CPU time
+    cpuTime = float("inf")
+    totalCpu = 0.0
+    runs = 0
+    while runs < repeats or totalCpu < MIN_CPU_SECONDS:
+        startTime = time.process_time()
+        iterations, segments, retransmissions = runTransfer(dataToSend, profile, window, traces)
+        elapsed = time.process_time() - startTime
+        cpuTime = min(cpuTime, elapsed)
+        totalCpu += elapsed
+        runs += 1
+    cpuTime = max(cpuTime, 1e-9)
+
+    # separate run under tracemalloc so the tracing overhead does not pollute the CPU numbers
+    tracemalloc.start()
+    runTransfer(dataToSend, profile, window, traces)
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "goodputCharsPerIteration": size / iterations,
+        "goodputCharsPerCpuSecond": size / cpuTime,
+        "cpuUsPerSegment": cpuTime / max(segments, 1) * 1e6,
+        "retransmissions": retransmissions,
+        "peakMemoryKB": peakMemory / 1024,
+    }
+
+
+def runSuite(sizes, profiles, windows, seed, repeats=MIN_REPEATS):
+    encodeUs, decodeUs = segmentMicrobenchmark(repeats=max(repeats, 5))
+    results = {MICROBENCHMARK: {"segmentEncodeUs": encodeUs, "segmentDecodeUs": decodeUs}}
+    print("{0:<40} encode={1:.2f} us  verify={2:.2f} us per segment".format(MICROBENCHMARK, encodeUs, decodeUs))
+    for size in sizes:
+        for profile in profiles:
+            for window in windows:
+                name = "size={0}/profile={1}/window={2}".format(size, profile, window)
+                results[name] = runCase(size, profile, window, seed, repeats)
+                print("{0:<40} iterations={1:<8} goodput={2:.2f} chars/iter  {3:.1f} us/segment  peak={4:.0f} KB".format(
+                    name, results[name]["iterations"], results[name]["goodputCharsPerIteration"],
+                    results[name]["cpuUsPerSegment"], results[name]["peakMemoryKB"]))
+    return results
+
+
+# list of regression messages, empty when everything is within its threshold. timing metrics only count with
+# gateTiming (or when they have their own entry in metricThresholds)
+def compareResults(results, baseline, threshold, metricThresholds, gateTiming=False, timingThreshold=0.50):
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, higherIsBetter in METRICS.items():
+            if metric in metricThresholds:
+                limit = metricThresholds[metric]
+            elif metric in TIMING_METRICS:
+                if not gateTiming:
+                    continue
+                limit = timingThreshold
+            else:
+                limit = threshold
+            old = baseline[name].get(metric)
+            new = metrics.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / abs(old)
+            worse = -change if higherIsBetter else change
+            if worse > limit:
+                regressions.append("{0} {1}: {2:.4g} -> {3:.4g} ({4:+.1%}, limit {5:.0%})".format(
+                    name, metric, old, new, change, limit))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the RDT layer")
+    parser.add_argument("--sizes", default="44,1K,10K", help="comma separated payload sizes, K/M suffixes allowed")
+    parser.add_argument("--profiles", default="clean,lossy", help="comma separated from: " + ", ".join(PROFILES))
+    parser.add_argument("--windows", default=str(RDTLayer.FLOW_CONTROL_WIN_SIZE), help="comma separated window sizes")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated channel traces")
+    parser.add_argument("--save", help="write the results to this JSON file (new baseline)")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--large", action="store_true", help="allow payload sizes above 1M (slow)")
+    parser.add_argument("--repeats", type=int, default=MIN_REPEATS, help="CPU metrics are the best of this many runs")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed regression of the deterministic metrics as a fraction")
+    parser.add_argument("--gate-timing", action="store_true", help="also fail on regressions of the CPU timing metrics")
+    parser.add_argument("--timing-threshold", type=float, default=0.50,
+                        help="allowed regression of the CPU timing metrics with --gate-timing")
+    parser.add_argument("--metric-threshold", action="append", default=[], metavar="METRIC=FRACTION",
+                        help="override the threshold for one metric, can be repeated")
+    args = parser.parse_args(argv)
+
+    RDTLayer.VERBOSE = False
+    sizes = [parseSize(size) for size in args.sizes.split(",")]
+    if not args.large and max(sizes) > LARGE_SIZE:
+        parser.error("sizes above 1M take many minutes per case, pass --large to run them")
+    profiles = [profile.strip() for profile in args.profiles.split(",")]
+    for profile in profiles:
+        if profile not in PROFILES:
+            parser.error("unknown profile {0!r}".format(profile))
+    windows = [int(window) for window in args.windows.split(",")]
+
+    metricThresholds = {}
+    for item in args.metric_threshold:
+        metric, _, value = item.partition("=")
+        if metric not in METRICS:
+            parser.error("unknown metric {0!r}".format(metric))
+        metricThresholds[metric] = float(value)
+
+    results = runSuite(sizes, profiles, windows, args.seed, repeats=args.repeats)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Saved results to {0}".format(args.save))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compareResults(results, baseline, args.threshold, metricThresholds, args.gate_timing,
+                                     args.timing_threshold)
+        if regressions:
+            print("REGRESSIONS against {0}:".format(args.compare))
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("No regressions against {0}".format(args.compare))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,6 +15,7 @@ class RDTLayer(object):
     DATA_LENGTH = 4 # in characters                     # string data that is sent per packet
     FLOW_CONTROL_WIN_SIZE = 15 # in characters          # Max window size for flow-control
     TIMEOUT_ITERATIONS = 6                              # timeout threshold calculation explained in depth in report
+    VERBOSE = True                                      # per-segment trace output (turn off when running many layers)
 
 
     def __init__(self):
@@ -30,6 +31,7 @@ class RDTLayer(object):
         self.sentSegments = {}                          # {seqnum: (segment, send_time)}
         self.sndpkt = {}                                # buffed packets for retransmission
         self.lastSentTime = {}                          # Track when each segment was last sent
+        self.segmentEnds = {}                           # {seqnum: end of that segment's data} for sliding the window
         
         # Receiver state variables (Selective Repeat)
         self.rcvBase = 0                                # Start of receiving window in characters
@@ -43,6 +45,11 @@ class RDTLayer(object):
         self.duplicateAcksReceived = 0
 
 
+    # trace output for the layer, silenced when VERBOSE is off so that many layers can run at once
+    def log(self, message):
+        if self.VERBOSE:
+            print(message)
+
     # Called by main to set the unreliable sending lower-layer channel                                                 
     def setSendChannel(self, channel):
         self.sendChannel = channel
@@ -55,6 +62,10 @@ class RDTLayer(object):
     def setDataToSend(self,data):
         self.dataToSend = data
 
+    # Called to queue more string data behind what was already given to the layer (streaming use)
+    def appendDataToSend(self, data):
+        self.dataToSend += data
+
     # Called by main to get the buffered string data in order                               
     def getDataReceived(self):
         return self.receivedDataInOrder
@@ -100,9 +111,10 @@ class RDTLayer(object):
             self.sndpkt[data_start] = data_chunk
             self.sentSegments[data_start] = (segment, self.currentIteration)
             self.lastSentTime[data_start] = self.currentIteration
+            self.segmentEnds[data_start] = data_end
 
             # send the created seg and print info to terminal
-            print(f"Sending NEW segment: seq={data_start}, data='{data_chunk}' [window: {self.sendBase}-{self.sendBase + self.FLOW_CONTROL_WIN_SIZE - 1}]")
+            self.log(f"Sending NEW segment: seq={data_start}, data='{data_chunk}' [window: {self.sendBase}-{self.sendBase + self.FLOW_CONTROL_WIN_SIZE - 1}]")
             self.sendChannel.send(segment)
             
             #increase iteration count at end of each segment
@@ -134,7 +146,7 @@ class RDTLayer(object):
                 self.lastSentTime[seqnum] = current_time
                 
                 #print error message for debugging
-                print(f"RETRANSMITTING segment: seq={seqnum} (timeout after {self.TIMEOUT_ITERATIONS} iterations)")
+                self.log(f"RETRANSMITTING segment: seq={seqnum} (timeout after {self.TIMEOUT_ITERATIONS} iterations)")
                 self.sendChannel.send(new_segment)
                 self.countSegmentTimeouts += 1
 
@@ -152,13 +164,13 @@ class RDTLayer(object):
         """Process received data segment and send ACK"""
         # verify checksum (data corruption)
         if not segment.checkChecksum():
-            print(f"CORRUPTED segment received: seq={segment.seqnum} (checksum failed)")
+            self.log(f"CORRUPTED segment received: seq={segment.seqnum} (checksum failed)")
             return  #ignore, timeout and retransmit
             
         seqnum = int(segment.seqnum)
         data = segment.payload
         
-        print(f"Received data segment: seq={seqnum}, data='{data}'")
+        self.log(f"Received data segment: seq={seqnum}, data='{data}'")
         
         # always ACK (even duplicates)
         self.sendAckForSegment(seqnum)
@@ -168,13 +180,13 @@ class RDTLayer(object):
             
             #check duplicates
             if seqnum in self.receivedSegments:
-                print(f"Duplicate segment received: seq={seqnum}")
+                self.log(f"Duplicate segment received: seq={seqnum}")
                 self.duplicateDataReceived += 1
                 return 
             
             # buffer the segment
             self.receivedSegments[seqnum] = data
-            print(f"Buffered segment: seq={seqnum}")
+            self.log(f"Buffered segment: seq={seqnum}")
             
             # if a gap is filled at the base, deliver the following segments
             if seqnum == self.rcvBase:
@@ -182,18 +194,18 @@ class RDTLayer(object):
         
         else:
             # if the segment is outside of the window them send an ACK, but do not buffer
-            print(f"Segment outside window: seq={seqnum} (window: {self.rcvBase}-{self.rcvBase + self.FLOW_CONTROL_WIN_SIZE - 1})")
+            self.log(f"Segment outside window: seq={seqnum} (window: {self.rcvBase}-{self.rcvBase + self.FLOW_CONTROL_WIN_SIZE - 1})")
 
     def processAckSegment(self, segment):
         ack_seqnum = int(segment.acknum)
 
         # check if the new ACK is a duplicate
         if ack_seqnum not in self.sentSegments:
-            print(f"Received duplicate/late ACK: {ack_seqnum}")
+            self.log(f"Received duplicate/late ACK: {ack_seqnum}")
             self.duplicateAcksReceived += 1
             return
         
-        print(f"Received valid ACK: {ack_seqnum}")
+        self.log(f"Received valid ACK: {ack_seqnum}")
         
         # remove the ackd segment from the buffer list
         if ack_seqnum in self.sentSegments:
@@ -215,14 +227,14 @@ class RDTLayer(object):
             
             #if moving base print message
             if self.sendBase != old_base:
-                print(f"WINDOW ADVANCED: {old_base} -> {self.sendBase}")
+                self.log(f"WINDOW ADVANCED: {old_base} -> {self.sendBase}")
         
     def sendAckForSegment(self, seqnum):
         # Send new ACK for duplicates in case the network failed
         segmentAck = Segment()
         segmentAck.setAck(str(seqnum))
         
-        print(f"Sending ACK: {seqnum}")
+        self.log(f"Sending ACK: {seqnum}")
         self.sendChannel.send(segmentAck)
         
         self.lastAckSent[seqnum] = self.currentIteration
@@ -244,14 +256,18 @@ class RDTLayer(object):
             self.rcvBase += len(data)
             delivered_count += 1
             
-            print(f"DELIVERED segment: seq={old_base}, new rcvBase: {self.rcvBase}")
+            self.log(f"DELIVERED segment: seq={old_base}, new rcvBase: {self.rcvBase}")
         
         if delivered_count > 0:
-            print(f"Delivered {delivered_count} consecutive segments, total received: {len(self.receivedDataInOrder)} chars")
+            self.log(f"Delivered {delivered_count} consecutive segments, total received: {len(self.receivedDataInOrder)} chars")
 
     #find the beginning of the next segment
     def findNextSegmentBoundary(self, current_pos):
-       
+
+        # segments sent before more data was appended can be shorter than DATA_LENGTH, use where they really ended
+        if current_pos in self.segmentEnds:
+            return self.segmentEnds.pop(current_pos)
+
         if current_pos >= len(self.dataToSend):
             return len(self.dataToSend)
         
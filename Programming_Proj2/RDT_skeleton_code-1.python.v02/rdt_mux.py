@@ -0,0 +1,168 @@
+from collections import deque
+
+from rdt_layer import RDTLayer
+
+
+# Connection multiplexing for the RDT layer
+# Description:
+# Runs many independent RDTLayer streams over one UnreliableChannel pair instead of giving every transfer its own
+# pair of channels and its own processData loop.
+#   - Stream ids: every segment put on the shared channel is tagged with the id of the stream that produced it
+#   - Demultiplexing: incoming segments are handed to the stream with the matching id (new ids open a stream)
+#   - Fair scheduling: deficit round robin shares the send budget of each iteration between the busy streams
+#   - Idle streams: streams with nothing in flight and nothing received are not ticked at all
+
+
+class StreamChannel(object):
+    # virtual channel given to one stream's RDTLayer, the multiplexer moves segments between it and the real channel
+    def __init__(self):
+        self.sendQueue = deque()
+        self.receiveQueue = []
+
+    def send(self, seg):
+        self.sendQueue.append(seg)
+
+    def receive(self):
+        new_list = self.receiveQueue
+        self.receiveQueue = []
+        return new_list
+
+
+class RDTMultiplexer(object):
+    # CLASS SCOPE VARIABLES
+    QUANTUM = RDTLayer.DATA_LENGTH                      # credit (in characters) a busy stream earns per round
+    ACK_COST = 1                                        # an ACK has no payload but still costs a send opportunity
+    MAX_CHARS_PER_ITERATION = 4096                      # shared send budget of the channel per iteration
+
+
+    def __init__(self):
+        self.sendChannel = None
+        self.receiveChannel = None
+        self.currentIteration = 0
+
+        # stream state
+        self.streams = {}                               # {streamId: (layer, streamChannel)}
+        self.deficit = {}                               # {streamId: unused credit in characters}
+        self.activeStreams = deque()                    # streams with queued segments in round robin order
+        self.activeSet = set()                          # same ids as activeStreams for O(1) membership checks
+
+        # statistics
+        self.countSegmentsSent = 0
+        self.countSegmentsReceived = 0
+        self.countUntaggedSegments = 0
+        self.countBusyStreams = 0                       # streams that had work in the last iteration
+
+
+    # Called by main to set the shared unreliable sending lower-layer channel
+    def setSendChannel(self, channel):
+        self.sendChannel = channel
+
+    # Called by main to set the shared unreliable receiving lower-layer channel
+    def setReceiveChannel(self, channel):
+        self.receiveChannel = channel
+
+    # open a new logical stream, both sides must use the same id for the same transfer
+    def openStream(self, streamId, dataToSend=''):
+        if streamId in self.streams:
+            layer, channel = self.streams[streamId]
+        else:
+            layer = RDTLayer()
+            channel = StreamChannel()
+            layer.setSendChannel(channel)
+            layer.setReceiveChannel(channel)
+            self.streams[streamId] = (layer, channel)
+            self.deficit[streamId] = 0
+
+        if dataToSend:
+            layer.setDataToSend(dataToSend)
+        return layer
+
+    # forget a stream, anything still queued for it is discarded
+    def closeStream(self, streamId):
+        if streamId not in self.streams:
+            return
+        del self.streams[streamId]
+        del self.deficit[streamId]
+        if streamId in self.activeSet:
+            self.activeSet.discard(streamId)
+            self.activeStreams.remove(streamId)
+
+    def getStream(self, streamId):
+        return self.streams[streamId][0]
+
+    def getDataReceived(self, streamId):
+        return self.streams[streamId][0].getDataReceived()
+
+    # a stream is done sending once every character has been acknowledged
+    def isSendComplete(self, streamId):
+        layer = self.streams[streamId][0]
+        return layer.sendBase >= len(layer.dataToSend)
+
+    # one iteration: deliver what arrived, tick the streams that have work, then share the channel between them
+    def processData(self):
+        self.currentIteration += 1
+        self.demultiplex()
+
+        self.countBusyStreams = 0
+        for streamId, (layer, channel) in self.streams.items():
+            if not channel.receiveQueue and layer.sendBase >= len(layer.dataToSend):
+                continue
+            self.countBusyStreams += 1
+            layer.processData()
+            if channel.sendQueue and streamId not in self.activeSet:
+                self.activeSet.add(streamId)
+                self.activeStreams.append(streamId)
+
+        self.schedule()
+
+    # hand every incoming segment to the stream it is tagged with
+    def demultiplex(self):
+        for segment in self.receiveChannel.receive():
+            streamId = getattr(segment, 'streamId', None)
+            if streamId is None:
+                self.countUntaggedSegments += 1
+                continue
+
+            if streamId not in self.streams:
+                self.openStream(streamId)
+            self.streams[streamId][1].receiveQueue.append(segment)
+            self.countSegmentsReceived += 1
+
+    # deficit round robin: each visit a busy stream earns QUANTUM characters of credit and may send
+    # segments while its credit covers them, so a stream with a big backlog can not starve the rest
+    def schedule(self):
+        budget = self.MAX_CHARS_PER_ITERATION
+
+        while self.activeStreams and budget > 0:
+            streamId = self.activeStreams.popleft()
+            channel = self.streams[streamId][1]
+            queue = channel.sendQueue
+
+            if self.segmentCost(queue[0]) > budget:
+                # out of channel budget this iteration, this stream goes first next time
+                self.activeStreams.appendleft(streamId)
+                break
+
+            self.deficit[streamId] += self.QUANTUM
+            while queue:
+                cost = self.segmentCost(queue[0])
+                if cost > self.deficit[streamId] or cost > budget:
+                    break
+                segment = queue.popleft()
+                segment.streamId = streamId
+                self.sendChannel.send(segment)
+                self.deficit[streamId] -= cost
+                budget -= cost
+                self.countSegmentsSent += 1
+
+            if queue:
+                self.activeStreams.append(streamId)
+            else:
+                # an empty stream does not keep saving up credit
+                self.deficit[streamId] = 0
+                self.activeSet.discard(streamId)
+
+    def segmentCost(self, segment):
+        if segment.acknum != -1:
+            return self.ACK_COST
+        return max(len(segment.payload), self.ACK_COST)
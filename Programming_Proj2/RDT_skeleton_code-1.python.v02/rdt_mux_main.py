@@ -0,0 +1,65 @@
+import sys
+import time
+
+from rdt_layer import RDTLayer
+from rdt_mux import RDTMultiplexer
+from unreliable import UnreliableChannel
+
+# #################################################################################################################### #
+# Multiplexed Main                                                                                                     #
+#                                                                                                                      #
+# Runs many small transfers at once over ONE pair of unreliable channels using RDTMultiplexer.                         #
+# Usage: python rdt_mux_main.py [number of streams]                                                                    #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+numStreams = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+dataToSend = "The quick brown fox jumped over the lazy dog"
+
+# per-segment output from thousands of layers would swamp the terminal
+RDTLayer.VERBOSE = False
+
+outOfOrder = True
+dropPackets = True
+delayPackets = True
+dataErrors = True
+
+clientToServerChannel = UnreliableChannel(outOfOrder,dropPackets,delayPackets,dataErrors)
+serverToClientChannel = UnreliableChannel(outOfOrder,dropPackets,delayPackets,dataErrors)
+
+client = RDTMultiplexer()
+server = RDTMultiplexer()
+client.setSendChannel(clientToServerChannel)
+client.setReceiveChannel(serverToClientChannel)
+server.setSendChannel(serverToClientChannel)
+server.setReceiveChannel(clientToServerChannel)
+
+# every stream sends its own copy of the data tagged with its id so misdelivery would show up
+expected = {}
+for streamId in range(numStreams):
+    expected[streamId] = "{0}:{1}".format(streamId, dataToSend)
+    client.openStream(streamId, expected[streamId])
+
+startTime = time.perf_counter()
+remaining = set(expected)
+loopIter = 0
+while remaining:
+    loopIter += 1
+    client.processData()
+    clientToServerChannel.processData()
+    server.processData()
+    serverToClientChannel.processData()
+
+    for streamId in list(remaining):
+        if streamId in server.streams and server.getDataReceived(streamId) == expected[streamId]:
+            remaining.discard(streamId)
+
+elapsed = time.perf_counter() - startTime
+
+print('$$$$$$$$ ALL DATA RECEIVED ON {0} STREAMS $$$$$$$$'.format(numStreams))
+print("countSentPackets: {0}".format(clientToServerChannel.countSentPackets + serverToClientChannel.countSentPackets))
+print("countDroppedDataPackets: {0}".format(clientToServerChannel.countDroppedPackets))
+print("countDroppedAckPackets: {0}".format(serverToClientChannel.countDroppedPackets))
+print("# segment timeouts: {0}".format(sum(layer.countSegmentTimeouts for layer, channel in client.streams.values())))
+print("TOTAL ITERATIONS: {0}".format(loopIter))
+print("WALL TIME: {0:.2f}s".format(elapsed))
@@ -0,0 +1,229 @@
+import gzip
+import random
+
+from unreliable import UnreliableChannel
+
+
+# Replayable channel traces
+# Description:
+# UnreliableChannel rolls the global random module for every impairment, so two runs of the same RDT layer never see
+# the same network. These channels behave exactly like UnreliableChannel but take their decisions from a trace.
+#   - RecordingChannel: rolls the dice (optionally from its own seeded random.Random) and writes down every decision
+#   - ReplayChannel: reads the decisions back from a trace, iteration by iteration (optionally starting over at the end)
+#   - generateTrace: builds a trace from a seed without running any traffic, useful for a benchmark corpus
+#
+# Trace format (text, optionally gzip'd when the file name ends in .gz):
+#   line 1:  RDTTRACE 1
+#   line n:  one line per processData() call. First token is R when the send queue was reversed, - otherwise.
+#            Then one token per segment in send order: D delayed, X dropped, . delivered, optionally followed by
+#            c<index> when the payload was corrupted at that character index.
+# When a replayed protocol sends more segments in an iteration than the trace has tokens the extras are delivered, and
+# iterations past the end of the trace are clean, so traces can be shared between different versions of the protocol.
+
+TRACE_HEADER = "RDTTRACE 1"
+
+
+class TraceChannel(UnreliableChannel):
+    # same algorithm as UnreliableChannel.processData, the decisions come from the decide* methods
+
+    def processData(self):
+        self.currentIteration += 1
+        self.beginIteration()
+
+        if len(self.sendQueue) == 0:
+            self.endIteration()
+            return
+
+        if self.canDeliverOutOfOrder and self.decideReorder():
+            self.countOutOfOrderPackets += 1
+            self.sendQueue.reverse()
+
+        # add in delayed packets
+        noLongerDelayed = []
+        for seg in self.delayedPackets:
+            numIterDelayed = self.currentIteration - seg.getStartDelayIteration()
+            if numIterDelayed >= UnreliableChannel.ITERATIONS_TO_DELAY_PACKETS:
+                noLongerDelayed.append(seg)
+
+        for seg in noLongerDelayed:
+            self.countSentPackets += 1
+            self.delayedPackets.remove(seg)
+            self.receiveQueue.append(seg)
+
+        for seg in self.sendQueue:
+            self.beginSegment()
+            if self.canDelayPackets and self.decideDelay():
+                self.countDelayedPackets += 1
+                seg.setStartDelayIteration(self.currentIteration)
+                self.delayedPackets.append(seg)
+                continue
+
+            if self.canDropPackets and self.decideDrop():
+                self.countDroppedPackets += 1
+            else:
+                self.receiveQueue.append(seg)
+                self.countSentPackets += 1
+
+            if seg.acknum == -1:
+                self.countTotalDataPackets += 1
+
+                # only data packets can have checksum errors...
+                if self.canHaveChecksumErrors:
+                    index = self.decideCorrupt(seg)
+                    if index is not None and seg.payload:
+                        char = seg.payload[index % len(seg.payload)]
+                        seg.payload = seg.payload.replace(char, 'X', 1)
+                        self.countChecksumErrorPackets += 1
+            else:
+                self.countAckPackets += 1
+
+        self.sendQueue.clear()
+        self.endIteration()
+
+    def beginIteration(self):
+        pass
+
+    def endIteration(self):
+        pass
+
+    def beginSegment(self):
+        pass
+
+
+class RecordingChannel(TraceChannel):
+    def __init__(self, canDeliverOutOfOrder_, canDropPackets_, canDelayPackets_, canHaveChecksumErrors_, rng=None):
+        super().__init__(canDeliverOutOfOrder_, canDropPackets_, canDelayPackets_, canHaveChecksumErrors_)
+        self.rng = rng if rng is not None else random   # global random keeps the original behaviour
+        self.trace = []
+        self.tokens = None
+
+    def beginIteration(self):
+        self.tokens = ['-']
+
+    def endIteration(self):
+        self.trace.append(' '.join(self.tokens))
+
+    # every segment gets a token, delivered until a decision says otherwise
+    def beginSegment(self):
+        self.tokens.append('.')
+
+    def decideReorder(self):
+        if self.rng.random() <= UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS:
+            self.tokens[0] = 'R'
+            return True
+        return False
+
+    def decideDelay(self):
+        if self.rng.random() <= UnreliableChannel.RATIO_DELAYED_PACKETS:
+            self.tokens[-1] = 'D'
+            return True
+        return False
+
+    def decideDrop(self):
+        if self.rng.random() <= UnreliableChannel.RATIO_DROPPED_PACKETS:
+            self.tokens[-1] = 'X'
+            return True
+        return False
+
+    # the original picks a random character and replaces its first occurrence, record where that occurrence is
+    def decideCorrupt(self, seg):
+        if self.rng.random() > UnreliableChannel.RATIO_DATA_ERROR_PACKETS or not seg.payload:
+            return None
+        index = seg.payload.index(self.rng.choice(seg.payload))
+        self.tokens[-1] += 'c{0}'.format(index)
+        return index
+
+    def saveTrace(self, path):
+        saveTrace(path, self.trace)
+
+
+class ReplayChannel(TraceChannel):
+    def __init__(self, trace, canDeliverOutOfOrder_=True, canDropPackets_=True, canDelayPackets_=True,
+                 canHaveChecksumErrors_=True, repeat=False):
+        super().__init__(canDeliverOutOfOrder_, canDropPackets_, canDelayPackets_, canHaveChecksumErrors_)
+        self.trace = trace
+        self.repeat = repeat                            # wrap around instead of going clean after the last line
+        self.tokens = []
+        self.tokenIndex = 0
+        self.current = ''
+
+    @classmethod
+    def fromFile(cls, path, *flags):
+        return cls(loadTrace(path), *flags)
+
+    def beginIteration(self):
+        index = self.currentIteration - 1
+        if self.repeat and self.trace:
+            index %= len(self.trace)
+        self.tokens = self.trace[index].split() if index < len(self.trace) else ['-']
+        self.tokenIndex = 1
+
+    # every segment consumes one token, missing tokens mean a clean delivery
+    def beginSegment(self):
+        if self.tokenIndex < len(self.tokens):
+            self.current = self.tokens[self.tokenIndex]
+        else:
+            self.current = '.'
+        self.tokenIndex += 1
+
+    def decideReorder(self):
+        return self.tokens[0] == 'R'
+
+    def decideDelay(self):
+        return self.current[0] == 'D'
+
+    def decideDrop(self):
+        return self.current[0] == 'X'
+
+    def decideCorrupt(self, seg):
+        marker = self.current.find('c')
+        if marker == -1:
+            return None
+        return int(self.current[marker + 1:])
+
+
+def saveTrace(path, trace):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as f:
+        f.write(TRACE_HEADER + '\n')
+        for line in trace:
+            f.write(line + '\n')
+
+
+def loadTrace(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        header = f.readline().strip()
+        if header != TRACE_HEADER:
+            raise ValueError("{0} is not an RDT trace (header {1!r})".format(path, header))
+        return [line.strip() for line in f]
+
+
+# trace for `iterations` iterations with room for `segmentsPerIteration` segments each, built from a seed only
+def generateTrace(seed, iterations, segmentsPerIteration=16, payloadLength=4):
+    rng = random.Random(seed)
+    trace = []
+    for i in range(iterations):
+        tokens = ['R' if rng.random() <= UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS else '-']
+        for s in range(segmentsPerIteration):
+            if rng.random() <= UnreliableChannel.RATIO_DELAYED_PACKETS:
+                tokens.append('D')
+                continue
+            token = 'X' if rng.random() <= UnreliableChannel.RATIO_DROPPED_PACKETS else '.'
+            if rng.random() <= UnreliableChannel.RATIO_DATA_ERROR_PACKETS:
+                token += 'c{0}'.format(rng.randrange(payloadLength))
+            tokens.append(token)
+        trace.append(' '.join(tokens))
+    return trace
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python trace_channel.py <output file> <seed> [iterations]
+    if len(sys.argv) < 3:
+        print("usage: python trace_channel.py <output trace> <seed> [iterations]")
+        sys.exit(1)
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    saveTrace(sys.argv[1], generateTrace(int(sys.argv[2]), iterations))
+    print("wrote {0} iterations to {1}".format(iterations, sys.argv[1]))
@@ -0,0 +1,284 @@
+import argparse
+import heapq
+import random
+import socket
+import struct
+import time
+
+from rdt_layer import RDTLayer
+from segment import Segment
+
+
+# UDP transport for the RDT layer
+# Description:
+# UdpChannel has the same send/receive/processData interface as UnreliableChannel but carries the segments in real
+# UDP datagrams on 127.0.0.1, so the RDT layer can be measured (MB/s, latency) and used between local processes.
+#   - Non-blocking socket: receive() drains whatever datagrams are waiting and never blocks the protocol loop
+#   - Wire format: fixed header (seqnum, acknum, checksum, stream id) followed by the UTF-8 payload
+#   - Impairment: optional netem-style loss/delay/jitter/reorder/corruption applied in user space before sending
+#   - Wall-clock timers: WallClockRDTLayer maps real elapsed time onto currentIteration so timeouts are in seconds
+
+
+class UdpImpairment(object):
+    # netem style knobs, probabilities are 0.0 - 1.0 and times are in seconds
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, reorder=0.0, corrupt=0.0, rng=None):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder                          # chance that a packet skips the delay and overtakes the rest
+        self.corrupt = corrupt
+        self.rng = rng if rng is not None else random.Random()
+
+    # returns None for a dropped packet, otherwise how long to hold the packet back
+    def holdTime(self):
+        if self.loss and self.rng.random() < self.loss:
+            return None
+        if self.reorder and self.rng.random() < self.reorder:
+            return 0.0
+        hold = self.delay
+        if self.jitter:
+            hold += self.rng.uniform(-self.jitter, self.jitter)
+        return max(hold, 0.0)
+
+    def shouldCorrupt(self, segment):
+        return bool(self.corrupt and segment.payload and self.rng.random() < self.corrupt)
+
+
+class UdpChannel(object):
+    # CLASS SCOPE VARIABLES
+    HEADER = struct.Struct('!qqqq')                     # seqnum, acknum, checksum, stream id (-1 when untagged)
+    MAX_DATAGRAM = 65507                                # largest UDP payload over IPv4
+    HOST = "127.0.0.1"
+
+    def __init__(self, localPort=0, peerPort=None, impairment=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.HOST, localPort))
+        self.sock.setblocking(False)
+        self.localAddress = self.sock.getsockname()
+        self.peerAddress = (self.HOST, peerPort) if peerPort is not None else None   # learned from the first datagram otherwise
+        self.impairment = impairment
+        self.delayedPackets = []                        # heap of (release time, order, datagram)
+        self.delayOrder = 0
+        self.recvBuffer = bytearray(self.MAX_DATAGRAM)
+        self.recvView = memoryview(self.recvBuffer)
+
+        # stats (same names as UnreliableChannel where they mean the same thing)
+        self.countSentPackets = 0
+        self.countReceivedPackets = 0
+        self.countDroppedPackets = 0
+        self.countDelayedPackets = 0
+        self.countChecksumErrorPackets = 0
+        self.countSentBytes = 0
+        self.countReceivedBytes = 0
+
+    def setPeer(self, port):
+        self.peerAddress = (self.HOST, port)
+
+    def encode(self, seg):
+        streamId = getattr(seg, 'streamId', -1)
+        return self.HEADER.pack(int(seg.seqnum), int(seg.acknum), seg.checksum, streamId) + seg.payload.encode()
+
+    def decode(self, view):
+        seqnum, acknum, checksum, streamId = self.HEADER.unpack_from(view)
+        seg = Segment()
+        # the RDT layer builds segments with string sequence numbers, keep the same types on this side of the wire
+        seg.seqnum = str(seqnum) if seqnum != -1 else -1
+        seg.acknum = str(acknum) if acknum != -1 else -1
+        seg.payload = str(view[self.HEADER.size:], 'utf-8', 'replace')
+        seg.checksum = checksum
+        if streamId != -1:
+            seg.streamId = streamId
+        return seg
+
+    def send(self, seg):
+        if self.peerAddress is None:
+            # nobody has talked to us yet so there is nowhere to send, same as a drop
+            self.countDroppedPackets += 1
+            return
+
+        if self.impairment is None:
+            self.transmit(self.encode(seg))
+            return
+
+        hold = self.impairment.holdTime()
+        if hold is None:
+            self.countDroppedPackets += 1
+            return
+        if self.impairment.shouldCorrupt(seg):
+            # corrupt a copy so a segment the sender keeps for retransmission stays intact
+            corrupted = Segment()
+            corrupted.seqnum, corrupted.acknum, corrupted.checksum = seg.seqnum, seg.acknum, seg.checksum
+            corrupted.payload = seg.payload
+            if hasattr(seg, 'streamId'):
+                corrupted.streamId = seg.streamId
+            corrupted.createChecksumError()
+            seg = corrupted
+            self.countChecksumErrorPackets += 1
+        if hold <= 0.0:
+            self.transmit(self.encode(seg))
+            return
+
+        self.countDelayedPackets += 1
+        self.delayOrder += 1
+        heapq.heappush(self.delayedPackets, (time.monotonic() + hold, self.delayOrder, self.encode(seg)))
+
+    def transmit(self, datagram):
+        try:
+            self.sock.sendto(datagram, self.peerAddress)
+        except BlockingIOError:
+            # socket send buffer is full, UDP gives no guarantees so the RDT layer will retransmit it
+            self.countDroppedPackets += 1
+            return
+        self.countSentPackets += 1
+        self.countSentBytes += len(datagram)
+
+    def receive(self):
+        new_list = []
+        while True:
+            try:
+                nbytes, address = self.sock.recvfrom_into(self.recvBuffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionRefusedError:
+                # ICMP port unreachable from an earlier send, the peer is not up yet
+                continue
+
+            if self.peerAddress is None:
+                self.peerAddress = address
+            if nbytes < self.HEADER.size:
+                continue
+            self.countReceivedPackets += 1
+            self.countReceivedBytes += nbytes
+            new_list.append(self.decode(self.recvView[:nbytes]))
+        return new_list
+
+    # releases the delayed packets whose hold time is over, call once per loop like UnreliableChannel.processData
+    def processData(self):
+        now = time.monotonic()
+        while self.delayedPackets and self.delayedPackets[0][0] <= now:
+            releaseTime, order, datagram = heapq.heappop(self.delayedPackets)
+            self.transmit(datagram)
+
+    def close(self):
+        self.sock.close()
+
+
+class WallClockRDTLayer(RDTLayer):
+    # length of one protocol "iteration" in seconds, TIMEOUT_ITERATIONS ticks make up the retransmission timeout
+    TICK_SECONDS = 0.005
+
+    def __init__(self):
+        super().__init__()
+        self.startTime = time.monotonic()
+
+    # currentIteration follows the wall clock instead of the number of calls
+    def processData(self):
+        self.currentIteration = int((time.monotonic() - self.startTime) / self.TICK_SECONDS)
+        self.processSend()
+        self.processReceiveAndSendRespond()
+
+
+# transfers `size` characters between two RDT layers in this process over loopback UDP and reports the real rates
+def runLoopbackBenchmark(size, impairment=None, tickSeconds=WallClockRDTLayer.TICK_SECONDS):
+    RDTLayer.VERBOSE = False
+    WallClockRDTLayer.TICK_SECONDS = tickSeconds
+    dataToSend = ("The quick brown fox jumped over the lazy dog " * (size // 45 + 1))[:size]
+
+    clientChannel = UdpChannel(impairment=impairment)
+    serverChannel = UdpChannel(peerPort=clientChannel.localAddress[1], impairment=impairment)
+    clientChannel.setPeer(serverChannel.localAddress[1])
+
+    client = WallClockRDTLayer()
+    server = WallClockRDTLayer()
+    client.setSendChannel(clientChannel)
+    client.setReceiveChannel(clientChannel)
+    server.setSendChannel(serverChannel)
+    server.setReceiveChannel(serverChannel)
+    client.setDataToSend(dataToSend)
+
+    startTime = time.perf_counter()
+    loopIter = 0
+    while len(server.getDataReceived()) < len(dataToSend):
+        loopIter += 1
+        client.processData()
+        clientChannel.processData()
+        server.processData()
+        serverChannel.processData()
+    elapsed = time.perf_counter() - startTime
+
+    assert server.getDataReceived() == dataToSend
+    clientChannel.close()
+    serverChannel.close()
+
+    return {
+        "chars": size,
+        "seconds": elapsed,
+        "loops": loopIter,
+        "goodputMBps": size / elapsed / 1e6,
+        "wireMBps": (clientChannel.countSentBytes + serverChannel.countSentBytes) / elapsed / 1e6,
+        "datagramsSent": clientChannel.countSentPackets + serverChannel.countSentPackets,
+        "timeouts": client.countSegmentTimeouts,
+        # one segment = DATA_LENGTH chars, so this is the average time a segment needed to be delivered in order
+        "usPerSegment": elapsed / max(size / RDTLayer.DATA_LENGTH, 1) * 1e6,
+    }
+
+
+# one side of a transfer between two local processes: `recv` listens and prints what arrives, `send` sends a file
+def runEndpoint(mode, localPort, peerPort, path):
+    RDTLayer.VERBOSE = False
+    channel = UdpChannel(localPort, peerPort)
+    layer = WallClockRDTLayer()
+    layer.setSendChannel(channel)
+    layer.setReceiveChannel(channel)
+
+    if mode == "send":
+        with open(path, encoding="utf-8") as f:
+            layer.setDataToSend(f.read())
+        while layer.sendBase < len(layer.dataToSend):
+            layer.processData()
+            channel.processData()
+        print(f"Sent {len(layer.dataToSend)} characters to port {peerPort}")
+    else:
+        print(f"Listening on udp://{UdpChannel.HOST}:{channel.localAddress[1]}")
+        delivered = 0
+        try:
+            while True:
+                layer.processData()
+                channel.processData()
+                data = layer.getDataReceived()
+                if len(data) > delivered:
+                    print(data[delivered:], end="", flush=True)
+                    delivered = len(data)
+                time.sleep(0.0005)
+        except KeyboardInterrupt:
+            print(f"\nReceived {delivered} characters")
+    channel.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the RDT layer over loopback UDP")
+    parser.add_argument("mode", choices=["bench", "send", "recv"])
+    parser.add_argument("--size", type=int, default=100000, help="characters to transfer in bench mode")
+    parser.add_argument("--port", type=int, default=0, help="local UDP port")
+    parser.add_argument("--peer", type=int, default=None, help="peer UDP port")
+    parser.add_argument("--file", default=None, help="file to send in send mode")
+    parser.add_argument("--tick", type=float, default=WallClockRDTLayer.TICK_SECONDS, help="seconds per protocol tick")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--reorder", type=float, default=0.0)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    args = parser.parse_args()
+    if args.mode == "send" and args.peer is None:
+        # the sender speaks first, without a peer port it would retransmit into nothing forever
+        parser.error("send mode needs --peer, the UDP port the recv endpoint listens on")
+
+    if args.mode == "bench":
+        impairment = None
+        if args.loss or args.delay or args.jitter or args.reorder or args.corrupt:
+            impairment = UdpImpairment(args.loss, args.delay, args.jitter, args.reorder, args.corrupt)
+        for key, value in runLoopbackBenchmark(args.size, impairment, args.tick).items():
+            print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+    else:
+        WallClockRDTLayer.TICK_SECONDS = args.tick
+        runEndpoint(args.mode, args.port, args.peer, args.file)